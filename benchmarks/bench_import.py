@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Measures how long importing each floodsnet module takes in a fresh interpreter, and which heavy dependencies (ee,
+geopandas, pandas, ...) each import pulls in. Importing a module should not initialise Earth Engine or parse the
+command-line arguments, so every module must import without EE credentials or arguments.
+
+Run from the repository root:
+    python benchmarks/bench_import.py [--repeat 5] [--json results.json]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+MODULES = [
+    'floodsnet',
+    'floodsnet.calculate_classes',
+    'floodsnet.calculate_features',
+    'floodsnet.s2_functions',
+    'floodsnet.tools',
+    'floodsnet.pipeline',
+    'floodsnet.geetasks',
+    'floodsnet.get_imgs',
+    'floodsnet.seasonal_water_jrc',
+    'floodsnet.unosat_functions',
+]
+HEAVY = ['ee', 'geetools', 'geopandas', 'pandas', 'fiona', 'shapely', 'rasterio', 'osgeo']
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+t1 = time.perf_counter()
+print(json.dumps({{'seconds': t1 - t0, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def time_import(module: str) -> dict:
+    """Imports `module` in a new interpreter and returns its import time and the heavy modules it loaded."""
+    proc = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY)], cwd=REPO,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'failed'}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the import time of the floodsnet modules.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of imports per module. Default is 5.')
+    parser.add_argument('--json', type=Path, default=None, help='File where the results are saved as JSON.')
+    parser.add_argument('modules', nargs='*', default=MODULES, help='Modules to import. Default is all.')
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules:
+        runs = [time_import(module) for _ in range(args.repeat)]
+        errors = [r['error'] for r in runs if 'error' in r]
+        if errors:
+            results[module] = {'error': errors[0]}
+            print(f'{module:<32} ERROR: {errors[0]}')
+            continue
+        seconds = [r['seconds'] for r in runs]
+        results[module] = {'median_s': statistics.median(seconds), 'min_s': min(seconds),
+                           'heavy': runs[-1]['heavy']}
+        print(f"{module:<32} {results[module]['median_s'] * 1000:8.1f} ms   loads: {', '.join(runs[-1]['heavy'])}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps({'python': sys.version, 'repeat': args.repeat, 'results': results}, indent=2))
+        print(f'Results saved to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks `floodsnet.reader` on a synthetic event (see `synthetic.py`): random aligned windows of S2, S1, NDWI and
+CLASS per second, when
+    open:    each sample opens the files with rasterio (what consumers did without the reader)
+    handles: the reader keeps the files open (handle cache)
+    mmap:    the event is in the memory-mapped .npy cache tier
+
+Run from the repository root:
+    python benchmarks/bench_reader.py --size 2048 --window 256 --samples 500
+"""
+import argparse
+import contextlib
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio as rio
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from synthetic import make_inputs  # noqa: E402
+from floodsnet.calculate_classes import calc_classes  # noqa: E402
+from floodsnet.calculate_features import calc_ndwi  # noqa: E402
+from floodsnet.reader import ProductReader  # noqa: E402
+
+
+def make_event(inputs_dir: Path, size: int) -> dict:
+    """Writes the NDWI and CLASS of the synthetic inputs and returns {layer name: path} of the event."""
+    inputs = make_inputs(inputs_dir, size)
+    out_dir = Path(inputs['s2']).parent
+    with rio.open(inputs['s2']) as src:
+        profile = src.profile
+    profile['nodata'] = None
+    with contextlib.redirect_stdout(sys.stderr):
+        ndwi = calc_ndwi(s2_path=inputs['s2'], dt_set='usgs', s2_name='bench', out_dir=out_dir, profile=profile.copy())
+        classes = calc_classes(dt_set='usgs', s2_name='bench', out_dir=out_dir, profile=profile.copy(),
+                               gt_path=inputs['gt_resampled'], jrc_path=inputs['jrc'])
+    return {'S2': inputs['s2'], 'S1': inputs['s1'], 'NDWI': ndwi, 'CLASS': classes}
+
+
+def _read_open(layers: dict, window) -> dict:
+    arrays = {}
+    for name, fp in layers.items():
+        with rio.open(fp) as src:
+            arrays[name] = src.read(window=window)
+    return arrays
+
+
+def run(mode: str, layers: dict, window_size: int, samples: int, cache_dir: Path) -> float:
+    """Returns the samples per second of `mode`."""
+    reader = ProductReader({'bench': layers}, cache_dir=cache_dir if mode == 'mmap' else None)
+    if mode == 'mmap':
+        reader.cache_event('bench')
+    rng = np.random.default_rng(0)
+    windows = [reader.random_window('bench', window_size, rng) for _ in range(samples)]
+    t0 = time.perf_counter()
+    for window in windows:
+        arrays = _read_open(layers, window) if mode == 'open' else reader.read('bench', window)
+    seconds = time.perf_counter() - t0
+    assert arrays['S2'].shape == (13, window_size, window_size)
+    reader.close()
+    return samples / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the training reader on a synthetic event.')
+    parser.add_argument('--size', type=int, default=2048, help='Width (= height) of the event. Default is 2048.')
+    parser.add_argument('--window', type=int, default=256, help='Width (= height) of the samples. Default is 256.')
+    parser.add_argument('--samples', type=int, default=500, help='Samples per mode. Default is 500.')
+    parser.add_argument('--inputs', type=Path, default=Path(tempfile.gettempdir()) / 'floodsnet_bench_inputs',
+                        help='Folder where the synthetic inputs are generated (and reused from).')
+    args = parser.parse_args()
+
+    layers = make_event(args.inputs, args.size)
+    cache_dir = Path(tempfile.mkdtemp(prefix='floodsnet_reader_'))
+    try:
+        for mode in ['open', 'handles', 'mmap']:
+            rate = run(mode, layers, args.window, args.samples, cache_dir)
+            print(f'{mode:<8} {rate:10.1f} samples/s  ({args.window} x {args.window}, 4 layers)')
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
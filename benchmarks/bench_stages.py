@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks the raster stages (reproj_rename_s2, _reproj_merge, resample_to_s2, gdal_warp_compressed, calc_ndwi,
+calc_features and calc_classes) on synthetic inputs (see `synthetic.py`), without real data or GEE.
+
+Each run of a stage is done in a fresh process, so that its peak RSS is its own, and outputs are written to a new
+folder each time (the stages skip outputs that already exist). Results are the wall and CPU time, throughput in
+megapixels of the S2 grid (size x size) per second, and peak RSS, and can be saved as JSON and compared across commits
+with `compare.py`.
+
+Run from the repository root:
+    python benchmarks/bench_stages.py --sizes 512 2048 10980 --json results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from synthetic import UTM_CRS, make_inputs  # noqa: E402
+
+DEFAULT_SIZES = [512, 2048]
+
+
+def _read_profile(fp: str) -> dict:
+    import rasterio as rio
+    with rio.open(fp) as src:
+        return src.profile
+
+
+def _prepare_gdal_warp_compressed(inputs: dict, work: Path):
+    from osgeo import gdal
+    from floodsnet.tools import gdal_warp_compressed
+    return lambda: gdal_warp_compressed(work / 'warp_S2.tif', inputs['s2_geo'], dstSRS=UTM_CRS, xRes=10, yRes=10,
+                                        outputType=gdal.GDT_Float32)
+
+
+def _prepare_reproj_rename_s2(inputs: dict, work: Path):
+    from floodsnet.s2_functions import reproj_rename_s2
+    return lambda: reproj_rename_s2(img_path=inputs['s2_geo'], dt_set='world_floods', gt_name='bench', out_dir=work,
+                                    sat='S2', generated_img_path=work)
+
+
+def _prepare_reproj_merge(inputs: dict, work: Path):
+    from floodsnet.paths import setup_dirs
+    from floodsnet.s2_functions import _reproj_merge
+    setup_dirs(work, 'usgs')
+    return lambda: _reproj_merge(img_lst=list(inputs['s2_parts']), out_dir=work, gt_name='bench', dt_set='usgs',
+                                 sat='S2', generated_img_path=work)
+
+
+def _prepare_resample_to_s2(inputs: dict, work: Path):
+    from floodsnet.paths import setup_dirs
+    from floodsnet.s2_functions import resample_to_s2
+    setup_dirs(work, 'usgs')
+    return lambda: resample_to_s2(in_path=inputs['gt'], s2_path=inputs['s2'], gt_name='bench', out_dir=work,
+                                  tag='GT', dt_set='usgs', generated_img_path=work)
+
+
+def _prepare_calc_ndwi(inputs: dict, work: Path):
+    from floodsnet.calculate_features import calc_ndwi
+    profile = _read_profile(inputs['s2'])
+    return lambda: calc_ndwi(s2_path=inputs['s2'], dt_set='usgs', s2_name='bench', out_dir=work, profile=profile)
+
+
+def _prepare_calc_features(inputs: dict, work: Path):
+    from floodsnet.calculate_features import calc_features
+    profile = _read_profile(inputs['s2'])
+    return lambda: calc_features(s2_path=inputs['s2'], dt_set='usgs', s2_name='bench', out_dir=work, profile=profile)
+
+
+def _prepare_calc_classes(inputs: dict, work: Path):
+    from floodsnet.calculate_classes import calc_classes
+    profile = _read_profile(inputs['s2'])
+    profile['nodata'] = None
+    return lambda: calc_classes(dt_set='usgs', s2_name='bench', out_dir=work, profile=profile,
+                                gt_path=inputs['gt_resampled'], jrc_path=inputs['jrc'])
+
+
+STAGES = {
+    'gdal_warp_compressed': _prepare_gdal_warp_compressed,
+    'reproj_rename_s2': _prepare_reproj_rename_s2,
+    '_reproj_merge': _prepare_reproj_merge,
+    'resample_to_s2': _prepare_resample_to_s2,
+    'calc_ndwi': _prepare_calc_ndwi,
+    'calc_features': _prepare_calc_features,
+    'calc_classes': _prepare_calc_classes,
+}
+
+
+def _max_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10  # bytes on macOS, KiB on Linux
+
+
+def _run_child(stage: str, inputs: dict, work: Path):
+    """Runs `stage` once in this (child) process and prints its measurements as JSON."""
+    import contextlib
+    run = STAGES[stage](inputs, work)
+    baseline_rss = _max_rss_mb()
+    t0, c0 = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(sys.stderr):  # the stages print a lot
+        run()
+    seconds, cpu_seconds = time.perf_counter() - t0, time.process_time() - c0
+    print(json.dumps({'seconds': seconds, 'cpu_seconds': cpu_seconds, 'peak_rss_mb': _max_rss_mb(),
+                      'baseline_rss_mb': baseline_rss}))
+
+
+def run_stage(stage: str, inputs: dict, work_root: Path) -> dict:
+    """Runs `stage` in a fresh process with a new output folder and returns its measurements."""
+    work = Path(tempfile.mkdtemp(prefix=f'{stage}_', dir=work_root))
+    try:
+        proc = subprocess.run([sys.executable, __file__, '--child', stage, '--child-inputs', json.dumps(inputs),
+                               '--workdir', str(work)], capture_output=True, text=True)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines()
+        return {'error': lines[-1] if lines else f'exit code {proc.returncode}'}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the floodsnet raster stages on synthetic inputs.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help=f'Width (= height) of the S2 grid, in pixels. Default is {DEFAULT_SIZES}; a full S2 tile '
+                             f'is 10980.')
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES),
+                        help='Stages to benchmark. Default is all.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per stage and size. Default is 3.')
+    parser.add_argument('--inputs', type=Path, default=Path(tempfile.gettempdir()) / 'floodsnet_bench_inputs',
+                        help='Folder where the synthetic inputs are generated (and reused from).')
+    parser.add_argument('--workdir', type=Path, default=None, help='Folder where the outputs are written.')
+    parser.add_argument('--json', type=Path, default=None, help='File where the results are saved as JSON.')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--child-inputs', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        _run_child(args.child, json.loads(args.child_inputs), args.workdir)
+        return
+
+    work_root = args.workdir if args.workdir is not None else Path(tempfile.mkdtemp(prefix='floodsnet_bench_'))
+    work_root.mkdir(parents=True, exist_ok=True)
+    results = []
+    for size in args.sizes:
+        print(f'Generating synthetic inputs of {size} x {size} in {args.inputs}')
+        inputs = make_inputs(args.inputs, size)
+        for stage in args.stages:
+            runs = [run_stage(stage, inputs, work_root) for _ in range(args.repeat)]
+            errors = [r['error'] for r in runs if 'error' in r]
+            if errors:
+                results.append({'stage': stage, 'size': size, 'error': errors[0]})
+                print(f'{stage:<22} {size:>6}  ERROR: {errors[0]}')
+                continue
+            seconds = [r['seconds'] for r in runs]
+            median = statistics.median(seconds)
+            result = {
+                'stage': stage,
+                'size': size,
+                'seconds': seconds,
+                'median_s': median,
+                'cpu_s': statistics.median(r['cpu_seconds'] for r in runs),
+                'mpix_per_s': size * size / 1e6 / median,
+                'peak_rss_mb': max(r['peak_rss_mb'] for r in runs),
+                'baseline_rss_mb': min(r['baseline_rss_mb'] for r in runs),
+            }
+            results.append(result)
+            print(f"{stage:<22} {size:>6}  {median:8.3f} s  {result['mpix_per_s']:8.2f} MPix/s  "
+                  f"peak RSS {result['peak_rss_mb']:8.1f} MB")
+    if args.workdir is None:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    if args.json is not None:
+        try:
+            from osgeo import gdal
+            gdal_version = gdal.__version__
+        except ImportError:
+            gdal_version = None
+        meta = {
+            'commit': _git_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'gdal': gdal_version,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+        }
+        args.json.write_text(json.dumps({'meta': meta, 'results': results}, indent=2))
+        print(f'Results saved to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
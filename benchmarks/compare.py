@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Compares two JSON results of `bench_stages.py` (e.g., from two commits), stage by stage and size by size.
+
+    python benchmarks/compare.py base.json new.json [--fail-above 1.10]
+
+With `--fail-above`, exits with code 1 if any stage got slower than that ratio (new / base median time).
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def _load(path: Path) -> tuple:
+    data = json.loads(Path(path).read_text())
+    return data.get('meta', {}), {(r['stage'], r['size']): r for r in data['results']}
+
+
+def compare(base: dict, new: dict) -> list:
+    """Returns (stage, size, base median s, new median s, time ratio, base peak RSS, new peak RSS) rows for the stages
+    and sizes that are in both results and ran without errors."""
+    rows = []
+    for key in base:
+        if key not in new or 'error' in base[key] or 'error' in new[key]:
+            continue
+        b, n = base[key], new[key]
+        rows.append((*key, b['median_s'], n['median_s'], n['median_s'] / b['median_s'], b['peak_rss_mb'],
+                     n['peak_rss_mb']))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares two benchmark results.')
+    parser.add_argument('base', type=Path)
+    parser.add_argument('new', type=Path)
+    parser.add_argument('--fail-above', type=float, default=None,
+                        help='Exit with an error if any new/base time ratio is above this value.')
+    args = parser.parse_args()
+
+    base_meta, base = _load(args.base)
+    new_meta, new = _load(args.new)
+    print(f"base: {base_meta.get('commit', args.base)}   new: {new_meta.get('commit', args.new)}")
+    print(f"{'stage':<22} {'size':>6} {'base s':>9} {'new s':>9} {'ratio':>7} {'base MB':>9} {'new MB':>9}")
+    rows = compare(base, new)
+    for stage, size, b_s, n_s, ratio, b_mb, n_mb in rows:
+        print(f'{stage:<22} {size:>6} {b_s:9.3f} {n_s:9.3f} {ratio:7.2f} {b_mb:9.1f} {n_mb:9.1f}')
+    for key in sorted(set(base) ^ set(new)):
+        print(f'{key[0]:<22} {key[1]:>6}  only in {"base" if key in base else "new"}')
+
+    if args.fail_above is not None:
+        slower = [row for row in rows if row[4] > args.fail_above]
+        if slower:
+            print(f'{len(slower)} stage(s) are more than {args.fail_above}x slower.')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic Sentinel-2, Sentinel-1, ground truth and JRC GeoTIFFs to benchmark the raster stages without real data or
+GEE. The rasters are written in strips, so that tile-sized (10980 x 10980) inputs do not need to fit in memory.
+
+"""
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import rasterio as rio
+from rasterio.transform import from_origin
+
+S2_BANDS = ['B1', 'B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B8A', 'B9', 'B10', 'B11', 'B12']
+S1_BANDS = ['VV', 'VH']
+UTM_CRS = 'EPSG:32633'
+UTM_ORIGIN = (500000.0, 5000000.0)
+GEO_ORIGIN = (15.0, 45.1)  # roughly the same place as UTM_ORIGIN, in lon/lat
+# approximate size of a 10 m pixel in degrees (x, y) at GEO_ORIGIN
+DEG_10M = (float(10 / (111320 * np.cos(np.radians(GEO_ORIGIN[1])))), 10 / 110950)
+STRIP_ROWS = 512
+
+
+def _profile(size: int, count: int, dtype: str, crs: str, res: tuple, origin: tuple) -> dict:
+    return dict(driver='GTiff', width=size, height=size, count=count, dtype=dtype, crs=crs,
+                transform=from_origin(origin[0], origin[1], res[0], res[1]), tiled=True, blockxsize=256, blockysize=256,
+                compress='lzw', interleave='band')
+
+
+def _write(path: Union[str, Path], profile: dict, make_strip, descriptions=None, seed: int = 0) -> str:
+    """Writes `path` strip by strip, with `make_strip(rng, rows, cols, row_off)` returning an array of shape
+    (count, rows, cols)."""
+    rng = np.random.default_rng(seed)
+    size = profile['width']
+    with rio.open(path, 'w', **profile) as dst:
+        for row_off in range(0, profile['height'], STRIP_ROWS):
+            rows = min(STRIP_ROWS, profile['height'] - row_off)
+            window = rio.windows.Window(0, row_off, size, rows)
+            dst.write(make_strip(rng, rows, size, row_off).astype(profile['dtype'], copy=False), window=window)
+        if descriptions is not None:
+            dst.descriptions = tuple(descriptions)
+    return str(path)
+
+
+def _water_mask(rows: int, cols: int, row_off: int, size: int) -> np.ndarray:
+    """A smooth, deterministic "river" so that the water classes form realistic patches instead of noise."""
+    y = (np.arange(row_off, row_off + rows) / size)[:, None]
+    x = (np.arange(cols) / size)[None, :]
+    return np.abs(x - 0.5 - 0.15 * np.sin(6 * np.pi * y)) < 0.08
+
+
+def make_s2(path: Union[str, Path], size: int, geographic: bool = False, x_shift: float = 0, seed: int = 0) -> str:
+    """13-band uint16 S2 image (surface reflectance x 10000) with lower green than NIR on land and the opposite on
+    water. In UTM, or in lon/lat if `geographic` (as the WorldFloods/Sen1Floods11 S2 that need reprojecting). The image
+    is shifted east by `x_shift` times its width."""
+    crs, res, origin = ('EPSG:4326', DEG_10M, GEO_ORIGIN) if geographic else (UTM_CRS, (10.0, 10.0), UTM_ORIGIN)
+    origin = (origin[0] + x_shift * size * res[0], origin[1])
+
+    def strip(rng, rows, cols, row_off):
+        arr = rng.integers(300, 3000, size=(len(S2_BANDS), rows, cols), dtype=np.uint16)
+        water = _water_mask(rows, cols, row_off, size)
+        arr[2][water] += 1500  # B3, green
+        arr[7][~water] += 2500  # B8, NIR
+        return arr
+
+    return _write(path, _profile(size, len(S2_BANDS), 'uint16', crs, res, origin), strip, S2_BANDS, seed)
+
+
+def make_s1(path: Union[str, Path], size: int, seed: int = 1) -> str:
+    """2-band (VV, VH) float32 backscatter in dB, in UTM."""
+    def strip(rng, rows, cols, row_off):
+        arr = rng.normal(-12, 3, size=(len(S1_BANDS), rows, cols)).astype(np.float32)
+        arr[:, _water_mask(rows, cols, row_off, size)] -= 10
+        return arr
+
+    profile = _profile(size, len(S1_BANDS), 'float32', UTM_CRS, (10.0, 10.0), UTM_ORIGIN)
+    return _write(path, profile, strip, S1_BANDS, seed)
+
+
+def make_gt(path: Union[str, Path], size: int, resampled: bool = False, seed: int = 2) -> str:
+    """Ground truth with the usgs coding (0 no data, 1 water, 2 land, 4 cloud). In lon/lat at 20 m, so that it has to
+    be resampled to the S2 grid, or already `resampled` to the S2 grid (float32, as `resample_to_s2` writes it)."""
+    gt_size = size if resampled else max(size // 2, 1)
+
+    def strip(rng, rows, cols, row_off):
+        gt = np.full((1, rows, cols), 2, dtype=np.uint8)
+        gt[0][_water_mask(rows, cols, row_off, gt_size)] = 1
+        gt[0][rng.random((rows, cols)) < 0.01] = 4
+        gt[0, :, :2] = 0
+        return gt
+
+    if resampled:
+        profile = _profile(gt_size, 1, 'float32', UTM_CRS, (10.0, 10.0), UTM_ORIGIN)
+    else:
+        profile = _profile(gt_size, 1, 'uint8', 'EPSG:4326', (2 * DEG_10M[0], 2 * DEG_10M[1]), GEO_ORIGIN)
+    return _write(path, profile, strip, ['GT'], seed)
+
+
+def make_jrc(path: Union[str, Path], size: int, seed: int = 3) -> str:
+    """Seasonal JRC (0 not water, 1 seasonal, 2 permanent) on the S2 grid."""
+    def strip(rng, rows, cols, row_off):
+        jrc = np.zeros((1, rows, cols), dtype=np.int32)
+        water = _water_mask(rows, cols, row_off, size)
+        jrc[0][water] = rng.integers(0, 3, size=int(water.sum()))
+        return jrc
+
+    return _write(path, _profile(size, 1, 'int32', UTM_CRS, (10.0, 10.0), UTM_ORIGIN), strip, ['JRC'], seed)
+
+
+def make_inputs(folder: Union[str, Path], size: int) -> dict:
+    """Writes (or reuses) the synthetic inputs of `size` x `size` pixels in `folder` and returns their paths:
+        s2_geo: S2 in lon/lat, to reproject
+        s2: S2 in UTM, i.e., already reprojected
+        s2_parts: two overlapping S2 images with the same image id, to merge
+        s1, gt, jrc
+        gt_resampled: GT on the S2 grid, to classify
+    """
+    folder = Path(folder) / f'{size}'
+    folder.mkdir(parents=True, exist_ok=True)
+    paths = {
+        's2_geo': folder / 'bench_20200101_T33TWL_geo_S2.tif',
+        's2': folder / 'bench_20200101_T33TWL_utm_S2.tif',
+        's2_parts': [folder / 'bench_20200101_T33TWL_0_S2.tif', folder / 'bench_20200101_T33TWL_1_S2.tif'],
+        's1': folder / 'bench_20200101_A_VV_VH_S1.tif',
+        'gt': folder / 'bench_GT.tif',
+        'gt_resampled': folder / 'bench_resamp_GT.tif',
+        'jrc': folder / 'bench_JRC.tif',
+    }
+    if not paths['s2_geo'].exists():
+        make_s2(paths['s2_geo'], size, geographic=True)
+    if not paths['s2'].exists():
+        make_s2(paths['s2'], size)
+    for i, part in enumerate(paths['s2_parts']):
+        if not part.exists():
+            make_s2(part, size, x_shift=0.5 * i, seed=10 + i)
+    if not paths['s1'].exists():
+        make_s1(paths['s1'], size)
+    if not paths['gt'].exists():
+        make_gt(paths['gt'], size)
+    if not paths['gt_resampled'].exists():
+        make_gt(paths['gt_resampled'], size, resampled=True)
+    if not paths['jrc'].exists():
+        make_jrc(paths['jrc'], size)
+    return {key: [str(p) for p in val] if isinstance(val, list) else str(val) for key, val in paths.items()}
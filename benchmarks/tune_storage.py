@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Chooses a storage profile (codec, predictor, block size and interleave) per product type with `floodsnet.autotune`:
+measures the size, encode and decode throughput, and window read time of the candidate profiles on a sample of each
+product, prints them, and saves the chosen profiles for `--storage-profiles`.
+
+Products are given by path (one per type is used; their type is the tag at the end of their name, e.g., _S2.tif or
+_resamp_GT.tif). Without paths, a synthetic event (see `synthetic.py`) is used, which is only good to try the tool:
+real S2 and S1 compress very differently.
+
+Run from the repository root:
+    python benchmarks/tune_storage.py out/usgs_EVENT_*.tif resampled/EVENT_resamp_*.tif --out storage_profiles.json
+"""
+import argparse
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from floodsnet.autotune import choose_profiles, results_table, tune_products  # noqa: E402
+from floodsnet.storage import save_profiles  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chooses a storage profile per product type.')
+    parser.add_argument('paths', nargs='*', help='Products to sample, one or more per type. Default is a synthetic '
+                                                  'event.')
+    parser.add_argument('--sample-size', type=int, default=1024,
+                        help='Width (= height) of the central window sampled from each product. Default is 1024.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement (the best is kept). Default is 3.')
+    parser.add_argument('--min-decode', type=float, default=0.5,
+                        help='Keep only profiles that decode at least this fraction as fast as the fastest one. '
+                             'Default is 0.5.')
+    parser.add_argument('--min-encode', type=float, default=0.1,
+                        help='Keep only profiles that encode at least this fraction as fast as the fastest one. '
+                             'Default is 0.1.')
+    parser.add_argument('--inputs', type=Path, default=Path(tempfile.gettempdir()) / 'floodsnet_bench_inputs',
+                        help='Folder where the synthetic inputs are generated (and reused from).')
+    parser.add_argument('--json', type=Path, default=None, help='Save all the measurements to this JSON file.')
+    parser.add_argument('--out', type=Path, default=None, help='Save the chosen profiles to this JSON file.')
+    args = parser.parse_args()
+
+    paths = args.paths
+    if len(paths) == 0:
+        from bench_reader import make_event
+        paths = list(make_event(args.inputs, args.sample_size).values())
+
+    results = tune_products(paths, sample_size=args.sample_size, repeat=args.repeat)
+    print(results_table(results))
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+    chosen = choose_profiles(results, min_decode=args.min_decode, min_encode=args.min_encode)
+    print('\nChosen profiles:')
+    for name, profile in chosen.items():
+        print(f'{name:<6} {profile}')
+    if args.out is not None:
+        save_profiles(chosen, args.out)
+        print(f'Saved to {args.out}. Use them with --storage-profiles {args.out}')
+
+
+if __name__ == '__main__':
+    main()
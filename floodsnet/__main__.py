@@ -9,48 +9,68 @@
 # for example:
 # python -m floodsnet -dt=unosat --generated_path='/Volumes/GoogleDrive/My Drive/projects'
 
+import atexit
+import functools
 import os
 from glob import glob
 from pathlib import Path
 
-import ee
-import geopandas as gpd
-
 from .calculate_classes import calc_classes
-from .calculate_features import calc_ndwi
+from .calculate_features import calc_features, calc_ndwi
 from .cli import parse_flood_training_data_args
+from .config import Config
+from .earthengine import get_ee
 from .gee_sentinel1_download import download_s1_imgs
 from .gee_sentinel2_download import download_s2_imgs
-from .geetasks import check_on_tasks_in_queue, wait_for_local_sync
+from .geetasks import check_on_tasks_in_queue
 from .get_imgs import (get_ground_truth,
                        get_s2_imgs,
                        get_s1_imgs,
                        get_jrc_imgs,
                        get_img_date_bbox,
                        get_metadata)
+from .ledger import RunLedger
 from .paths import dataset_paths, get_s2_jrc_s1_indexes, setup_dirs
+from . import storage, tracing
+from .pipeline import run_events, stream_events
 from .s2_functions import reproj_rename_s2, resample_to_s2
 from .seasonal_water_jrc import download_seasonal_jrc_imgs
-from .tools import gdal_wait, img_rename, rename_from_dict
+from .tile_index import load_tile_index
+from .tools import gdal_is_valid, img_rename, rename_from_dict
 from .unosat_functions import (get_flood_layers_from_unosat_gdbs,
                                validate_date,
-                               rasterize_shp)
+                               rasterize_flood_tiles)
+from .watcher import wait_for_downloads
+
 
-args = parse_flood_training_data_args()
-generated_img_path = args.generated_path
-print("generated_img_path is ", generated_img_path)
+def _record_downloads(ledger, dt_set, name, layer, task_paths):
+    if ledger is None:
+        return
+    for task, path in task_paths:
+        ledger.record_download(dt_set, name, layer, task.id, path)
 
 
 def main():
-    # initialize Google Earth Engine
-    ee.Initialize()
     # get paths to various input sources
     args = parse_flood_training_data_args()
+    config = Config.from_args(args)
+    if args.trace is not None:
+        tracing.enable()
+        atexit.register(tracing.write_report, args.trace)
+    storage.configure(args.output_format, blocksize=args.cog_blocksize, level=args.cog_level,
+                      profiles=storage.load_profiles(args.storage_profiles) if args.storage_profiles else None)
+    generated_img_path = config.generated_path
+    print("generated_img_path is ", generated_img_path)
     dt_set = args.dt_set
-    out_dir = args.out_dir
+    out_dir = config.out_dir
+    # initialize Google Earth Engine
+    ee = get_ee()
 
     # if output directory does not exist, create it
     os.makedirs(out_dir, exist_ok=True)
+    ledger = RunLedger(args.ledger) if not args.no_ledger else None
+    # downloads found valid are remembered in the ledger, so that reruns do not check them again
+    validate = functools.partial(gdal_is_valid, store=ledger.validity_store() if ledger is not None else None)
 
     rename_dict = {}
 
@@ -70,16 +90,26 @@ def main():
         resampled_img_path = dataset_paths_dict['resampled']
 
         if dt_set == 'unosat':
-            unosat_lst = get_ground_truth(dt_set)
-            hls_tiles = gpd.read_file(args.s2_tile_path)
+            import geopandas as gpd
+            unosat_lst = get_ground_truth(dt_set, config=config)
+            hls_index = load_tile_index(config.s2_tile_path)
             # loop through all geodatabases
             flood_lst = get_flood_layers_from_unosat_gdbs(unosat_lst)
             # for each flood, clip to S2 tile size, download S2, rasterize GT
             print("checking interactively ", "flood_lst is ", flood_lst)
+            # read each flood layer once, and find the HLS tiles of all the layers at once
+            flood_unions = {}
+            flood_dates = {}
             for gdb, flood_layer in flood_lst:
                 gdf = gpd.read_file(gdb, layer=flood_layer)
-                gdf_union = gdf.unary_union
-                flood_date = validate_date(gdf['Sensor_Date'].unique()[0], flood_layer)
+                flood_unions[(gdb, flood_layer)] = gdf.unary_union
+                flood_dates[(gdb, flood_layer)] = gdf['Sensor_Date'].unique()[0]
+                del gdf
+            # clip multipoly-unions to HLS tiles
+            flood_hls_tiles = hls_index.clip_many(flood_unions)
+            for gdb, flood_layer in flood_lst:
+                gdf_union = flood_unions[(gdb, flood_layer)]
+                flood_date = validate_date(flood_dates[(gdb, flood_layer)], flood_layer)
                 start_date, end_date, aoi = get_img_date_bbox(dt_set=dt_set, plus_days=4,
                                                               fl=flood_date,
                                                               shp=gdf_union)
@@ -90,13 +120,13 @@ def main():
                 print(f'--- --- --- renaming gt_name --- --- ---\nfrom: {gt_name_orig}\nto: {gt_name}\n')
                 rename_dict[gt_name] = gt_name_orig
 
-                del gdf
                 # # if no s2 images for any of the overlapping folder OR no overlap, check GEE for S2 images
                 # # get JRC images from GEE
-                # clip multipoly-union to HLS tiles
-                flood_hls = gpd.clip(hls_tiles, gdf_union)
+                flood_hls = flood_hls_tiles[(gdb, flood_layer)]
                 # make list of s2 image names (there can be multiple S2 images)
                 # loop through s2 names, download if not already downloaded
+                tiles_done = []
+                tile_jobs = []
                 for i in range(len(flood_hls)):
                     flood = flood_hls.iloc[[i]]
                     aoi = list(flood.bounds.values)[0]
@@ -157,9 +187,11 @@ def main():
                         file_name_lst = s2_dwnld_path_lst + s1_dwnld_path_lst + jrc_out_path
 
                         print(file_name_lst)
-                        for dwnld_path in file_name_lst:
-                            wait_for_local_sync(dwnld_path)
-                            gdal_wait(dwnld_path)
+                        ready = wait_for_downloads(file_name_lst, validate=validate, raise_on_invalid=False)
+                        invalid = [str(fp) for fp in file_name_lst if str(fp) not in ready]
+                        if len(invalid) > 0:
+                            print(f'These downloads of {gt_name} {tile} are not valid: {invalid} \nSkipping the tile.')
+                            continue
 
                         print("2nd s2_dwnld_path_lst ", s2_dwnld_path_lst)
                         
@@ -192,6 +224,10 @@ def main():
                                 # CALCULATE NDWI for each s2 image
                                 calc_ndwi(s2_path=s2_outpath, dt_set=dt_set, s2_name=s2_name, out_dir=out_dir,
                                           profile=profile)
+                                if args.features:
+                                    calc_features(s2_path=s2_path, dt_set=dt_set, s2_name=s2_name, out_dir=out_dir,
+                                                  profile=profile.copy(), features=args.features,
+                                                  separate=args.separate_features)
 
                             # REPROJECT S1 to S2 OR get S1 profile if no S2
                             for s1_path in s1_dwnld_path_lst:
@@ -215,31 +251,38 @@ def main():
                         # as long as we have either an S1 or S2 image,
                         # resample GT and JRC and save to main output directory
                         if len(s2_dwnld_path_lst) != 0 or len(s1_dwnld_path_lst) != 0:
-                            # RASTERIZE GT
                             print('s_path ', s_path)
-                            gt_resamp_path = rasterize_shp(flood_shp=flood, out_dir=resampled_img_path, gt_name=gt_name,
-                                                           s2_path=s_path, date_info=date_info)
-                            print("done with rasterize_shp")
-                            # resample JRC to s2 profile
-                            jrc_out_path = f'{jrc_img_path}/{gt_name}_{jrc_date}_{tile}_Seasonal_JRC.tif'
-                            print("jrc_out_path ", jrc_out_path)
-                            jrc_resamp_path = resample_to_s2(in_path=jrc_out_path, s2_path=s_path,
-                                                             gt_name='_'.join([gt_name, date_info, tile]),
-                                                             tag='JRC', dt_set=dt_set, out_dir=out_dir,
-                                                             generated_img_path=generated_img_path)
-
-                            # CLASSIFY IMAGE
-                            calc_classes(dt_set=dt_set, s2_name='_'.join([gt_name, date_info, tile]),
-                                         out_dir=out_dir, profile=profile,
-                                         gt_path=gt_resamp_path, jrc_path=jrc_resamp_path)
+                            tiles_done.append(i)
+                            tile_jobs.append(dict(tile=tile, s_path=s_path, profile=profile, jrc_date=jrc_date))
+
+                # RASTERIZE GT of all the tiles of the flood at once
+                gt_resamp_paths = rasterize_flood_tiles(flood_tiles=flood_hls.iloc[tiles_done],
+                                                        out_dir=resampled_img_path, gt_name=gt_name,
+                                                        s_paths=[job['s_path'] for job in tile_jobs],
+                                                        date_info=date_info)
+                print("done with rasterize_flood_tiles")
+                for job, gt_resamp_path in zip(tile_jobs, gt_resamp_paths):
+                    tile, s_path = job['tile'], job['s_path']
+                    # resample JRC to s2 profile
+                    jrc_out_path = f'{jrc_img_path}/{gt_name}_{job["jrc_date"]}_{tile}_Seasonal_JRC.tif'
+                    print("jrc_out_path ", jrc_out_path)
+                    jrc_resamp_path = resample_to_s2(in_path=jrc_out_path, s2_path=s_path,
+                                                     gt_name='_'.join([gt_name, date_info, tile]),
+                                                     tag='JRC', dt_set=dt_set, out_dir=out_dir,
+                                                     generated_img_path=generated_img_path)
+
+                    # CLASSIFY IMAGE
+                    calc_classes(dt_set=dt_set, s2_name='_'.join([gt_name, date_info, tile]),
+                                 out_dir=out_dir, profile=job['profile'],
+                                 gt_path=gt_resamp_path, jrc_path=jrc_resamp_path)
 
                 rename_from_dict(out_dir, rename_dict, tiles=None)
 
         else:
-            gt_fl_paths, gt_names = get_ground_truth(dt_set)
-            s2_fl_paths, s2_names = get_s2_imgs(dt_set)  # empty for usgs
-            s1_fl_paths, s1_names = get_s1_imgs(dt_set)  # empty for WF, Sen1Floods11, usgs
-            jrc_fl_paths, jrc_names = get_jrc_imgs(dt_set)  # empty for WF, usgs
+            gt_fl_paths, gt_names = get_ground_truth(dt_set, config=config)
+            s2_fl_paths, s2_names = get_s2_imgs(dt_set, config=config)  # empty for usgs
+            s1_fl_paths, s1_names = get_s1_imgs(dt_set, config=config)  # empty for WF, Sen1Floods11, usgs
+            jrc_fl_paths, jrc_names = get_jrc_imgs(dt_set, config=config)  # empty for WF, usgs
 
             s2_missing, jrc_missing, s1_missing = get_s2_jrc_s1_indexes(gt_names, s2_names, jrc_names, s1_names,
                                                                         check_miss=True)
@@ -248,13 +291,33 @@ def main():
             s2_dwnld_path_lst = []
             s1_dwnld_path_lst = []
             jrc_dwnld_path_lst = []
+            # (task, path) pairs of the GEE exports of each event, per layer; used by the streaming mode
+            event_downloads = {}
+
+            if ledger is not None:
+                for stage in args.rebuild_stage:
+                    ledger.invalidate(dt_set, stage)
+                # exports submitted in a previous run that are still running or done are waited on, not resubmitted
+                live_downloads = ledger.live_downloads(dt_set)
+                for layer, missing, dwnld_path_lst in (('s2', s2_missing, s2_dwnld_path_lst),
+                                                       ('jrc', jrc_missing, jrc_dwnld_path_lst),
+                                                       ('s1', s1_missing, s1_dwnld_path_lst)):
+                    for name in list(missing):
+                        task_paths = live_downloads.get(name, {}).get(layer, [])
+                        if len(task_paths) == 0:
+                            continue
+                        print(f'{layer} of {name} was already submitted to GEE. Waiting on it.')
+                        missing.remove(name)
+                        gee_tasks.extend(task for task, _ in task_paths)
+                        dwnld_path_lst.extend(path for _, path in task_paths)
+                        event_downloads.setdefault(name, {}).setdefault(layer, []).extend(task_paths)
 
             for name in gt_names:
                 print('name', name)
                 print('s2_missing', s2_missing)
                 if name in s2_missing + s1_missing + jrc_missing:
                     # get metadata file
-                    meta_fl = get_metadata(dt_set, name)
+                    meta_fl = get_metadata(dt_set, name, config=config)
                     # get date and bounds
                     # by default, end_date is start_date + 1
                     start_date, end_date, aoi = get_img_date_bbox(dt_set, meta_fl)
@@ -269,6 +332,10 @@ def main():
                         # add gee tasks to list
                         # some floods have multiple s2 tasks if the flooded area is very large
                         gee_tasks.extend(task_lst)
+                        task_paths = list(zip(task_lst,
+                                              [f'{s2_img_path}/{file_name}.tif' for file_name in file_name_lst]))
+                        event_downloads.setdefault(name, {}).setdefault('s2', []).extend(task_paths)
+                        _record_downloads(ledger, dt_set, name, 's2', task_paths)
                     if name in jrc_missing:
                         # download seasonal jrc from GEE                    
                         print('before ', name)
@@ -277,6 +344,9 @@ def main():
                         jrc_dwnld_path_lst.extend([f'{jrc_img_path}/{Path(jrc_out_path).name}.tif'])
                         print('jrc_dwnld_path_lst: ', jrc_dwnld_path_lst)
                         gee_tasks.append(task)
+                        event_downloads.setdefault(name, {})['jrc'] = [
+                            (task, f'{jrc_img_path}/{Path(jrc_out_path).name}.tif')]
+                        _record_downloads(ledger, dt_set, name, 'jrc', event_downloads[name]['jrc'])
                     if name in s1_missing:
                         # download s1 from GEE
                         task_lst, n_s1_imgs, file_name_lst2 = download_s1_imgs(date_start=start_date, 
@@ -288,9 +358,31 @@ def main():
                         print('s1_dwnld_path_lst: ', s1_dwnld_path_lst)
                         print('task_lst empty?', task_lst)
                         gee_tasks.extend(task_lst)
+                        task_paths = list(zip(task_lst,
+                                              [f'{s1_img_path}/{file_name}.tif' for file_name in file_name_lst2]))
+                        event_downloads.setdefault(name, {}).setdefault('s1', []).extend(task_paths)
+                        _record_downloads(ledger, dt_set, name, 's1', task_paths)
                         # add gee tasks to list
                         # some floods have multiple s1 tasks if the flooded area is very large
                 
+            if args.stream:
+                # process each event as soon as its own downloads are done, instead of waiting for all of them
+                s2_idx, jrc_idx, s1_idx = get_s2_jrc_s1_indexes(gt_names, s2_names, jrc_names, s1_names)
+                events = []
+                for i in range(len(gt_fl_paths)):
+                    gt_name = gt_names[i]
+                    events.append(dict(gt_name=gt_name,
+                                       gt_path=gt_fl_paths[i],
+                                       s2_lst=[s2_fl_i for s2_fl_i in s2_fl_paths if gt_name in s2_fl_i],
+                                       s1_lst=[s1_fl_i for s1_fl_i in s1_fl_paths if gt_name in s1_fl_i],
+                                       jrc_path=jrc_fl_paths[jrc_idx[i]] if i in jrc_idx else None))
+                stream_events(events, event_downloads, dt_set=dt_set, out_dir=out_dir,
+                              generated_img_path=generated_img_path, jobs=args.jobs, ledger=ledger,
+                              stage_workers=args.stage_workers, features=args.features,
+                              separate_features=args.separate_features, chip_size=args.chip_size,
+                              chip_overlap=args.chip_overlap, checksum_outputs=args.checksum_outputs)
+                continue
+
     # might need to handle if we don't need to download anything...     
             print('entering check_on_tasks_in_queue(gee_tasks)')
             check_on_tasks_in_queue(gee_tasks)
@@ -299,104 +391,43 @@ def main():
             file_name_lst = s2_dwnld_path_lst + s1_dwnld_path_lst + jrc_dwnld_path_lst
 
             print(file_name_lst)
-            for dwnld_path in file_name_lst:
-                wait_for_local_sync(dwnld_path)
-                gdal_wait(dwnld_path)
+            # a download that never becomes valid fails only the events that need it
+            ready = wait_for_downloads(file_name_lst, validate=validate, raise_on_invalid=False)
+            invalid = [str(fp) for fp in file_name_lst if str(fp) not in ready]
 
-            gt_fl_paths, gt_names = get_ground_truth(dt_set)
-            s2_fl_paths, s2_names = get_s2_imgs(dt_set)
-            s1_fl_paths, s1_names = get_s1_imgs(dt_set)
-            jrc_fl_paths, jrc_names = get_jrc_imgs(dt_set)
+            gt_fl_paths, gt_names = get_ground_truth(dt_set, config=config)
+            s2_fl_paths, s2_names = get_s2_imgs(dt_set, config=config)
+            s1_fl_paths, s1_names = get_s1_imgs(dt_set, config=config)
+            jrc_fl_paths, jrc_names = get_jrc_imgs(dt_set, config=config)
 
             s2_idx, jrc_idx, s1_idx = get_s2_jrc_s1_indexes(gt_names, s2_names, jrc_names, s1_names)
 
+            events = []
             for i in range(len(gt_fl_paths)):
-
-                print(f'{gt_names[i]}')
                 gt_name = gt_names[i]
-                s2_lst = [s2_fl_i for s2_fl_i in s2_fl_paths if gt_name in s2_fl_i]
-                print(f's2_lst: {len(s2_lst)}')
-                s1_lst = [s1_fl_i for s1_fl_i in s1_fl_paths if gt_name in s1_fl_i]
-                print(f's1_lst: {len(s1_lst)}\n')
-                if len(s2_lst) > 1:  # if there are more than 1 files per gt_name so (1), (2) etc.
-                    # reproject with merge
-                    print("reprojecting with merge, s2_lst ", len(s2_lst), s2_lst)
-                    s_outpath, profile = reproj_rename_s2(img_path=s2_lst.copy(), 
-                                                          dt_set=dt_set,
-                                                          gt_name=gt_name,
-                                                          out_dir=out_dir,
-                                                          sat='S2',
-                                                          generated_img_path=generated_img_path)
-
-                elif len(s2_lst) == 1:
-                    # REPROJECT
-                    s_outpath, profile = reproj_rename_s2(img_path=s2_lst[0], 
-                                                          dt_set=dt_set,
-                                                          gt_name=gt_name,
-                                                          out_dir=out_dir,
-                                                          sat='S2',
-                                                          generated_img_path=generated_img_path)
-                    
-                elif len(s1_lst) > 0:  # no s2 images, at least 1 s1
-                    # REPROJECT / GET S1 PROFILE
-                    s_outpath, profile = reproj_rename_s2(img_path=s1_lst.copy(), 
-                                                          dt_set=dt_set, 
-                                                          gt_name=gt_name,
-                                                          out_dir=out_dir, 
-                                                          sat='S1',
-                                                          generated_img_path=generated_img_path)
-                else:  # no s2 or s1
-                    print(f"no s2 or s1 images for {gt_name}\n")
-                    continue
-                
-                if len(s2_lst) != 0:
-                    s2_dwnld_path_lst = glob(f'{out_dir}/{dt_set}_{gt_name}*S2.tif')
-                    print("s2_dwnld_path_lst:", s2_dwnld_path_lst)
-                    # reproject and calculate ndwi for each s2 image
-                    for s2_path in s2_dwnld_path_lst:
-                        s2_name = Path(s2_path).stem.replace("_S2", "")
-                        print(f's2_path: {s2_path}')
-                        print(f's2_name: {s2_name}')
-                        # CALCULATE NDWI
-                        calc_ndwi(s2_path=s_outpath, 
-                                  dt_set=dt_set,
-                                  s2_name=s2_name,
-                                  out_dir=out_dir,
-                                  profile=profile)
-                    
-                    if len(s1_lst) != 0:
-                        for s1_path in s1_lst:
-                            # resample s1 to s2 profile 
-                            s1_resamp_path = resample_to_s2(in_path=s1_path, 
-                                                            s2_path=s_outpath, 
-                                                            gt_name=gt_name,
-                                                            out_dir=out_dir, 
-                                                            tag='S1', 
-                                                            dt_set=dt_set,
-                                                            generated_img_path=generated_img_path)
-                            print('s1_resamp_path: ', s1_resamp_path)
-                    else:
-                        print(f'No S1 images for {gt_name}')
-
-                # resample gt to s2 profile (if needed)
-                gt_resamp_path = resample_to_s2(in_path=gt_fl_paths[i], 
-                                                s2_path=s_outpath, 
-                                                gt_name=gt_name, 
-                                                tag='GT',
-                                                out_dir=out_dir,
-                                                dt_set=dt_set,
-                                                generated_img_path=generated_img_path)
-
-                # resample JRC to s2 profile
-                jrc_resamp_path = resample_to_s2(in_path=jrc_fl_paths[jrc_idx[i]], out_dir=out_dir,
-                                                 s2_path=s_outpath, gt_name=gt_name,
-                                                 tag='JRC', dt_set=dt_set,
-                                                 generated_img_path=generated_img_path)
-
-                # CLASSIFY IMAGE
-                calc_classes(dt_set=dt_set, s2_name=gt_name, out_dir=out_dir, profile=profile, 
-                             gt_path=gt_resamp_path, jrc_path=jrc_resamp_path)
-
+                events.append(dict(gt_name=gt_name,
+                                   gt_path=gt_fl_paths[i],
+                                   s2_lst=[s2_fl_i for s2_fl_i in s2_fl_paths if gt_name in s2_fl_i],
+                                   s1_lst=[s1_fl_i for s1_fl_i in s1_fl_paths if gt_name in s1_fl_i],
+                                   jrc_path=jrc_fl_paths[jrc_idx[i]] if i in jrc_idx else None))
+            failed = {}
+            for event in events:
+                event_invalid = [fp for fp in invalid if event['gt_name'] in fp]
+                if len(event_invalid) > 0:
+                    failed[event['gt_name']] = f'These downloads are not valid: {event_invalid}'
+
+            run_events(events, dt_set=dt_set, out_dir=out_dir, generated_img_path=generated_img_path,
+                       jobs=args.jobs, ledger=ledger, stage_workers=args.stage_workers, features=args.features,
+                       separate_features=args.separate_features, chip_size=args.chip_size,
+                       chip_overlap=args.chip_overlap, checksum_outputs=args.checksum_outputs, failed=failed)
+
+    if args.export_zarr is not None:
+        from .products import event_products
+        from .zarr_export import export_zarr
+        for dt_set in dt_set_lst:
+            products = event_products(dt_set, out_dir, generated_img_path,
+                                      ledger=ledger if dt_set != 'unosat' else None)
+            export_zarr(products, args.export_zarr, dt_set, chunk=args.zarr_chunk, jobs=args.jobs)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Storage layout autotuner: measures, on a sample window of a product of each type (S2, S1, CLASS, NDWI, GT and JRC),
+the size and the encode and decode throughput of candidate `StorageProfile`s (codec, predictor, block size and
+interleave), and chooses a profile per product type, which the writers then use (see `floodsnet.storage`).
+
+The samples are encoded to in-memory GeoTIFFs, so no files are written. Decode throughput is measured reading the
+whole sample, and window reads (as for training chips) reading random windows of it, which is where the block size
+matters.
+
+>>> results = tune_products(['usgs_EVENT_20200101_T33TWL_S2.tif', 'usgs_EVENT_CLASS.tif'])
+>>> print(results_table(results))
+>>> from floodsnet.storage import save_profiles
+>>> save_profiles(choose_profiles(results), 'storage_profiles.json')  # then run with --storage-profiles
+"""
+import itertools
+import time
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import rasterio as rio
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+
+from .storage import StorageProfile, product_type
+
+CANDIDATE_CODECS = [('LZW', None), ('DEFLATE', 6), ('ZSTD', 1), ('ZSTD', 9), ('LERC_ZSTD', 9)]
+CANDIDATE_PREDICTORS = [1, 'auto']
+CANDIDATE_BLOCKSIZES = [256, 512]
+CANDIDATE_INTERLEAVES = ['PIXEL', 'BAND']
+
+
+def candidate_profiles(count: int) -> list:
+    """Candidate profiles for a product with `count` bands: every codec, predictor (none for LERC) and block size,
+    with pixel and band interleave if it has several bands."""
+    interleaves = CANDIDATE_INTERLEAVES if count > 1 else ['BAND']
+    candidates = []
+    for (codec, level), predictor, blocksize, interleave in itertools.product(
+            CANDIDATE_CODECS, CANDIDATE_PREDICTORS, CANDIDATE_BLOCKSIZES, interleaves):
+        if codec.startswith('LERC') and predictor != 1:
+            continue
+        candidates.append(StorageProfile(compress=codec, predictor=predictor, blocksize=blocksize,
+                                         interleave=interleave, level=level))
+    return candidates
+
+
+def read_sample(path: Union[str, Path], size: int = 1024) -> tuple:
+    """Reads the central `size` x `size` window (or the whole image, if smaller) of all the bands of `path`. Returns
+    (array, rasterio profile of the sample)."""
+    with rio.open(path) as src:
+        width, height = min(size, src.width), min(size, src.height)
+        window = Window((src.width - width) // 2, (src.height - height) // 2, width, height)
+        data = src.read(window=window)
+        profile = dict(driver='GTiff', width=width, height=height, count=src.count, dtype=src.dtypes[0],
+                       crs=src.crs, transform=src.window_transform(window), nodata=src.nodata)
+    return data, profile
+
+
+def _best_time(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def measure_profile(data: np.ndarray, sample_profile: dict, profile: StorageProfile, repeat: int = 3,
+                    window: int = 256, n_windows: int = 16) -> dict:
+    """Encodes `data` with `profile` to an in-memory GeoTIFF and reads it back (the best of `repeat` runs each).
+    Returns the compressed size, its ratio to the raw size, the encode and decode throughput in MB/s of raw data,
+    and the mean time (ms) of a read of a random `window` x `window` window."""
+    options = dict(sample_profile, **profile.creation_options(sample_profile['dtype']))
+    raw_mb = data.nbytes / 1e6
+    memfiles = []
+
+    def encode():
+        memfile = MemoryFile()
+        with memfile.open(**options) as dst:
+            dst.write(data)
+        memfiles.append(memfile)
+
+    encode_s = _best_time(encode, repeat)
+    memfile = memfiles.pop(0)
+    for other in memfiles:
+        other.close()
+    nbytes = memfile.getbuffer().nbytes
+    # each run opens the file again: GDAL caches the decoded blocks of an open dataset
+
+    def decode():
+        with memfile.open() as src:
+            return src.read()
+
+    decode_s = _best_time(decode, repeat)
+    if not np.array_equal(decode(), data):
+        raise ValueError(f'{profile} is not lossless.')
+    rng = np.random.default_rng(0)
+    height, width = data.shape[1:]
+    size = min(window, width, height)
+    windows = [Window(int(rng.integers(0, width - size + 1)), int(rng.integers(0, height - size + 1)), size, size)
+               for _ in range(n_windows)]
+
+    def read_windows():
+        with memfile.open() as src:
+            return [src.read(window=w) for w in windows]
+
+    window_s = _best_time(read_windows, repeat)
+    memfile.close()
+    return {'size_mb': nbytes / 1e6, 'ratio': nbytes / data.nbytes, 'encode_mbps': raw_mb / encode_s,
+            'decode_mbps': raw_mb / decode_s, 'window_ms': 1000 * window_s / n_windows}
+
+
+def tune_products(paths: list, sample_size: int = 1024, repeat: int = 3) -> list:
+    """Measures the candidate profiles (see `candidate_profiles`) on a sample of each product in `paths`, one per
+    product type (the first of each type is used). Returns a list of dicts, one per product type and profile."""
+    samples = {}
+    for fp in paths:
+        ptype = product_type(fp)
+        if ptype is None:
+            print(f'{fp} is not a product of a known type. Leaving it out.')
+        elif ptype not in samples:
+            samples[ptype] = fp
+    results = []
+    for ptype, fp in samples.items():
+        data, sample_profile = read_sample(fp, sample_size)
+        print(f'Tuning {ptype} on a {data.shape} {data.dtype} sample of {fp}')
+        for profile in candidate_profiles(data.shape[0]):
+            row = {'product': ptype, 'compress': profile.compress, 'level': profile.level,
+                   'predictor': profile.predictor, 'blocksize': profile.blocksize, 'interleave': profile.interleave}
+            row.update(measure_profile(data, sample_profile, profile, repeat=repeat))
+            results.append(row)
+    return results
+
+
+def choose_profiles(results: list, min_decode: float = 0.5, min_encode: float = 0.1) -> dict:
+    """Chooses, for each product type, the smallest profile among those that decode at least `min_decode` times as
+    fast as the fastest one, and encode at least `min_encode` times as fast. Returns {product type: StorageProfile}."""
+    chosen = {}
+    for ptype in dict.fromkeys(row['product'] for row in results):
+        rows = [row for row in results if row['product'] == ptype]
+        max_decode = max(row['decode_mbps'] for row in rows)
+        max_encode = max(row['encode_mbps'] for row in rows)
+        fast = [row for row in rows
+                if row['decode_mbps'] >= min_decode * max_decode and row['encode_mbps'] >= min_encode * max_encode]
+        best = min(fast, key=lambda row: (row['size_mb'], -row['decode_mbps']))
+        chosen[ptype] = StorageProfile(compress=best['compress'], predictor=best['predictor'],
+                                       blocksize=best['blocksize'], interleave=best['interleave'], level=best['level'])
+    return chosen
+
+
+def results_table(results: list) -> str:
+    """`results` as a text table, by product type and from the smallest size."""
+    header = (f'{"product":<8}{"compress":<11}{"level":>6}{"pred":>6}{"block":>7}{"interleave":>11}{"size MB":>10}'
+              f'{"ratio":>7}{"enc MB/s":>10}{"dec MB/s":>10}{"win ms":>8}')
+    lines = [header, '-' * len(header)]
+    for row in sorted(results, key=lambda row: (row['product'], row['size_mb'])):
+        level = row['level'] if row['level'] is not None else '-'
+        lines.append(f'{row["product"]:<8}{row["compress"]:<11}{level:>6}{row["predictor"]:>6}{row["blocksize"]:>7}'
+                     f'{row["interleave"]:>11}{row["size_mb"]:>10.2f}{row["ratio"]:>7.3f}{row["encode_mbps"]:>10.1f}'
+                     f'{row["decode_mbps"]:>10.1f}{row["window_ms"]:>8.2f}')
+    return '\n'.join(lines)
@@ -4,7 +4,78 @@ from pathlib import Path
 import numpy as np
 import rasterio as rio
 
+from .storage import finalize, update_profile
+from .tracing import traced
 
+
+# jrc categories of the class rules
+JRC_LT1 = 'lt1'  # jrc < 1, i.e., not water in JRC
+JRC_ANY = 'any'  # any jrc value
+_JRC_COLUMNS = [JRC_LT1, 1, 2]  # plus a last column for any other jrc value
+
+# (gt value, jrc category, class) rules of each dataset. jrc categories are JRC_LT1, 1 (seasonal water), 2 (permanent
+# water) or JRC_ANY. Any (gt, jrc) combination without a rule is class 0 (land/non-water).
+CLASS_RULES = {
+    'world_floods': [
+        (2, 2, 1),  # water, permanent in JRC -> permanent water
+        (2, 1, 2),  # water, seasonal in JRC -> seasonal water
+        (2, JRC_LT1, 3),  # water, not in JRC -> flood
+        (3, JRC_ANY, 9),  # cloud
+        (0, JRC_ANY, 255),  # no data
+    ],
+    'sen1_floods11': [  # dataset has its own jrc with only perm water
+        (1, 2, 1),
+        (1, 1, 2),
+        (1, JRC_LT1, 3),
+        (-1, JRC_ANY, 255),
+    ],
+    'usgs': [
+        (1, 2, 1),
+        (1, 1, 2),
+        (1, JRC_LT1, 3),
+        (4, JRC_ANY, 9),
+        (0, JRC_ANY, 255),
+    ],
+    'unosat': [
+        (1, 2, 1),
+        (1, 1, 2),
+        (1, JRC_LT1, 3),
+        (0, JRC_ANY, 255),
+    ],
+}
+
+
+def class_lut(rules: list) -> tuple:
+    """Builds the lookup table of the class `rules` (see `CLASS_RULES`): a uint8 array with one row per gt value, from
+    the smallest gt value in the rules, plus a last row for the gt values without rules, and one column per jrc
+    category. Returns the table and the gt value of its first row."""
+    gt_values = [gt for gt, _, _ in rules]
+    gt_min = min(gt_values)
+    lut = np.zeros((max(gt_values) - gt_min + 2, len(_JRC_COLUMNS) + 1), dtype=np.uint8)
+    for gt, jrc, cls in rules:
+        if jrc == JRC_ANY:
+            lut[gt - gt_min, :] = cls
+        else:
+            lut[gt - gt_min, _JRC_COLUMNS.index(jrc)] = cls
+    return lut, gt_min
+
+
+def apply_class_lut(gt: np.ndarray, jrc: np.ndarray, lut: np.ndarray, gt_min: int, out: np.ndarray = None):
+    """Classifies each pixel of (a block of) `gt` and `jrc` with one gather from the lookup table `lut` (see
+    `class_lut`). gt values are truncated to integers, as with astype(int)."""
+    n_gt = lut.shape[0] - 1
+    gt_idx = gt.astype('int32') - gt_min
+    gt_idx[(gt_idx < 0) | (gt_idx >= n_gt)] = n_gt
+    jrc_col = np.full(jrc.shape, len(_JRC_COLUMNS), dtype=np.int32)
+    jrc_col[jrc < 1] = 0
+    jrc_col[jrc == 1] = 1
+    jrc_col[jrc == 2] = 2
+    gt_idx *= lut.shape[1]
+    gt_idx += jrc_col
+    return np.take(lut.ravel(), gt_idx, out=out)
+
+
+@traced('calc_classes')
 def calc_classes(dt_set: str, s2_name: str, out_dir: str, profile, gt_path=None, jrc_path=None):
     """Calculate flood classifications and save the result to the output directory.
     Classification coding:
@@ -14,68 +85,38 @@ def calc_classes(dt_set: str, s2_name: str, out_dir: str, profile, gt_path=None,
           3 - flood
           9 - cloud
         255 - No data
+    The rules of each dataset are in `CLASS_RULES`. The classes are computed block by block over the internal tiles of
+    the output, which has the same grid as the gt and jrc images.
     """
     # generate path for reprojected S2 image in the output directory
     out_path = os.path.join(out_dir, '_'.join([dt_set, s2_name, 'CLASS.tif']))
     if os.path.exists(out_path):
         print(f'{out_path} already exists.')
-        return
-    if gt_path:
-        with rio.open(gt_path) as src:
-            gt = src.read(1).astype('int')
-            print('gt type:', type(gt[0]))
-    else:
+        return out_path
+    if not gt_path:
         print('No ground truth... exiting without bands.')
         return
     if not jrc_path:
         print(f'We are missing JRC Yearly and Seasonal data for {s2_name}...')
         return
-    else:
-        with rio.open(jrc_path) as src:
-            jrc = src.read(1)
-        if dt_set == 'world_floods':
-            non_water = np.where(gt == 1, 0, 0)
-            perm_water = np.where((gt == 2) & (jrc == 2), 1, 0)
-            szn_water = np.where((gt == 2) & (jrc == 1), 2, 0)
-            flood = np.where((gt == 2) & (jrc < 1), 3, 0)
-            cloud = np.where(gt == 3, 9, 0)
-            no_data = np.where(gt == 0, 255, 0)
-            all_classes = non_water + perm_water + szn_water + flood + cloud + no_data
-        elif dt_set == 'sen1_floods11':
-            non_water = np.where(gt == 0, 0, 0)
-            perm_water = np.where((gt == 1) & (jrc == 2), 1, 0)
-            # dataset has its own jrc with only perm water
-            szn_water = np.where((gt == 1) & (jrc == 1), 2, 0)
-            flood = np.where((gt == 1) & (jrc < 1), 3, 0)
-            no_data = np.where(gt == -1, 255, 0)
-            all_classes = non_water + perm_water + szn_water + flood + no_data
-        elif dt_set == 'usgs':
-            non_water = np.where(gt == 2, 0, 0)
-            perm_water = np.where((gt == 1) & (jrc == 2), 1, 0)
-            szn_water = np.where((gt == 1) & (jrc == 1), 2, 0)
-            flood = np.where((gt == 1) & (jrc < 1), 3, 0)
-            cloud = np.where(gt == 4, 9, 0)
-            no_data = np.where(gt == 0, 255, 0)
-            all_classes = non_water + perm_water + szn_water + flood + cloud + no_data
-        elif dt_set == 'unosat':
-            perm_water = np.where((gt == 1) & (jrc == 2), 1, 0)
-            szn_water = np.where((gt == 1) & (jrc == 1), 2, 0)
-            flood = np.where((gt == 1) & (jrc < 1), 3, 0)
-            no_data = np.where(gt == 0, 255, 0)
-            all_classes = perm_water + szn_water + flood + no_data
+    if dt_set not in CLASS_RULES:
+        raise ValueError(f'dt_set {dt_set} has no class rules. Options are {list(CLASS_RULES)}.')
+    lut, gt_min = class_lut(CLASS_RULES[dt_set])
 
     # write classified raster to output directory
     profile.update(
         dtype='uint8',
         count=1,
         nodata=255,
-        compress='lzw',
         interleave='band',
-        tiled=True,
     )
-    with rio.open(out_path, 'w', **profile) as dst:
-        dst.write(all_classes.astype(np.uint8), 1)
+    update_profile(profile, out_path)
+    with rio.open(gt_path) as gt_src, rio.open(jrc_path) as jrc_src, rio.open(out_path, 'w', **profile) as dst:
+        for _, window in dst.block_windows(1):
+            classes = apply_class_lut(gt_src.read(1, window=window), jrc_src.read(1, window=window), lut, gt_min)
+            dst.write(classes, 1, window=window)
         dst.set_band_description(1, 'CLASS')
 
+    finalize(out_path)
     print(f'{out_path} saved.')
-    return
+    return out_path
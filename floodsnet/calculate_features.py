@@ -1,9 +1,29 @@
+import ast
 import os
 
 import numpy as np
 import rasterio as rio
 
+from .storage import finalize, update_profile
+from .tracing import traced
 
+# band number (starting with 1) of each band in the reprojected S2 images
+S2_BANDS = {'B1': 1, 'B2': 2, 'B3': 3, 'B4': 4, 'B5': 5, 'B6': 6, 'B7': 7, 'B8': 8, 'B8A': 9, 'B9': 10, 'B10': 11,
+            'B11': 12, 'B12': 13}
+
+# spectral indices: name -> (band-math expression of the S2 bands, scale). Bands are reflectance x 10000. Indices are
+# saved as int16 (index x scale); the scale is also saved in the SCALE tag of each band.
+SPECTRAL_INDICES = {
+    'NDWI': ('(B3 - B8) / (B3 + B8)', 10000),  # McFeeters (1996)
+    'MNDWI': ('(B3 - B11) / (B3 + B11)', 10000),  # Xu (2006)
+    'NDVI': ('(B8 - B4) / (B8 + B4)', 10000),
+    'AWEISH': ('B2 + 2.5 * B3 - 1.5 * (B8 + B11) - 0.25 * B12', 0.1),  # Feyisa et al. (2014), as reflectance x 1000
+}
+# tag prefix of the indices saved one per file, so that they never share a file (or layer name) with calc_ndwi's NDWI
+FEATURE_PREFIX = 'FEAT-'
+
+
+@traced('calc_ndwi')
 def calc_ndwi(s2_path: str, dt_set: str, s2_name: str, out_dir: str, profile):
     """
         s2_path should point to the reprojected s2 saved in the output directory.
@@ -11,39 +31,173 @@ def calc_ndwi(s2_path: str, dt_set: str, s2_name: str, out_dir: str, profile):
         Calculate NDWI for Sentinel-2 images.
         NDWI = (Green - NIR) / (Green + NIR)
 
-        Return NDWI and source EPSG and UTM EPSG
+        Computed block by block over the internal tiles of the output, in int32/float32, so memory use does not depend
+        on the size of the image. Saved as int16 (NDWI x 10000).
     """
     # generate path for reprojected S2 image in the output directory
     out_path = os.path.join(out_dir, '_'.join([s2_name, 'NDWI.tif']))
     if os.path.exists(out_path):
         print(f'{out_path} already exists.')
-        return
-    with rio.open(s2_path, 'r') as src:
-        b3 = src.read(3).astype(int)  # bands index starting with 1. Band 3 = Green
-        b8 = src.read(8).astype(int)  # Band 8 = Near Infra Red
-        ndwi = _get_ndwi_formula(b3, b8)
+        return out_path
     # write NDWI to the output directory
-    profile.update(
-        dtype='int16',
-        count=1,
-        compress='lzw',
-        interleave='band',
-        tiled=True,
-    )
-    with rio.open(out_path, 'w', **profile) as dst:
-        dst.write(np.array(ndwi * 10000).astype('int16'), 1)
+    _update_index_profile(profile, count=1, out_path=out_path)
+    buffers = {}
+    with rio.open(s2_path, 'r') as src, rio.open(out_path, 'w', **profile) as dst:
+        for _, window in dst.block_windows(1):
+            shape = (int(window.height), int(window.width))
+            if shape not in buffers:  # edge blocks can be smaller
+                buffers[shape] = _ndwi_buffers(shape)
+            b3, b8, dif, tot, ndwi, out = buffers[shape]
+            src.read(3, window=window, out=b3)  # bands index starting with 1. Band 3 = Green
+            src.read(8, window=window, out=b8)  # Band 8 = Near Infra Red
+            _get_ndwi_formula(b3, b8, out=(dif, tot, ndwi))
+            np.multiply(ndwi, 10000, out=ndwi)
+            np.copyto(out, ndwi, casting='unsafe')  # truncates, as astype('int16')
+            dst.write(out, 1, window=window)
         dst.set_band_description(1, 'NDWI')
 
+    finalize(out_path)
     print(f'{out_path} saved.')
-    return
+    return out_path
+
 
+def _ndwi_buffers(shape: tuple) -> tuple:
+    """Green, NIR, difference, sum, NDWI and output buffers for a block of `shape`."""
+    return (np.empty(shape, dtype='int32'), np.empty(shape, dtype='int32'), np.empty(shape, dtype='int32'),
+            np.empty(shape, dtype='int32'), np.empty(shape, dtype='float32'), np.empty(shape, dtype='int16'))
 
-def _get_ndwi_formula(b3, b8):
-    b3_b8_dif = np.subtract(b3, b8, out=np.zeros(b3.shape, dtype=int))
-    b3_b8_sum = np.add(b3, b8, out=np.zeros(b3.shape, dtype=int))
+
+def _get_ndwi_formula(b3, b8, out=None):
+    """(b3 - b8) / (b3 + b8), or 0 where b3 + b8 is 0. `out` can be a tuple with preallocated difference, sum and
+    result arrays; otherwise they are allocated as int32, int32 and float32."""
+    if out is None:
+        out = (np.empty(b3.shape, dtype='int32'), np.empty(b3.shape, dtype='int32'),
+               np.empty(b3.shape, dtype='float32'))
+    b3_b8_dif, b3_b8_sum, ndwi = out
+    np.subtract(b3, b8, out=b3_b8_dif)
+    np.add(b3, b8, out=b3_b8_sum)
+    ndwi.fill(0)
     return np.divide(
         b3_b8_dif,
         b3_b8_sum,
-        out=np.zeros(b3.shape, dtype=float),
+        out=ndwi,
         where=b3_b8_sum != 0,
     )
+
+
+def _update_index_profile(profile, count: int, out_path):
+    """Updates the profile of the reprojected S2 image for `count` int16 index bands, written to `out_path`."""
+    profile.update(
+        dtype='int16',
+        count=count,
+        interleave='band',
+    )
+    return update_profile(profile, out_path)
+
+
+_BIN_OPS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply}
+
+
+def compile_expression(expression: str):
+    """Compiles a band-math `expression` (e.g., '(B3 - B8) / (B3 + B8)') of the S2 bands in `S2_BANDS`, numbers, +, -,
+    *, / and parentheses, into a function of a dict of band arrays. Division by 0 gives 0.
+    Returns the function and the set of bands it uses."""
+    tree = ast.parse(expression, mode='eval')
+    bands = set()
+
+    def build(node):
+        if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+            left, right, op = build(node.left), build(node.right), _BIN_OPS[type(node.op)]
+            return lambda arrs: op(left(arrs), right(arrs))
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div):
+            left, right = build(node.left), build(node.right)
+
+            def divide(arrs):
+                num, den = np.asarray(left(arrs), dtype='float32'), np.asarray(right(arrs), dtype='float32')
+                num, den = np.broadcast_arrays(num, den)
+                return np.divide(num, den, out=np.zeros(num.shape, dtype='float32'), where=den != 0)
+            return divide
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand = build(node.operand)
+            return (lambda arrs: np.negative(operand(arrs))) if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            value = np.float32(node.value)
+            return lambda arrs: value
+        if isinstance(node, ast.Name) and node.id in S2_BANDS:
+            bands.add(node.id)
+            name = node.id
+            return lambda arrs: arrs[name]
+        raise ValueError(f'Not valid in a band-math expression: {ast.unparse(node)} (in {expression})')
+
+    return build(tree.body), bands
+
+
+@traced('calc_features')
+def calc_features(s2_path: str, dt_set: str, s2_name: str, out_dir: str, profile, features=None,
+                  separate: bool = False) -> list:
+    """
+        s2_path should point to the reprojected s2 saved in the output directory.
+
+        Calculates the spectral indices in `features` (names in `SPECTRAL_INDICES`, or a dict of
+        name -> (expression, scale); defaults to all of `SPECTRAL_INDICES`) in a single pass: each block of the S2
+        image is read once and all the indices are computed from it.
+        Saves them as the bands of one {s2_name}_FEATURES.tif, or, if `separate`, as one {s2_name}_FEAT-{name}.tif
+        per index (not {s2_name}_{name}.tif, which for NDWI is the output of `calc_ndwi`). Returns the list of saved
+        paths.
+    """
+    if features is None:
+        features = SPECTRAL_INDICES
+    if not isinstance(features, dict):
+        unknown = [name for name in features if name not in SPECTRAL_INDICES]
+        if unknown:
+            raise ValueError(f'Unknown spectral indices {unknown}. Options are {list(SPECTRAL_INDICES)}.')
+        features = {name: SPECTRAL_INDICES[name] for name in features}
+    names = list(features)
+    if separate:
+        out_paths = [os.path.join(out_dir, '_'.join([s2_name, f'{FEATURE_PREFIX}{name}.tif'])) for name in names]
+    else:
+        out_paths = [os.path.join(out_dir, '_'.join([s2_name, 'FEATURES.tif']))]
+    if all(os.path.exists(fp) for fp in out_paths):
+        print(f'{out_paths} already exist.')
+        return out_paths
+
+    compiled = {}
+    bands = set()
+    for name, (expression, scale) in features.items():
+        func, used = compile_expression(expression)
+        compiled[name] = (func, np.float32(scale))
+        bands |= used
+    bands = sorted(bands, key=S2_BANDS.get)
+
+    outputs = []
+    if separate:
+        for name, fp in zip(names, out_paths):
+            outputs.append((fp, [name]))
+    else:
+        outputs.append((out_paths[0], names))
+    info = np.iinfo('int16')
+    with rio.open(s2_path, 'r') as src:
+        dsts = [rio.open(fp, 'w', **_update_index_profile(dict(profile), count=len(out_names), out_path=fp))
+                for fp, out_names in outputs]
+        try:
+            for _, window in dsts[0].block_windows(1):
+                data = src.read([S2_BANDS[b] for b in bands], window=window, out_dtype='float32')
+                arrs = dict(zip(bands, data))
+                for dst, (_, out_names) in zip(dsts, outputs):
+                    for i, name in enumerate(out_names, start=1):
+                        func, scale = compiled[name]
+                        index = np.broadcast_to(func(arrs), data.shape[1:]) * scale
+                        np.clip(index, info.min, info.max, out=index)
+                        dst.write(index.astype('int16'), i, window=window)  # truncates, as in calc_ndwi
+            for dst, (_, out_names) in zip(dsts, outputs):
+                for i, name in enumerate(out_names, start=1):
+                    dst.set_band_description(i, name)
+                    dst.update_tags(i, SCALE=str(features[name][1]), EXPRESSION=features[name][0])
+        finally:
+            for dst in dsts:
+                dst.close()
+
+    for fp in out_paths:
+        finalize(fp)
+        print(f'{fp} saved.')
+    return out_paths
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Cuts the harmonized layers of an event (S2, S1, NDWI, JRC and CLASS, all on the same grid) into aligned, fixed-size
+training chips, and indexes them in a Parquet file per event.
+
+Chips are read with windowed reads; with a chip size that is a multiple of the internal block size of the layers
+(256 or 512), each chip reads whole blocks only. Chips whose CLASS is all no data (255) are dropped.
+
+    {out_dir}/chips/{dt_set}/{event}/{chip_id}_{layer}.tif
+    {out_dir}/chips/index/{dt_set}_{event}.parquet
+The index folder can be read at once as a Parquet dataset (see `read_chip_index`).
+"""
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+
+from .tracing import traced
+
+CLASS_NODATA = 255
+# values of the CLASS layer (see `floodsnet.calculate_classes.calc_classes`), counted in the index
+CLASS_CODES = [0, 1, 2, 3, 9, CLASS_NODATA]
+# chips are many and small: fast ZSTD writes ~10x faster than LZW, and smaller
+CHIP_COMPRESSION = dict(compress='zstd', zstd_level=1)
+
+
+def chip_offsets(length: int, size: int, overlap: int = 0) -> list:
+    """Offsets of the chips of `size` pixels along an axis of `length` pixels, `size - overlap` apart. A last chip is
+    aligned with the end of the axis if the others do not reach it. Empty if `length` < `size`."""
+    if overlap < 0 or overlap >= size:
+        raise ValueError(f'overlap must be between 0 and size - 1 ({size - 1}), not {overlap}.')
+    if length < size:
+        return []
+    offsets = list(range(0, length - size + 1, size - overlap))
+    if offsets[-1] + size < length:
+        offsets.append(length - size)
+    return offsets
+
+
+def chip_dir(out_dir: Union[str, Path], dt_set: str, event: str) -> Path:
+    return Path(out_dir) / 'chips' / dt_set / event
+
+
+def index_path(out_dir: Union[str, Path], dt_set: str, event: str) -> Path:
+    return Path(out_dir) / 'chips' / 'index' / f'{dt_set}_{event}.parquet'
+
+
+def _chip_profile(src, window: Window, size: int) -> dict:
+    profile = src.profile.copy()
+    profile.update(driver='GTiff', width=size, height=size, transform=src.window_transform(window),
+                   interleave='band', **CHIP_COMPRESSION)
+    if size % 16 == 0:
+        profile.update(tiled=True, blockxsize=min(size, 256), blockysize=min(size, 256))
+    else:
+        profile.update(tiled=False)
+        profile.pop('blockxsize', None)
+        profile.pop('blockysize', None)
+    return profile
+
+
+@traced('make_chips')
+def make_chips(layers: dict, dt_set: str, event: str, out_dir: Union[str, Path], size: int = 512,
+               overlap: int = 0) -> list:
+    """Cuts the `layers` ({layer name: path}, including 'CLASS') of `event` into chips of `size` x `size` pixels that
+    overlap by `overlap` pixels, and writes their index (see `index_path`). Layers that are not on the grid of the
+    CLASS layer are left out. Returns the paths of the chips and of the index."""
+    import pandas as pd  # only needed to write the index
+
+    out_chip_dir = chip_dir(out_dir, dt_set, event)
+    out_index = index_path(out_dir, dt_set, event)
+    out_chip_dir.mkdir(parents=True, exist_ok=True)
+    out_index.parent.mkdir(parents=True, exist_ok=True)
+
+    srcs = {name: rio.open(fp) for name, fp in layers.items()}
+    try:
+        ref = srcs['CLASS']
+        for name, src in list(srcs.items()):
+            if (src.width, src.height, src.transform) != (ref.width, ref.height, ref.transform):
+                print(f'{layers[name]} is not on the grid of {layers["CLASS"]}. Leaving it out of the chips.')
+                srcs.pop(name).close()
+
+        rows, chip_paths = [], []
+        for row_off in chip_offsets(ref.height, size, overlap):
+            for col_off in chip_offsets(ref.width, size, overlap):
+                window = Window(col_off, row_off, size, size)
+                classes = ref.read(1, window=window)
+                if np.all(classes == CLASS_NODATA):
+                    continue
+                chip_id = f'{dt_set}_{event}_{row_off}_{col_off}'
+                counts = np.bincount(classes.ravel(), minlength=256)
+                left, bottom, right, top = rio.windows.bounds(window, ref.transform)
+                row = {'chip_id': chip_id, 'dt_set': dt_set, 'event': event, 'row_off': row_off,
+                       'col_off': col_off, 'size': size, 'minx': left, 'miny': bottom, 'maxx': right, 'maxy': top,
+                       'crs': ref.crs.to_string() if ref.crs is not None else None}
+                row.update({f'class_{code}': int(counts[code]) for code in CLASS_CODES})
+                for name, src in srcs.items():
+                    fp = out_chip_dir / f'{chip_id}_{name}.tif'
+                    data = classes[None] if name == 'CLASS' else src.read(window=window)
+                    with rio.open(fp, 'w', **_chip_profile(src, window, size)) as dst:
+                        dst.write(data)
+                        dst.descriptions = src.descriptions
+                    row[f'path_{name}'] = str(fp)
+                    chip_paths.append(str(fp))
+                rows.append(row)
+    finally:
+        for src in srcs.values():
+            src.close()
+
+    columns = ['chip_id', 'dt_set', 'event', 'row_off', 'col_off', 'size', 'minx', 'miny', 'maxx', 'maxy', 'crs']
+    columns += [f'class_{code}' for code in CLASS_CODES] + [f'path_{name}' for name in srcs]
+    pd.DataFrame(rows, columns=columns).to_parquet(out_index, index=False)
+    print(f'{len(rows)} chips of {event} saved to {out_chip_dir}.')
+    return chip_paths + [str(out_index)]
+
+
+def read_chip_index(out_dir: Union[str, Path]):
+    """Reads the chip index of all the events in `out_dir` as a DataFrame."""
+    import pandas as pd
+    folder = Path(out_dir) / 'chips' / 'index'
+    files = sorted(folder.glob('*.parquet'))
+    if len(files) == 0:
+        return pd.DataFrame()
+    return pd.concat([pd.read_parquet(fp) for fp in files], ignore_index=True)
+
@@ -4,6 +4,7 @@ from pathlib import Path
 DOWNLOADED_IMG_PATH = Path('data/flood_training_datasets').resolve()
 HLS_LAND_TILE_PATH = Path('data/hls_land_tiles.json').resolve()
 OUT_DIR = Path('data/open_source_training').resolve()
+LEDGER_PATH = Path('data/floodsnet_ledger.sqlite').resolve()
 # GENERATED_IMG_PATH needs to be a gdrive forlder for Google Earth Engine to dwl
 GENERATED_IMG_PATH = Path('/Volumes/GoogleDrive/My Drive/projects/InProgress').resolve()
 
@@ -28,5 +29,74 @@ def parse_flood_training_data_args():
     parser.add_argument('-s2p', '--s2_tile_path',
                         default=HLS_LAND_TILE_PATH,
                         help='Path where the the hls/s2 land tiles are located')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=1,
+                        help='Number of worker processes used to process the events after the downloads are done. '
+                             'Default is 1, i.e., events are processed one at a time.')
+    parser.add_argument('--stage-workers', type=int,
+                        default=1,
+                        help='Number of threads used to run the independent stages of an event (e.g., NDWI and the '
+                             'resampling of S1, GT and JRC) in parallel. Default is 1.')
+    parser.add_argument('--stream', action='store_true',
+                        help='Process each event as soon as its own GEE downloads are done and synced, instead of '
+                             'waiting for the downloads of the whole dataset. Not used for unosat.')
+    parser.add_argument('--ledger', type=Path,
+                        default=LEDGER_PATH,
+                        help='Local SQLite file where the run state (GEE tasks and outputs of each event) is kept, '
+                             'so that restarted runs skip what is already done. Not used for unosat.')
+    parser.add_argument('--no-ledger', action='store_true',
+                        help='Do not use the run ledger; resume only from the files that exist.')
+    parser.add_argument('--checksum-outputs', action='store_true',
+                        help='Record a checksum of the content of each output in the ledger, which reads every '
+                             'output once more. By default only their size and modification time are recorded.')
+    parser.add_argument('--trace', type=Path,
+                        default=None,
+                        help='Record the time, I/O and memory of each stage of each event, and save them to this file '
+                             'as a Chrome trace (plus a .summary.json) at the end of the run.')
+    parser.add_argument('--features', nargs='+', default=[],
+                        choices=['NDWI', 'MNDWI', 'NDVI', 'AWEISH'],
+                        help='Spectral indices to calculate from each S2 image, in a single pass, as the bands of a '
+                             '_FEATURES.tif. Default is none (NDWI is always saved on its own).')
+    parser.add_argument('--separate-features', action='store_true',
+                        help='Save each index of --features to its own _FEAT-{index}.tif instead of as the bands of '
+                             'one file. NDWI in --features is then saved again as _FEAT-NDWI.tif, apart from the '
+                             '_NDWI.tif that is always saved.')
+    parser.add_argument('--output-format', default='gtiff', choices=['gtiff', 'cog'],
+                        help='Format of the outputs: tiled GeoTIFF (default) or Cloud-Optimized GeoTIFF with internal '
+                             'overviews (nearest for CLASS, GT, JRC and mosaic sources, average for the rest). '
+                             'Existing outputs are kept as they are; use --rebuild-stage to convert them.')
+    parser.add_argument('--cog-blocksize', type=int,
+                        default=512,
+                        help='Tile size, in pixels, of the COG outputs. Default is 512.')
+    parser.add_argument('--cog-level', type=int,
+                        default=6,
+                        help='DEFLATE compression level (1-9) of the COG outputs. Default is 6.')
+    parser.add_argument('--storage-profiles', type=Path,
+                        default=None,
+                        help='JSON file with the storage profile (codec, predictor, block size and interleave) of '
+                             'each product type (S2, S1, CLASS, NDWI, GT, JRC), e.g., as chosen by '
+                             'benchmarks/tune_storage.py. Types not in the file are written as LZW with 256 x 256 '
+                             'tiles (the default).')
+    parser.add_argument('--chip-size', type=int,
+                        default=None,
+                        help='Cut the S2, S1, NDWI, JRC and CLASS of each event into aligned chips of this size (in '
+                             'pixels), indexed in a Parquet file per event. Chips that are all no data are dropped. '
+                             'Default is no chips.')
+    parser.add_argument('--chip-overlap', type=int,
+                        default=0,
+                        help='Overlap, in pixels, between neighbouring chips. Default is 0.')
+    parser.add_argument('--export-zarr', type=Path,
+                        default=None,
+                        help='At the end of the run, export the products of every event to this Zarr store, with '
+                             'one group per event and one chunked array per layer. Events that did not change since '
+                             'the last export are skipped. Requires zarr.')
+    parser.add_argument('--zarr-chunk', type=int,
+                        default=512,
+                        help='Height and width, in pixels, of the chunks of the Zarr arrays. Default is 512.')
+    parser.add_argument('--rebuild-stage', action='append', default=[],
+                        choices=['reproject', 'ndwi', 'features', 'resample_s1', 'resample_gt', 'resample_jrc',
+                                 'classes', 'chips'],
+                        help='Delete and recompute the outputs of this stage, and of the stages downstream of it, '
+                             'that are recorded in the ledger. Can be repeated.')
 
     return parser.parse_args()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Run configuration: the folders the flood training datasets are read from and generated in. `__main__` builds it from
+the command-line arguments and passes it to the functions that need it, so that nothing parses the arguments at import
+time.
+
+"""
+from dataclasses import dataclass
+from pathlib import Path
+
+from .cli import DOWNLOADED_IMG_PATH, GENERATED_IMG_PATH, HLS_LAND_TILE_PATH, OUT_DIR
+
+
+@dataclass
+class Config:
+    """Folders of a run. Defaults are the same as the command-line defaults (see `cli.py`).
+    path: where the flood training datasets have been downloaded
+    generated_path: where the GEE images are exported to (i.e., a gdrive folder)
+    out_dir: where the outputs are saved
+    s2_tile_path: hls/s2 land tiles file
+    """
+    path: Path = DOWNLOADED_IMG_PATH
+    generated_path: Path = GENERATED_IMG_PATH
+    out_dir: Path = OUT_DIR
+    s2_tile_path: Path = HLS_LAND_TILE_PATH
+
+    @classmethod
+    def from_args(cls, args):
+        """Builds the configuration from the arguments of `parse_flood_training_data_args`."""
+        return cls(path=Path(args.path), generated_path=Path(args.generated_path), out_dir=Path(args.out_dir),
+                   s2_tile_path=Path(args.s2_tile_path))
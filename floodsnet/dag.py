@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal DAG of processing stages whose outputs are keyed by a hash of their inputs, parameters and code version, so
+that only the stages whose key changed (stale) are recomputed.
+
+"""
+import hashlib
+import inspect
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .tracing import span
+
+
+def code_version(*funcs) -> str:
+    """Hash of the source code of `funcs`, used as the code version of a stage."""
+    h = hashlib.sha256()
+    for func in funcs:
+        try:
+            source = inspect.getsource(func)
+        except (OSError, TypeError):
+            source = getattr(func, '__qualname__', repr(func))
+        h.update(source.encode())
+    return h.hexdigest()[:16]
+
+
+def input_fingerprint(fp) -> str:
+    """Identifies the content of input file `fp` by its path, size and modification time, without reading it."""
+    try:
+        st = os.stat(fp)
+    except (FileNotFoundError, TypeError):
+        return f'{fp}:missing'
+    return f'{fp}:{st.st_size}:{st.st_mtime_ns}'
+
+
+class Node:
+    """A stage of the DAG. When run, it is called as `func(*results of deps, **params)`.
+    `inputs` are the files the stage reads that are not produced by other stages, and `version` identifies its code
+    (defaults to a hash of the source of `func`). `load`, if given, returns the result of the stage from its existing
+    outputs, without running it; it is used when the stage is up to date but a stale stage depends on it.
+    """
+
+    def __init__(self, name: str, func, deps=(), inputs=(), params=None, version=None, load=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.inputs = [str(fp) for fp in inputs if fp is not None]
+        self.params = params if params is not None else {}
+        self.version = version if version is not None else code_version(func)
+        self.load = load
+
+
+class Dag:
+    """A set of `Node`s, keyed and run in dependency order."""
+
+    def __init__(self, nodes: list):
+        self.nodes = {node.name: node for node in nodes}
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> list:
+        order = []
+        visiting = set()
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f'The DAG has a cycle through {name}.')
+            visiting.add(name)
+            for dep in self.nodes[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.nodes:
+            visit(name)
+        return order
+
+    def keys(self) -> dict:
+        """Returns the key of each node: a hash of its name, code version, parameters, input fingerprints and the keys
+        of the nodes it depends on (so a change upstream makes all the nodes downstream stale)."""
+        keys = {}
+        for name in self.order:
+            node = self.nodes[name]
+            desc = json.dumps({
+                'name': name,
+                'version': node.version,
+                'params': node.params,
+                'inputs': [input_fingerprint(fp) for fp in node.inputs],
+                'deps': [keys[dep] for dep in node.deps],
+            }, sort_keys=True, default=str)
+            keys[name] = hashlib.sha256(desc.encode()).hexdigest()
+        return keys
+
+    def _call(self, node: Node, args: list, trace_attrs: dict):
+        with span(node.name, 'stage', **trace_attrs):
+            return node.func(*args, **node.params)
+
+    def run(self, stored_keys: dict = None, max_workers: int = 1, on_stale=None, trace_attrs: dict = None):
+        """Runs the nodes that are not up to date, i.e., whose key differs from the one in `stored_keys` (a dict of node
+        name to the key of its existing outputs). A node without a stored key is run as well.
+        `on_stale(name)` is called before running a node whose stored key is outdated, e.g., to remove its outputs.
+        Nodes whose dependencies are done run in parallel on up to `max_workers` threads. Each node run is traced as a
+        span (see `floodsnet.tracing`) with `trace_attrs`.
+        Returns (results, keys, ran): the results of the nodes that were run or loaded, the key of every node, and the
+        names of the nodes that were run, in the order they finished.
+        """
+        stored_keys = stored_keys if stored_keys is not None else {}
+        trace_attrs = trace_attrs if trace_attrs is not None else {}
+        keys = self.keys()
+        to_run = [name for name in self.order if stored_keys.get(name) != keys[name]]
+        # up-to-date nodes only need their result if a node to run depends on them
+        to_load = {dep for name in to_run for dep in self.nodes[name].deps if dep not in to_run}
+
+        results = {}
+        for name in self.order:
+            if name in to_load:
+                node = self.nodes[name]
+                results[name] = node.load() if node.load is not None else None
+
+        ran = []
+        remaining = list(to_run)
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            running = {}
+            while remaining or running:
+                for name in list(remaining):
+                    node = self.nodes[name]
+                    if any(dep in remaining or dep in running.values() for dep in node.deps):
+                        continue
+                    remaining.remove(name)
+                    if on_stale is not None and name in stored_keys:
+                        on_stale(name)
+                    args = [results[dep] for dep in node.deps]
+                    running[executor.submit(self._call, node, args, trace_attrs)] = name
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    results[name] = future.result()
+                    ran.append(name)
+        return results, keys, ran
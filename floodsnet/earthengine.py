@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy access to the Google Earth Engine API. `ee` is imported and initialised on the first GEE call instead of at
+import time, so that importing floodsnet (e.g., in a worker process that only processes rasters) is cheap and does not
+need EE credentials.
+
+"""
+import threading
+
+_lock = threading.Lock()
+_initialized = False
+
+
+def get_ee():
+    """Returns the `ee` module, initialising Earth Engine the first time it is called."""
+    global _initialized
+    import ee
+    if not _initialized:
+        with _lock:
+            if not _initialized:
+                ee.Initialize()
+                _initialized = True
+    return ee
@@ -1,9 +1,11 @@
-import ee
+from .earthengine import get_ee
+from .tracing import traced
 
 
 # Modified from WorldFloods GitHub:
 # https://github.com/spaceml-org/ml4floods/blob/main/ml4floods/data/ee_download.py
 def _get_collection(collection_name, date_start, date_end, bounds, polarisation):
+    ee = get_ee()
     collection = ee.ImageCollection(collection_name)
     collection_filtered = collection.filterDate(
                                      date_start, date_end
@@ -18,7 +20,8 @@ def _get_collection(collection_name, date_start, date_end, bounds, polarisation)
     return collection_filtered, n_images
 
 
-def download_s1_imgs(date_start: str, date_end: str, bounds: ee.Geometry, dt_set: str, img_name: str,
+@traced('submit_s1', 'gee')
+def download_s1_imgs(date_start: str, date_end: str, bounds: 'ee.Geometry', dt_set: str, img_name: str,
                      collection_name: str = "COPERNICUS/S1_GRD", tile: str = ''):
     '''
         Use GEE API to batch download S1 images.
@@ -27,6 +30,7 @@ def download_s1_imgs(date_start: str, date_end: str, bounds: ee.Geometry, dt_set
         Check how many floods we get/miss on the flood date
     '''
 
+    ee = get_ee()
     dt_set_fldr = {
         'world_floods': 'S1_WORLDFLOODS',
         'sen1_floods11': 'S1_SEN1FLOODS11',
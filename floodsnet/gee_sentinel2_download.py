@@ -1,4 +1,5 @@
-import ee
+from .earthengine import get_ee
+from .tracing import traced
 
 # from .timeout_decorator import timeout
 # from tenacity import retry, stop_after_attempt, wait_fixed
@@ -6,6 +7,7 @@ import ee
 
 # from WorldFloods GitHub https://github.com/spaceml-org/ml4floods/blob/main/ml4floods/data/ee_download.py
 def _get_collection(collection_name, date_start, date_end, bounds, add_filter=False):
+    ee = get_ee()
     collection = ee.ImageCollection(collection_name)
     if add_filter:
         collection_filtered = collection.filterDate(
@@ -22,6 +24,7 @@ def _get_collection(collection_name, date_start, date_end, bounds, add_filter=Fa
 
 
 def _make_gee_task(img, fldr, img_name, sys_id, bounds):
+    ee = get_ee()
     task = ee.batch.Export.image.toDrive(
         img,
         folder=fldr,
@@ -38,6 +41,7 @@ def _make_gee_task(img, fldr, img_name, sys_id, bounds):
 
 
 def _s2_download(n_images_col_tile, collection_name, date_start, date_end, img_col_all, bounds, fldr, img_name, tile=''):
+    ee = get_ee()
 
     task_lst = []
     file_name_lst = []
@@ -61,7 +65,8 @@ def _s2_download(n_images_col_tile, collection_name, date_start, date_end, img_c
 
 
 
-def download_s2_imgs(date_start: str, date_end: str, bounds: ee.Geometry,
+@traced('submit_s2', 'gee')
+def download_s2_imgs(date_start: str, date_end: str, bounds: 'ee.Geometry',
                      collection_name: str = "COPERNICUS/S2_HARMONIZED",
                      dt_set: str = '', img_name: str = '', hls_tiles=None):
     '''
@@ -5,30 +5,9 @@ Code to handle Google Earth Engine tasks.
 import time
 
 from pathlib import Path
-# from tenacity import retry, stop_after_attempt, wait_fixed
 
-# from .timeout_decorator import timeout
-
-
-# @retry(stop=stop_after_attempt(20), wait=wait_fixed(5))
-# @timeout(60)
-def gee_check_task_status(task):
-    """Waits for GEE task to be COMPLETE before moving to the next step of the code.
-    """
-    task_status = task.status()['state']
-    task_description = task.status()['description']
-    print(f'\nStart:{task_description}')
-    while task_status in ['READY', 'RUNNING']:
-        print(f'\tStatus:{task_status}.')
-        # time.sleep(60)
-        time.sleep(10)
-        try:
-            task_status = task.status()['state']
-        except Exception as e:
-            print(e, f' \n task_status not working ')
-    print(f'\tStatus:{task_status}.')
-    print(f'End:{task_description}')
-    return
+from .earthengine import get_ee
+from .tracing import span
 
 
 def remove_0_in_queue(queue: list) -> list:
@@ -60,41 +39,185 @@ def unnest_list_in_queue(queue: list) -> list:
     return clean_queue
 
 
-def check_on_tasks_in_queue(queue: list) -> None:
-    """Clean the tasks in queue, and then try/pop first task in queue.
-    If not complete after threhold set here and # of retries, append as
-    last item in queue.
+# states of a task that keep it outstanding; a task that was never started stays UNSUBMITTED, so it is not waited on
+ACTIVE_STATES = ('READY', 'RUNNING', 'CANCEL_REQUESTED')
+
+# Earth Engine operation states and their equivalent (legacy) task states, as returned by `task.status()`
+OPERATION_TO_TASK_STATE = {
+    'PENDING': 'READY',
+    'RUNNING': 'RUNNING',
+    'CANCELLING': 'CANCEL_REQUESTED',
+    'SUCCEEDED': 'COMPLETED',
+    'CANCELLED': 'CANCELLED',
+    'FAILED': 'FAILED',
+}
+
+
+def _ee_list_operations():
+    return get_ee().data.listOperations()
+
+
+def _operation_to_status(operation: dict) -> dict:
+    """Converts an operation from the EE operations endpoint to the dict returned by `task.status()`."""
+    metadata = operation.get('metadata', {})
+    status = {
+        'id': operation['name'].split('/')[-1],
+        'state': OPERATION_TO_TASK_STATE.get(metadata.get('state'), metadata.get('state')),
+        'description': metadata.get('description'),
+    }
+    if 'error' in operation:
+        status['error_message'] = operation['error'].get('message')
+    return status
+
+
+def fetch_task_status_table(task_ids, list_operations=None) -> dict:
+    """Gets the status of all the tasks in `task_ids` with a single listing of the operations in the EE project,
+    instead of one `task.status()` request per task. Returns a dict mapping task id to its status dict (same keys as
+    `task.status()`). Tasks that are not in the listing are left out.
+    `list_operations` defaults to `ee.data.listOperations`; see `tests/fake_ee_operations.py` for an offline fake.
     """
-    queue = remove_0_in_queue(queue)
-    queue = unnest_list_in_queue(queue)
-    attempt_counter = {}
-    while queue:
-        print('queue', queue)
-        print('attempt_counter', attempt_counter)
-        print('len(queue)', len(queue))
-        current_task = queue.pop(0)
-        if attempt_for_task_gt_thr(attempt_counter, current_task, thr=30):
-            # if a task has been checked on more than `thr` times
-            # unsucessfully, bail
-            print(current_task, queue)
-            assert False
-        print(4, type(current_task), current_task)
+    list_operations = list_operations if list_operations is not None else _ee_list_operations
+    task_ids = set(task_ids)
+    table = {}
+    for operation in list_operations():
+        status = _operation_to_status(operation)
+        if status['id'] in task_ids:
+            table[status['id']] = status
+    return table
+
+
+class GeeTaskRef:
+    """Stands for a GEE task known only by its id, e.g., one submitted in a previous run. Like `ee.batch.Task`, it has
+    an `id` and a `status` method, so it can be polled along with the tasks of the current run."""
+
+    def __init__(self, task_id: str, list_operations=None):
+        self.id = task_id
+        self.list_operations = list_operations
+
+    def status(self) -> dict:
+        table = fetch_task_status_table([self.id], self.list_operations)
+        return table.get(self.id, {'id': self.id, 'state': 'UNKNOWN', 'description': None})
+
+    def __repr__(self):
+        return f'<GeeTaskRef {self.id}>'
+
+
+class TaskPoller:
+    """Keeps track of every outstanding GEE task at once.
+    Each call to `sweep` checks the status of all outstanding tasks a single time, and `on_complete(task, status)` is
+    called for each task as soon as it is no longer READY, RUNNING or CANCEL_REQUESTED (`ACTIVE_STATES`), e.g.,
+    COMPLETED, FAILED, CANCELLED, or UNSUBMITTED if it was never started.
+    `on_complete` can be any callable, e.g., the `put` method of a `queue.Queue`.
+    The statuses are fetched with a single operations-list call per sweep (see `fetch_task_status_table`); only tasks
+    missing from the listing are asked for their status one by one.
+    `run` sweeps until no task is left, waiting `interval` seconds between sweeps. The wait grows by a factor of
+    `backoff` (up to `max_interval`) after each sweep in which no task finished, and goes back to `interval` as soon
+    as one does.
+    """
+
+    def __init__(self, tasks=(), on_complete=None, interval=10, max_interval=120, backoff=1.5, max_errors=30,
+                 list_operations=None):
+        self.on_complete = on_complete
+        self.list_operations = list_operations
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_errors = max_errors
+        self.outstanding = []
+        self.finished = {}
+        self._errors = {}
+        self._last_statuses = {}
+        for task in tasks:
+            self.add(task)
+
+    def add(self, task):
+        self.outstanding.append(task)
+
+    def _fetch_status(self, tasks: list) -> dict:
+        statuses = {}
         try:
-            gee_check_task_status(current_task)
-            del attempt_counter[current_task]
+            table = fetch_task_status_table([task.id for task in tasks], self.list_operations)
         except Exception as e:
-            queue.append(current_task)
-            print('Got an exception. Appending task to the queue.', e)
-
-
-def attempt_for_task_gt_thr(attempt_counter, task, thr=10) -> bool:
-    if task in attempt_counter:
-        if attempt_counter[task] > thr:
-            return True
-        attempt_counter[task] += 1
-        return False
-    attempt_counter[task] = 1
-    return False
+            print(e, f' \n listing the task operations not working ')
+            table = {}
+        for task in tasks:
+            if task.id in table:
+                statuses[task] = table[task.id]
+                continue
+            try:
+                statuses[task] = task.status()
+            except Exception as e:
+                print(e, f' \n task_status not working ')
+        self._last_statuses.update(statuses)
+        return statuses
+
+    def status_table(self) -> 'pd.DataFrame':
+        """Returns the last known status of every task, one row per task."""
+        import pandas as pd
+        rows = []
+        for task, status in self._last_statuses.items():
+            rows.append({
+                'id': task.id,
+                'description': status.get('description'),
+                'state': status.get('state'),
+                'error_message': status.get('error_message'),
+            })
+        return pd.DataFrame(rows, columns=['id', 'description', 'state', 'error_message'])
+
+    def sweep(self) -> list:
+        """Checks all the outstanding tasks once. Returns the (task, status) pairs of the tasks that finished."""
+        statuses = self._fetch_status(self.outstanding)
+        done = []
+        still_running = []
+        for task in self.outstanding:
+            status = statuses.get(task)
+            if status is None:
+                self._errors[task] = self._errors.get(task, 0) + 1
+                if self._errors[task] > self.max_errors:
+                    raise RuntimeError(f'Could not get the status of task {task} after {self.max_errors} attempts.')
+                still_running.append(task)
+            elif status['state'] in ACTIVE_STATES:
+                self._errors.pop(task, None)
+                still_running.append(task)
+            else:
+                self._errors.pop(task, None)
+                done.append((task, status))
+        self.outstanding = still_running
+
+        for task, status in done:
+            print(f'\tStatus:{status["state"]}.')
+            print(f'End:{status.get("description")}')
+            self.finished[task] = status
+            if self.on_complete is not None:
+                self.on_complete(task, status)
+        return done
+
+    def run(self) -> dict:
+        """Sweeps until all tasks finished. Returns a dict mapping each finished task to its last status."""
+        wait = self.interval
+        with span('poll', 'gee', tasks=len(self.outstanding)):
+            while self.outstanding:
+                done = self.sweep()
+                if not self.outstanding:
+                    break
+                if done:
+                    wait = self.interval
+                else:
+                    wait = min(wait * self.backoff, self.max_interval)
+                print(f'{len(self.outstanding)} GEE task(s) still running. Checking again in {wait:.0f} s.')
+                time.sleep(wait)
+        return self.finished
+
+
+def check_on_tasks_in_queue(queue: list, on_complete=None, list_operations=None) -> dict:
+    """Clean the tasks in queue, and then wait for all of them to finish,
+    checking on every outstanding task at each poll (see `TaskPoller`).
+    `on_complete(task, status)` is called as soon as each task finishes.
+    """
+    queue = remove_0_in_queue(queue)
+    queue = unnest_list_in_queue(queue)
+    print('len(queue)', len(queue))
+    return TaskPoller(queue, on_complete=on_complete, list_operations=list_operations).run()
 
 
 def get_gee_split_files(fp):
@@ -6,90 +6,96 @@ from pathlib import Path
 from typing import Union
 from typing_extensions import deprecated
 
-import ee
-
-from .cli import parse_flood_training_data_args
+from .config import Config
+from .earthengine import get_ee
+from .paths import generated_data
 from .usgs_floods import get_usgs_img_date_bbox
 
-args = parse_flood_training_data_args()
-DOWNLOADED_IMG_PATH = args.path
-GENERATED_IMG_PATH = args.generated_path
-print("GENERATED_IMG_PATH is ", GENERATED_IMG_PATH)
-GENERATED_IMG_PATH = Path(GENERATED_IMG_PATH) / 'global_flood_training' / 'data'
-
-# WorldFloods paths
-WORLD_FLOODS_S2_IMGS_PATH = Path(DOWNLOADED_IMG_PATH) / 'WorldFloods' / 'downloaded' / '*/S2/*.tif'
-WORLD_FLOODS_GROUND_TRUTH = Path(DOWNLOADED_IMG_PATH) / 'WorldFloods' / 'downloaded' / '*/gt/*.tif'
-WORLD_FLOODS_METADATA = Path(DOWNLOADED_IMG_PATH) / 'WorldFloods' / 'downloaded' / '*/meta'
-
-WORLD_FLOODS_GENERATED = Path(GENERATED_IMG_PATH) / 'WorldFloods' / 'generated'
-WORLD_FLOODS_RESAMPLED = Path(WORLD_FLOODS_GENERATED) / 'resampled'
-
-WORLD_FLOODS_SEASONAL_JRC_GENERATED = Path(WORLD_FLOODS_GENERATED) / 'JRC_WORLDFLOODS' / '*.tif'
-WORLD_FLOODS_S1_IMGS_PATH_GENERATED = Path(WORLD_FLOODS_GENERATED) / 'S1_WORLDFLOODS' / '*.tif'
-
-#Sen1Floods11 paths
-# first 5 come from dataset
-SEN1_FLOODS11_S2_IMGS_PATH = Path(DOWNLOADED_IMG_PATH) / 'Sen1Floods11' / 'downloaded' / '*/data/flood_events/HandLabeled/S2Hand/*.tif'
-SEN1_FLOODS11_GROUND_TRUTH = Path(DOWNLOADED_IMG_PATH) / 'Sen1Floods11' / 'downloaded' / '*/data/flood_events/HandLabeled/LabelHand/*.tif'
-SEN1_FLOODS11_JRC = Path(DOWNLOADED_IMG_PATH) / 'Sen1Floods11' / 'downloaded' / 'JRC_WORLDFLOODS' / '*.tif'
-SEN1_FLOODS11_S1 = Path(DOWNLOADED_IMG_PATH) / 'Sen1Floods11' / 'downloaded' / '*/data/flood_events/HandLabeled/S1Hand/*.tif'
-SEN1_FLOODS11_METADATA = Path(DOWNLOADED_IMG_PATH) / 'Sen1Floods11' / 'downloaded' / '*/catalog/sen1floods11_hand_labeled_source/*/'
-
-SEN1_FLOODS11_GENERATED = Path(GENERATED_IMG_PATH) / 'Sen1Floods11' / 'generated'
-SEN1_FLOODS11_RESAMPLED = Path(SEN1_FLOODS11_GENERATED) / 'resampled'
-
-# from GEE
-SEN1_FLOODS11_S1_IMGS_PATH_GENERATED = Path(SEN1_FLOODS11_GENERATED) / 'S1_SEN1FLOODS11/*.tif'
-SEN1_FLOODS11_SEASONAL_JRC_GENERATED = Path(SEN1_FLOODS11_GENERATED) / 'JRC_SEN1FLOODS11' / '*.tif'
-
-# USGS paths
-USGS_FLOOD_TRAINING_GROUND_TRUTH = Path(DOWNLOADED_IMG_PATH) / 'USGS_FloodTraining' / 'downloaded' / 'RasterData_and_Metadata/*.tif'
-USGS_GENERATED = Path(GENERATED_IMG_PATH) / 'usgs' / 'generated'
-USGS_RESAMPLED = Path(USGS_GENERATED) / 'resampled'
-USGS_FLOOD_TRAINING_GROUND_TRUTH_RESAMP = Path(USGS_RESAMPLED) / '*GT.tif'
-# s2
-USGS_FLOOD_TRAINING_S2_IMGS_PATH = Path(USGS_GENERATED) / 'S2_usgs' / '*.tif'
-# jrc
-USGS_FLOOD_TRAINING_JRC = Path(USGS_GENERATED) / 'JRC_usgs' / '*.tif'
-USGS_FLOOD_TRAINING_JRC_RESAMP = Path(USGS_RESAMPLED) / '*JRC.tif'
-# s1
-USGS_FLOOD_TRAINING_S1 = Path(USGS_GENERATED) / 'S1_usgs' / '*.tif'
-USGS_FLOOD_TRAINING_S1_RESAMP = Path(USGS_RESAMPLED) / '*S1.tif'
-# meta dir
-USGS_FLOOD_TRAINING_METADATA = Path(DOWNLOADED_IMG_PATH) / 'USGS_FloodTraining' / 'downloaded' / 'RasterData_and_Metadata'
-
-# UNOSAT paths
-UNOSAT_GROUND_TRUTH = Path(DOWNLOADED_IMG_PATH) / 'UNOSAT_SAR/downloaded/*gdb'
 
-UNOSAT_GENERATED = Path(GENERATED_IMG_PATH) / 'unosat' / 'generated'
-UNOSAT_RESAMPLED = Path(UNOSAT_GENERATED) / 'resampled'
-# gt
-UNOSAT_GROUND_TRUTH_RESAMP = Path(UNOSAT_RESAMPLED) / '*GT.tif'
-# s2
-UNOSAT_S2_IMGS_PATH = Path(UNOSAT_GENERATED) / 'S2_unosat'
-# jrc
-UNOSAT_SEASONAL_JRC = Path(UNOSAT_GENERATED) / 'JRC_unosat' 
-UNOSAT_SEASONAL_JRC_RESAMP = Path(UNOSAT_RESAMPLED) / '*JRC.tif'
-# s1
-UNOSAT_S1_IMGS_PATH = Path(UNOSAT_GENERATED) / 'S1_unosat'
-UNOSAT_S1_IMGS_PATH_RESAMP = Path(UNOSAT_RESAMPLED) / '*S1.tif'
+def source_paths(config: Config = None) -> dict:
+    """Returns the paths (or glob patterns) of the images of each dataset, given the `config` folders (defaults to
+    `Config()`). The keys are the names of the module constants these paths used to be."""
+    config = config if config is not None else Config()
+    downloaded = Path(config.path)
+    generated = generated_data(config.generated_path)
+    p = {}
+    # WorldFloods paths
+    p['WORLD_FLOODS_S2_IMGS_PATH'] = downloaded / 'WorldFloods' / 'downloaded' / '*/S2/*.tif'
+    p['WORLD_FLOODS_GROUND_TRUTH'] = downloaded / 'WorldFloods' / 'downloaded' / '*/gt/*.tif'
+    p['WORLD_FLOODS_METADATA'] = downloaded / 'WorldFloods' / 'downloaded' / '*/meta'
+
+    p['WORLD_FLOODS_GENERATED'] = generated / 'WorldFloods' / 'generated'
+    p['WORLD_FLOODS_RESAMPLED'] = p['WORLD_FLOODS_GENERATED'] / 'resampled'
+
+    p['WORLD_FLOODS_SEASONAL_JRC_GENERATED'] = p['WORLD_FLOODS_GENERATED'] / 'JRC_WORLDFLOODS' / '*.tif'
+    p['WORLD_FLOODS_S1_IMGS_PATH_GENERATED'] = p['WORLD_FLOODS_GENERATED'] / 'S1_WORLDFLOODS' / '*.tif'
+
+    # Sen1Floods11 paths
+    # first 5 come from dataset
+    s1f11 = downloaded / 'Sen1Floods11' / 'downloaded'
+    p['SEN1_FLOODS11_S2_IMGS_PATH'] = s1f11 / '*/data/flood_events/HandLabeled/S2Hand/*.tif'
+    p['SEN1_FLOODS11_GROUND_TRUTH'] = s1f11 / '*/data/flood_events/HandLabeled/LabelHand/*.tif'
+    p['SEN1_FLOODS11_JRC'] = s1f11 / 'JRC_WORLDFLOODS' / '*.tif'
+    p['SEN1_FLOODS11_S1'] = s1f11 / '*/data/flood_events/HandLabeled/S1Hand/*.tif'
+    p['SEN1_FLOODS11_METADATA'] = s1f11 / '*/catalog/sen1floods11_hand_labeled_source/*/'
+
+    p['SEN1_FLOODS11_GENERATED'] = generated / 'Sen1Floods11' / 'generated'
+    p['SEN1_FLOODS11_RESAMPLED'] = p['SEN1_FLOODS11_GENERATED'] / 'resampled'
+
+    # from GEE
+    p['SEN1_FLOODS11_S1_IMGS_PATH_GENERATED'] = p['SEN1_FLOODS11_GENERATED'] / 'S1_SEN1FLOODS11/*.tif'
+    p['SEN1_FLOODS11_SEASONAL_JRC_GENERATED'] = p['SEN1_FLOODS11_GENERATED'] / 'JRC_SEN1FLOODS11' / '*.tif'
+
+    # USGS paths
+    usgs = downloaded / 'USGS_FloodTraining' / 'downloaded' / 'RasterData_and_Metadata'
+    p['USGS_FLOOD_TRAINING_GROUND_TRUTH'] = usgs / '*.tif'
+    p['USGS_GENERATED'] = generated / 'usgs' / 'generated'
+    p['USGS_RESAMPLED'] = p['USGS_GENERATED'] / 'resampled'
+    p['USGS_FLOOD_TRAINING_GROUND_TRUTH_RESAMP'] = p['USGS_RESAMPLED'] / '*GT.tif'
+    # s2
+    p['USGS_FLOOD_TRAINING_S2_IMGS_PATH'] = p['USGS_GENERATED'] / 'S2_usgs' / '*.tif'
+    # jrc
+    p['USGS_FLOOD_TRAINING_JRC'] = p['USGS_GENERATED'] / 'JRC_usgs' / '*.tif'
+    p['USGS_FLOOD_TRAINING_JRC_RESAMP'] = p['USGS_RESAMPLED'] / '*JRC.tif'
+    # s1
+    p['USGS_FLOOD_TRAINING_S1'] = p['USGS_GENERATED'] / 'S1_usgs' / '*.tif'
+    p['USGS_FLOOD_TRAINING_S1_RESAMP'] = p['USGS_RESAMPLED'] / '*S1.tif'
+    # meta dir
+    p['USGS_FLOOD_TRAINING_METADATA'] = usgs
+
+    # UNOSAT paths
+    p['UNOSAT_GROUND_TRUTH'] = downloaded / 'UNOSAT_SAR/downloaded/*gdb'
+
+    p['UNOSAT_GENERATED'] = generated / 'unosat' / 'generated'
+    p['UNOSAT_RESAMPLED'] = p['UNOSAT_GENERATED'] / 'resampled'
+    # gt
+    p['UNOSAT_GROUND_TRUTH_RESAMP'] = p['UNOSAT_RESAMPLED'] / '*GT.tif'
+    # s2
+    p['UNOSAT_S2_IMGS_PATH'] = p['UNOSAT_GENERATED'] / 'S2_unosat'
+    # jrc
+    p['UNOSAT_SEASONAL_JRC'] = p['UNOSAT_GENERATED'] / 'JRC_unosat'
+    p['UNOSAT_SEASONAL_JRC_RESAMP'] = p['UNOSAT_RESAMPLED'] / '*JRC.tif'
+    # s1
+    p['UNOSAT_S1_IMGS_PATH'] = p['UNOSAT_GENERATED'] / 'S1_unosat'
+    p['UNOSAT_S1_IMGS_PATH_RESAMP'] = p['UNOSAT_RESAMPLED'] / '*S1.tif'
+    return p
 
 
 # FOR ALL DATASETS #####
-def get_ground_truth(dt_set: str, out_dir=''):
+def get_ground_truth(dt_set: str, out_dir='', config: Config = None):
+    p = source_paths(config)
     if dt_set == 'world_floods':
-        wf_gt_lst = glob(str(WORLD_FLOODS_GROUND_TRUTH))
+        wf_gt_lst = glob(str(p['WORLD_FLOODS_GROUND_TRUTH']))
         wf_gt_lst = [gt for gt in wf_gt_lst if '/train/' not in gt]
         wf_gt_names = [Path(i).stem for i in wf_gt_lst]
         return wf_gt_lst, wf_gt_names
     elif dt_set == 'sen1_floods11':
-        s1f11_label_lst = glob(str(SEN1_FLOODS11_GROUND_TRUTH))
+        s1f11_label_lst = glob(str(p['SEN1_FLOODS11_GROUND_TRUTH']))
         s1f11_label_lst.sort()
         s1f11_label_flood_id_lst = ['_'.join(Path(i).stem.split('_')[:2]) for i in s1f11_label_lst]
         return s1f11_label_lst, s1f11_label_flood_id_lst
     elif dt_set == 'usgs':
-        usgs_gt_lst = glob(str(USGS_FLOOD_TRAINING_GROUND_TRUTH))
+        usgs_gt_lst = glob(str(p['USGS_FLOOD_TRAINING_GROUND_TRUTH']))
         usgs_gt_lst.sort()
         usgs_gt_names = [os.path.basename(i)[:8] for i in usgs_gt_lst]
         return usgs_gt_lst, usgs_gt_names
@@ -99,49 +105,51 @@ def get_ground_truth(dt_set: str, out_dir=''):
             unosat_gt_names = [Path(i).stem for i in unosat_gt_lst]
             return unosat_gt_lst, unosat_gt_names
         else:
-            unosat_gt_lst = glob(str(UNOSAT_GROUND_TRUTH))
+            unosat_gt_lst = glob(str(p['UNOSAT_GROUND_TRUTH']))
             unosat_gt_lst.sort()
             return unosat_gt_lst
 
 
-def get_s2_imgs(dt_set: str):
+def get_s2_imgs(dt_set: str, config: Config = None):
+    p = source_paths(config)
     if dt_set == 'world_floods':
-        wf_s2_lst = glob(str(WORLD_FLOODS_S2_IMGS_PATH))
+        wf_s2_lst = glob(str(p['WORLD_FLOODS_S2_IMGS_PATH']))
         wf_s2_names = [Path(i).stem for i in wf_s2_lst]
         return wf_s2_lst, wf_s2_names
     elif dt_set == 'sen1_floods11':
-        s1f11_s2_lst = glob(str(SEN1_FLOODS11_S2_IMGS_PATH))
+        s1f11_s2_lst = glob(str(p['SEN1_FLOODS11_S2_IMGS_PATH']))
         s1f11_s2_lst.sort()
         s1f11_s2_flood_id_lst = ['_'.join(Path(i).stem.split('_')[:2]) for i in s1f11_s2_lst]
         return s1f11_s2_lst, s1f11_s2_flood_id_lst
     elif dt_set == 'usgs':
-        usgs_s2_lst = glob(str(USGS_FLOOD_TRAINING_S2_IMGS_PATH))
+        usgs_s2_lst = glob(str(p['USGS_FLOOD_TRAINING_S2_IMGS_PATH']))
         usgs_s2_names = [Path(i).stem[:8] for i in usgs_s2_lst]
         return usgs_s2_lst, usgs_s2_names
     elif dt_set == 'unosat':
-        unosat_s2_lst = glob(str(UNOSAT_S2_IMGS_PATH))
+        unosat_s2_lst = glob(str(p['UNOSAT_S2_IMGS_PATH']))
         unosat_s2_names = [Path(i).stem[:-45] + Path(i).stem[-12:-7] for i in unosat_s2_lst]
         return unosat_s2_lst, unosat_s2_names
 
 
-def get_s1_imgs(dt_set: str):
+def get_s1_imgs(dt_set: str, config: Config = None):
+    p = source_paths(config)
     if dt_set == 'world_floods':
-        wf_s1_lst = glob(str(WORLD_FLOODS_S1_IMGS_PATH_GENERATED))
+        wf_s1_lst = glob(str(p['WORLD_FLOODS_S1_IMGS_PATH_GENERATED']))
         wf_s1_names_lst = [Path(i).stem for i in wf_s1_lst]
         wf_s1_names = list({'_'.join(i.split('_')[:-4]) for i in wf_s1_names_lst})
         return wf_s1_lst, wf_s1_names
     elif dt_set == 'sen1_floods11':
-        s1f11_s1_lst = glob(str(SEN1_FLOODS11_S1)) + glob(str(SEN1_FLOODS11_S1_IMGS_PATH_GENERATED))
+        s1f11_s1_lst = glob(str(p['SEN1_FLOODS11_S1'])) + glob(str(p['SEN1_FLOODS11_S1_IMGS_PATH_GENERATED']))
         s1f11_s1_lst.sort()
         s1f11_s1_flood_id_lst = ['_'.join(Path(i).stem.split('_')[:2]) for i in s1f11_s1_lst]
         return s1f11_s1_lst, s1f11_s1_flood_id_lst
     elif dt_set == 'usgs':
-        usgs_s1_lst = glob(str(USGS_FLOOD_TRAINING_S1))
+        usgs_s1_lst = glob(str(p['USGS_FLOOD_TRAINING_S1']))
         usgs_s1_lst.sort()
         usgs_s1_names = [os.path.basename(i)[:8] for i in usgs_s1_lst]
         return usgs_s1_lst, usgs_s1_names
     elif dt_set == 'unosat':
-        unosat_s2_lst = glob(str(UNOSAT_S1_IMGS_PATH))
+        unosat_s2_lst = glob(str(p['UNOSAT_S1_IMGS_PATH']))
         unosat_s2_names = [os.path.basename(i)[:-7] for i in unosat_s2_lst]
         return unosat_s2_lst, unosat_s2_names
 
@@ -152,45 +160,49 @@ def _get_jrc_imgs_usgs_unosat(dt_set, int_place: int):
     return usgs_jrc_lst, usgs_jrc_names
 
 
-def get_jrc_imgs(dt_set: str):
+def get_jrc_imgs(dt_set: str, config: Config = None):
+    p = source_paths(config)
     if dt_set == 'world_floods':
-        wf_jrc_lst = glob(str(WORLD_FLOODS_SEASONAL_JRC_GENERATED))
+        wf_jrc_lst = glob(str(p['WORLD_FLOODS_SEASONAL_JRC_GENERATED']))
         wf_jrc_name_lst = [Path(i).stem for i in wf_jrc_lst]
         wf_jrc_names = ['_'.join(i.split('_')[:-3]) for i in wf_jrc_name_lst]
         return wf_jrc_lst, wf_jrc_names
     elif dt_set == 'sen1_floods11':
-        s1f11_jrc_lst = glob(str(SEN1_FLOODS11_JRC)) + glob(str(SEN1_FLOODS11_SEASONAL_JRC_GENERATED))
+        s1f11_jrc_lst = glob(str(p['SEN1_FLOODS11_JRC'])) + glob(str(p['SEN1_FLOODS11_SEASONAL_JRC_GENERATED']))
         s1f11_jrc_lst.sort()
         s1f11_jrc_flood_id_lst = ['_'.join(Path(i).stem.split('_')[:2]) for i in s1f11_jrc_lst]
         return s1f11_jrc_lst, s1f11_jrc_flood_id_lst
     elif dt_set == 'usgs':
-        return _get_jrc_imgs_usgs_unosat(USGS_FLOOD_TRAINING_JRC, 8)
+        return _get_jrc_imgs_usgs_unosat(p['USGS_FLOOD_TRAINING_JRC'], 8)
     elif dt_set == 'unosat':
-        return _get_jrc_imgs_usgs_unosat(UNOSAT_SEASONAL_JRC_RESAMP, -15)
+        return _get_jrc_imgs_usgs_unosat(p['UNOSAT_SEASONAL_JRC_RESAMP'], -15)
 
 
-def get_metadata(dt_set: str, flood_name: str):
+def get_metadata(dt_set: str, flood_name: str, config: Config = None):
+    p = source_paths(config)
     if dt_set == 'world_floods':
-        return glob(os.path.join(WORLD_FLOODS_METADATA, f'{flood_name}.json'))[0]
+        return glob(os.path.join(p['WORLD_FLOODS_METADATA'], f'{flood_name}.json'))[0]
     elif dt_set == 'sen1_floods11':
-        return glob(os.path.join(SEN1_FLOODS11_METADATA, f'{flood_name}.json'))[0]
+        return glob(os.path.join(p['SEN1_FLOODS11_METADATA'], f'{flood_name}.json'))[0]
     elif dt_set == 'usgs':
-        return glob(os.path.join(USGS_FLOOD_TRAINING_METADATA, f'{flood_name}.tif.xml'))[0]
+        return glob(os.path.join(p['USGS_FLOOD_TRAINING_METADATA'], f'{flood_name}.tif.xml'))[0]
 
 
-def get_usgs_flood_training_ground_truth_resamp(usgs_path=USGS_FLOOD_TRAINING_GROUND_TRUTH_RESAMP):
+def get_usgs_flood_training_ground_truth_resamp(usgs_path=None, config: Config = None):
     '''
         Get list of USGS ground truth images
     '''
+    usgs_path = str(usgs_path or source_paths(config)['USGS_FLOOD_TRAINING_GROUND_TRUTH_RESAMP'])
     usgs_gt_lst = glob(usgs_path)
     usgs_gt_names = [os.path.basename(i)[:8] for i in usgs_gt_lst]
     return usgs_gt_lst, usgs_gt_names
 
 
-def get_usgs_flood_training_jrc_resamp(usgs_path=USGS_FLOOD_TRAINING_JRC_RESAMP):
+def get_usgs_flood_training_jrc_resamp(usgs_path=None, config: Config = None):
     '''
         Get list of USGS ground truth images
     '''
+    usgs_path = str(usgs_path or source_paths(config)['USGS_FLOOD_TRAINING_JRC_RESAMP'])
     usgs_jrc_lst = glob(usgs_path)
     usgs_jrc_names = [os.path.basename(i)[:8] for i in usgs_jrc_lst]
     return usgs_jrc_lst, usgs_jrc_names
@@ -198,6 +210,7 @@ def get_usgs_flood_training_jrc_resamp(usgs_path=USGS_FLOOD_TRAINING_JRC_RESAMP)
 
 @deprecated('Seems to be unused.')
 def _open_meta_file2(fl: str, sat_date_key: str, plus_days=1, minus_days=0):
+    ee = get_ee()
     with open(fl) as json_fl:  # open the meta file
         fl_dict = json.load(json_fl)
         if sat_date_key == "satellite date":
@@ -214,6 +227,7 @@ def get_img_date_bbox(dt_set: str, fl=Union[str, list], plus_days=1, minus_days=
     """Gets the date and bounds of the flood/sentinel 2 image for a specified dataset.
     Can change if we want more than 1 day after the image and zero minus days.
     """
+    ee = get_ee()
     if dt_set == 'world_floods':
         with open(fl) as json_fl:  # open the meta file
             fl_dict = json.load(json_fl)
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Run-state ledger: a local SQLite database that records, per event, the GEE exports that were submitted and the
+outputs of each processing stage, so that a restarted run can tell what is done without rescanning the output folders.
+
+"""
+import hashlib
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Union
+
+from .dag import input_fingerprint
+from .geetasks import ACTIVE_STATES, GeeTaskRef, check_gee_split, fetch_task_status_table
+
+# Processing stages of an event and the stages whose outputs they use
+STAGE_DEPENDENCIES = {
+    'reproject': [],
+    'ndwi': ['reproject'],
+    'features': ['reproject'],
+    'resample_s1': ['reproject'],
+    'resample_gt': ['reproject'],
+    'resample_jrc': ['reproject'],
+    'classes': ['reproject', 'resample_gt', 'resample_jrc'],
+    'chips': ['reproject', 'ndwi', 'resample_s1', 'resample_jrc', 'classes'],
+}
+STAGES = list(STAGE_DEPENDENCIES)
+
+
+def downstream_stages(stage: str) -> list:
+    """Returns `stage` and all the stages that depend on it, directly or not, in processing order."""
+    if stage not in STAGE_DEPENDENCIES:
+        raise ValueError(f'stage {stage} not valid. Options are {STAGES}.')
+    affected = {stage}
+    for st in STAGES:  # STAGES is in processing order, so a single pass is enough
+        if any(dep in affected for dep in STAGE_DEPENDENCIES[st]):
+            affected.add(st)
+    return [st for st in STAGES if st in affected]
+
+
+def file_checksum(fp: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(fp, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def describe_output(stage: str, fp: Union[str, Path], checksum: bool = False) -> dict:
+    """Returns the ledger record of output `fp` of `stage`, with its size and, as its checksum, its size and
+    modification time (see `floodsnet.dag.input_fingerprint`), or a checksum of its content if `checksum` (which
+    reads the whole file). Both are None if it does not exist. Meant to be called where the output was written, e.g.,
+    in a worker process."""
+    fp = str(fp)
+    record = {'stage': stage, 'path': fp, 'size': None, 'checksum': None}
+    if os.path.exists(fp):
+        record['size'] = os.path.getsize(fp)
+        record['checksum'] = file_checksum(fp) if checksum else input_fingerprint(fp)
+    return record
+
+
+def output_changed(stage: str, fp: Union[str, Path], checksum: str = None) -> bool:
+    """Whether output `fp` of `stage` no longer exists, or no longer matches the `checksum` recorded for it by
+    `describe_output` (a checksum of its content is computed again only if that is what was recorded)."""
+    fp = str(fp)
+    if not os.path.exists(fp):
+        return True
+    if checksum is None:
+        return False
+    full = not checksum.startswith(f'{fp}:')  # not a size and modification time fingerprint
+    return describe_output(stage, fp, checksum=full)['checksum'] != checksum
+
+
+class ValidityStore:
+    """Files found valid by `floodsnet.tools.gdal_is_valid`, in the valid_files table of the ledger database at `path`,
+    by path, size and modification time, so that a rerun does not check unchanged downloads again. Unlike the rest of
+    the ledger, it is written by the process that validates (e.g., a worker): each call opens its own connection."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = str(path)
+        con = self._connect()
+        try:
+            with con:
+                con.execute("""CREATE TABLE IF NOT EXISTS valid_files (
+                                   path TEXT NOT NULL,
+                                   size INTEGER NOT NULL,
+                                   mtime_ns INTEGER NOT NULL,
+                                   deep INTEGER NOT NULL,
+                                   updated REAL,
+                                   PRIMARY KEY (path, size, mtime_ns))""")
+        finally:
+            con.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, fp: str, size: int, mtime_ns: int):
+        """None if `fp` (as it is now, with `size` and `mtime_ns`) was not found valid, otherwise whether it was
+        checked deeply (with a full checksum)."""
+        con = self._connect()
+        try:
+            row = con.execute("SELECT deep FROM valid_files WHERE path = ? AND size = ? AND mtime_ns = ?",
+                              (fp, size, mtime_ns)).fetchone()
+        finally:
+            con.close()
+        return bool(row[0]) if row is not None else None
+
+    def add(self, fp: str, size: int, mtime_ns: int, deep: bool):
+        con = self._connect()
+        try:
+            with con:
+                con.execute("DELETE FROM valid_files WHERE path = ?", (fp,))  # older versions of the file
+                con.execute("INSERT INTO valid_files VALUES (?, ?, ?, ?, ?)", (fp, size, mtime_ns, int(deep),
+                                                                               time.time()))
+        finally:
+            con.close()
+
+
+def _remove_files(paths: list):
+    for fp in paths:
+        if os.path.exists(fp):
+            os.remove(fp)
+
+
+class RunLedger:
+    """SQLite ledger of the run state. Only the main process should write to it; worker processes return the records
+    of their outputs (see `describe_output`) to be recorded."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(str(self.path))
+        with self.con:
+            self.con.execute("""CREATE TABLE IF NOT EXISTS outputs (
+                                    dt_set TEXT NOT NULL,
+                                    event TEXT NOT NULL,
+                                    stage TEXT NOT NULL,
+                                    path TEXT NOT NULL,
+                                    size INTEGER,
+                                    checksum TEXT,
+                                    task_id TEXT,
+                                    updated REAL,
+                                    PRIMARY KEY (dt_set, event, stage, path))""")
+            self.con.execute("""CREATE TABLE IF NOT EXISTS events (
+                                    dt_set TEXT NOT NULL,
+                                    event TEXT NOT NULL,
+                                    status TEXT,
+                                    error TEXT,
+                                    updated REAL,
+                                    PRIMARY KEY (dt_set, event))""")
+            self.con.execute("""CREATE TABLE IF NOT EXISTS stage_keys (
+                                    dt_set TEXT NOT NULL,
+                                    event TEXT NOT NULL,
+                                    stage TEXT NOT NULL,
+                                    key TEXT NOT NULL,
+                                    updated REAL,
+                                    PRIMARY KEY (dt_set, event, stage))""")
+
+    def close(self):
+        self.con.close()
+
+    def validity_store(self) -> ValidityStore:
+        """`ValidityStore` in the database of the ledger, to pass to `floodsnet.tools.gdal_is_valid`."""
+        return ValidityStore(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record_outputs(self, dt_set: str, event: str, records: list):
+        """Records the outputs of an event, given as dicts with the keys of `describe_output` (and optionally
+        task_id)."""
+        now = time.time()
+        with self.con:
+            self.con.executemany(
+                "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(dt_set, event, r['stage'], str(r['path']), r.get('size'), r.get('checksum'), r.get('task_id'), now)
+                 for r in records])
+
+    def record_event(self, dt_set: str, event: str, status: str, error: str = None):
+        with self.con:
+            self.con.execute("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?)",
+                             (dt_set, event, status, error, time.time()))
+
+    def record_download(self, dt_set: str, event: str, layer: str, task_id: str, path: Union[str, Path]):
+        """Records the GEE export of `layer` (s2, s1 or jrc) of `event` to `path`."""
+        self.record_outputs(dt_set, event, [{'stage': f'download_{layer}', 'path': path, 'task_id': task_id}])
+
+    def forget_download(self, dt_set: str, event: str, layer: str, path: Union[str, Path]):
+        with self.con:
+            self.con.execute("DELETE FROM outputs WHERE dt_set = ? AND event = ? AND stage = ? AND path = ?",
+                             (dt_set, event, f'download_{layer}', str(path)))
+
+    def downloads(self, dt_set: str) -> dict:
+        """Returns {event: {layer: [(task_id, path), ...]}} with all the recorded GEE exports of `dt_set`."""
+        rows = self.con.execute("SELECT event, stage, task_id, path FROM outputs "
+                                "WHERE dt_set = ? AND stage LIKE 'download_%' ORDER BY event, stage, path",
+                                (dt_set,))
+        downloads = {}
+        for event, stage, task_id, path in rows:
+            layer = stage[len('download_'):]
+            downloads.setdefault(event, {}).setdefault(layer, []).append((task_id, path))
+        return downloads
+
+    def live_downloads(self, dt_set: str, list_operations=None) -> dict:
+        """Returns the recorded GEE exports of `dt_set` whose task is still running or completed, in the same format as
+        `downloads` but with a `GeeTaskRef` in place of each task id, so that they can be waited on instead of being
+        submitted again. Exports whose task failed, was cancelled or is unknown are forgotten, and so are those whose
+        task completed but whose file (or the parts GEE split it into) is no longer there, so that they are submitted
+        again.
+        The task states are fetched with a single operations listing."""
+        downloads = self.downloads(dt_set)
+        if len(downloads) == 0:
+            return {}
+        task_ids = [task_id for layers in downloads.values() for pairs in layers.values() for task_id, _ in pairs]
+        table = fetch_task_status_table(task_ids, list_operations)
+        live = {}
+        for event, layers in downloads.items():
+            for layer, pairs in layers.items():
+                for task_id, path in pairs:
+                    state = table.get(task_id, {}).get('state')
+                    if state == 'COMPLETED' and not os.path.exists(path) and not check_gee_split(path)[0]:
+                        print(f'The GEE export to {path} completed, but the file is gone. Submitting it again.')
+                        self.forget_download(dt_set, event, layer, path)
+                    elif state == 'COMPLETED' or state in ACTIVE_STATES:
+                        task = GeeTaskRef(task_id, list_operations)
+                        live.setdefault(event, {}).setdefault(layer, []).append((task, path))
+                    else:
+                        self.forget_download(dt_set, event, layer, path)
+        return live
+
+    def done_stages(self, dt_set: str) -> dict:
+        """Returns {event: {stage: [output paths]}} with the processing stages recorded as done for `dt_set`.
+        The paths of each stage are in the order they were recorded."""
+        rows = self.con.execute("SELECT event, stage, path FROM outputs WHERE dt_set = ? AND stage NOT LIKE "
+                                "'download_%' ORDER BY rowid", (dt_set,))
+        done = {}
+        for event, stage, path in rows:
+            done.setdefault(event, {}).setdefault(stage, []).append(path)
+        return done
+
+    def forget_changed_stages(self, dt_set: str) -> dict:
+        """Forgets (see `forget_stage`) the stages of `dt_set` that have a recorded output that was deleted or changed
+        since (see `output_changed`), so that they are run again. Returns {event: [forgotten stages]}."""
+        rows = self.con.execute("SELECT event, stage, path, checksum FROM outputs WHERE dt_set = ? AND stage NOT LIKE "
+                                "'download_%'", (dt_set,))
+        changed = {}
+        for event, stage, path, checksum in rows.fetchall():
+            if stage not in changed.get(event, []) and output_changed(stage, path, checksum):
+                print(f'{path} of {event} was deleted or changed since it was recorded. Running {stage} again.')
+                changed.setdefault(event, []).append(stage)
+        for event, stages in changed.items():
+            for stage in stages:
+                self.forget_stage(dt_set, event, stage)
+        return changed
+
+    def record_stage_keys(self, dt_set: str, event: str, keys: dict):
+        """Records the content-hash key (see `floodsnet.dag`) of the current outputs of each stage in `keys`."""
+        now = time.time()
+        with self.con:
+            self.con.executemany("INSERT OR REPLACE INTO stage_keys VALUES (?, ?, ?, ?, ?)",
+                                 [(dt_set, event, stage, key, now) for stage, key in keys.items()])
+
+    def stage_keys(self, dt_set: str) -> dict:
+        """Returns {event: {stage: key}} with the keys of the current outputs of `dt_set`."""
+        keys = {}
+        for event, stage, key in self.con.execute("SELECT event, stage, key FROM stage_keys WHERE dt_set = ?",
+                                                  (dt_set,)):
+            keys.setdefault(event, {})[stage] = key
+        return keys
+
+    def forget_stage(self, dt_set: str, event: str, stage: str, remove_files: bool = True) -> list:
+        """Forgets the outputs and key of `stage` of `event`, deleting its files unless `remove_files` is False.
+        Returns the forgotten paths."""
+        paths = [row[0] for row in self.con.execute(
+            "SELECT path FROM outputs WHERE dt_set = ? AND event = ? AND stage = ?", (dt_set, event, stage))]
+        with self.con:
+            self.con.execute("DELETE FROM outputs WHERE dt_set = ? AND event = ? AND stage = ?", (dt_set, event, stage))
+            self.con.execute("DELETE FROM stage_keys WHERE dt_set = ? AND event = ? AND stage = ?",
+                             (dt_set, event, stage))
+        if remove_files:
+            _remove_files(paths)
+        return paths
+
+    def invalidate(self, dt_set: str, stage: str, remove_files: bool = True) -> list:
+        """Forgets the outputs of `stage` and of all the stages downstream of it for every event of `dt_set`, so that
+        they are run again. Their files are deleted too, unless `remove_files` is False. Returns the forgotten
+        paths."""
+        stages = downstream_stages(stage)
+        marks = ', '.join('?' * len(stages))
+        paths = [row[0] for row in self.con.execute(
+            f"SELECT path FROM outputs WHERE dt_set = ? AND stage IN ({marks})", (dt_set, *stages))]
+        with self.con:
+            self.con.execute(f"DELETE FROM outputs WHERE dt_set = ? AND stage IN ({marks})", (dt_set, *stages))
+            self.con.execute(f"DELETE FROM stage_keys WHERE dt_set = ? AND stage IN ({marks})", (dt_set, *stages))
+        if remove_files:
+            _remove_files(paths)
+        print(f'Invalidated {len(paths)} {dt_set} outputs of stages {stages}.')
+        return paths
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Cloud-aware best-pixel mosaicking of the S2 scenes of an event (the granules that cover it, with the same date).
+
+Instead of stacking the scenes in a VRT, where the last one wins wherever they overlap, each pixel of the mosaic is
+taken from the scene with the best quality score there (see `quality_score`):
+    - no data (all bands 0) is never used,
+    - opaque (QA60 bit 10) and cirrus (QA60 bit 11) clouds, and bright blue (B2 > 0.2, likely cloud or haze, which
+      also catches the clouds of scenes whose QA60 is empty), are used only if no scene is clearer there,
+    - among equally clear pixels, the first scene wins.
+
+The mosaic is written block by block, in one pass: each scene is warped on the fly to the block (nearest neighbour),
+or read directly if it is already on the grid of the mosaic, and only the scenes that overlap the block are read, so
+memory is bounded by a block of every scene. The index of the scene of each pixel is saved with it, as a
+`_MOSAICSRC.tif` sidecar whose SOURCES tag lists the scenes.
+"""
+import json
+import math
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, bounds as window_bounds
+
+from .calculate_features import S2_BANDS
+from .storage import finalize, update_profile
+from .tracing import traced
+
+QA60_OPAQUE = 1 << 10
+QA60_CIRRUS = 1 << 11
+# reflectance x 10000 of B2 above which a pixel is likely cloud or haze
+BRIGHT_BLUE = 2000
+SOURCE_NODATA = 255
+
+
+def source_path(out_path: Union[str, Path]) -> str:
+    """Path of the source-index sidecar of the mosaic at `out_path`."""
+    out_path = Path(out_path)
+    return str(out_path.with_name(f'{out_path.stem}_MOSAICSRC.tif'))
+
+
+def mosaic_grid(srcs: list, crs, res: float = 10) -> dict:
+    """Grid (crs, transform, width and height) in `crs`, at `res`, that covers all the datasets in `srcs`."""
+    bounds = [transform_bounds(src.crs, crs, *src.bounds) for src in srcs]
+    left, bottom = min(b[0] for b in bounds), min(b[1] for b in bounds)
+    right, top = max(b[2] for b in bounds), max(b[3] for b in bounds)
+    return dict(crs=crs, transform=from_origin(left, top, res, res),
+                width=math.ceil((right - left) / res), height=math.ceil((top - bottom) / res))
+
+
+def _grid_offset(src, grid: dict):
+    """(col, row) of the first pixel of `src` in the mosaic `grid`, if `src` is on it (same CRS, pixel size and pixel
+    corners), so that it can be read without warping. None otherwise."""
+    t, g = src.transform, grid['transform']
+    if src.crs != grid['crs'] or (t.a, t.b, t.d, t.e) != (g.a, g.b, g.d, g.e):
+        return None
+    col, row = (t.c - g.c) / g.a, (t.f - g.f) / g.e
+    if abs(col - round(col)) > 1e-6 or abs(row - round(row)) > 1e-6:
+        return None
+    return round(col), round(row)
+
+
+def _read_on_grid(src, offset: tuple, window: Window) -> np.ndarray:
+    """Reads `window` of the mosaic grid from `src`, which is on it at `offset` (see `_grid_offset`), with 0 (no data)
+    outside of `src`."""
+    col, row = offset
+    data = np.zeros((src.count, window.height, window.width), dtype=src.dtypes[0])
+    c0, r0 = max(window.col_off - col, 0), max(window.row_off - row, 0)
+    c1 = min(window.col_off + window.width - col, src.width)
+    r1 = min(window.row_off + window.height - row, src.height)
+    if c1 > c0 and r1 > r0:
+        block = src.read(window=Window(c0, r0, c1 - c0, r1 - r0))
+        if src.nodata is not None and src.nodata != 0:
+            block[block == src.nodata] = 0
+        out_r0, out_c0 = r0 + row - window.row_off, c0 + col - window.col_off
+        data[:, out_r0:out_r0 + block.shape[1], out_c0:out_c0 + block.shape[2]] = block
+    return data
+
+
+def _band_index(src, name: str, default: int = None):
+    """1-based index of the band described as `name`, or `default` if no band is."""
+    if name in src.descriptions:
+        return src.descriptions.index(name) + 1
+    return default
+
+
+def quality_score(data: np.ndarray, qa: np.ndarray = None, blue: np.ndarray = None) -> np.ndarray:
+    """Quality score of each pixel of a block of a scene (`data` of shape (bands, rows, cols)), from its QA60 and B2
+    bands (`qa` and `blue`, if it has them). Higher is better; no data is -inf. Clear pixels score 4, minus 2 if opaque
+    cloud, 1 if cirrus and 1 if bright."""
+    score = np.full(data.shape[1:], 4, dtype='float32')
+    if qa is not None:
+        score -= 2 * ((qa & QA60_OPAQUE) != 0)
+        score -= (qa & QA60_CIRRUS) != 0
+    if blue is not None:
+        score -= blue > BRIGHT_BLUE
+    score[~np.any(data != 0, axis=0)] = -np.inf
+    return score
+
+
+@traced('mosaic')
+def mosaic_scenes(paths: list, out_path: Union[str, Path], crs=None, res: float = 10, dtype: str = 'uint16') -> tuple:
+    """Composites the scenes at `paths` (with the same bands) into a best-pixel mosaic at `out_path`, on a grid in
+    `crs` (that of the first scene by default) at `res` that covers all of them, with values cast to `dtype`. Returns
+    the paths of the mosaic and of its source-index sidecar (`source_path`)."""
+    if len(paths) >= SOURCE_NODATA:
+        raise ValueError(f'Cannot mosaic more than {SOURCE_NODATA - 1} scenes, not {len(paths)}.')
+    out_path = str(out_path)
+    src_out_path = source_path(out_path)
+    srcs = [rio.open(fp) for fp in paths]
+    vrts = []
+    try:
+        crs = crs if crs is not None else srcs[0].crs
+        grid = mosaic_grid(srcs, crs, res)
+        offsets = [_grid_offset(src, grid) for src in srcs]
+        for src, offset in zip(srcs, offsets):
+            if offset is None:
+                vrts.append(WarpedVRT(src, resampling=Resampling.nearest, src_nodata=src.nodata or 0, nodata=0,
+                                      **grid))
+            else:
+                vrts.append(None)
+        scene_bounds = [transform_bounds(src.crs, crs, *src.bounds) for src in srcs]
+        qa_idx = [_band_index(src, 'QA60') for src in srcs]
+        blue_idx = [_band_index(src, 'B2', S2_BANDS['B2'] if src.count >= len(S2_BANDS) else None) for src in srcs]
+
+        profile = dict(driver='GTiff', count=srcs[0].count, dtype=dtype, nodata=None, interleave='band', **grid)
+        update_profile(profile, out_path)
+        src_profile = update_profile(dict(profile, count=1, dtype='uint8', nodata=SOURCE_NODATA), src_out_path)
+        info = np.iinfo(dtype) if np.issubdtype(np.dtype(dtype), np.integer) else np.finfo(dtype)
+        with rio.open(out_path, 'w', **profile) as dst, rio.open(src_out_path, 'w', **src_profile) as src_dst:
+            for _, window in dst.block_windows(1):
+                left, bottom, right, top = window_bounds(window, dst.transform)
+                best = np.full((window.height, window.width), -np.inf, dtype='float32')
+                source = np.full((window.height, window.width), SOURCE_NODATA, dtype='uint8')
+                out = np.zeros((dst.count, window.height, window.width), dtype=dtype)
+                for i, vrt in enumerate(vrts):
+                    b = scene_bounds[i]
+                    if b[0] >= right or b[2] <= left or b[1] >= top or b[3] <= bottom:
+                        continue
+                    if vrt is not None:
+                        data = vrt.read(window=window)
+                    else:
+                        data = _read_on_grid(srcs[i], offsets[i], window)
+                    qa = data[qa_idx[i] - 1].astype('int64') if qa_idx[i] is not None else None
+                    blue = data[blue_idx[i] - 1] if blue_idx[i] is not None else None
+                    score = quality_score(data, qa, blue)
+                    better = score > best
+                    if not better.any():
+                        continue
+                    best[better] = score[better]
+                    source[better] = i
+                    out[:, better] = np.clip(data[:, better], info.min, info.max).astype(dtype)
+                dst.write(out, window=window)
+                src_dst.write(source, 1, window=window)
+            dst.descriptions = srcs[0].descriptions
+            src_dst.set_band_description(1, 'MOSAICSRC')
+            sources = json.dumps([Path(fp).name for fp in paths])
+            dst.update_tags(MOSAIC_SOURCES=sources)
+            src_dst.update_tags(SOURCES=sources)
+    finally:
+        for vrt in vrts:
+            if vrt is not None:
+                vrt.close()
+        for src in srcs:
+            src.close()
+    finalize(out_path)
+    finalize(src_out_path)
+    print(f'{out_path} mosaicked from {len(paths)} scenes (sources in {src_out_path}).')
+    return out_path, src_out_path
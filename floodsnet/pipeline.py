@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+"""
+Post-download processing of flood events: reprojection, NDWI and other spectral indices, resampling, classification
+and training chips.
+
+"""
+import functools
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from pathlib import Path
+from typing import Union
+
+from . import storage, tracing
+from .calculate_classes import calc_classes
+from .chips import make_chips
+from .calculate_features import SPECTRAL_INDICES, _get_ndwi_formula, calc_features, calc_ndwi, compile_expression
+from .dag import Dag, Node, code_version
+from .geetasks import check_gee_split, check_on_tasks_in_queue
+from .ledger import STAGE_DEPENDENCIES, RunLedger, ValidityStore, describe_output
+from .mosaic import source_path
+from .products import name_layers
+from .s2_functions import _get_rio_profile, _reproj_merge, reproj_rename_s2, resample_to_s2, target_grid
+from .tools import gdal_is_valid
+from .tracing import span
+from .watcher import wait_for_downloads
+
+
+def _stage_reproject(dt_set: str, gt_name: str, s2_lst: list, s1_lst: list, out_dir: Union[str, Path],
+                     generated_img_path: Union[str, Path]) -> dict:
+    """Reprojects/merges S2, or S1 if there is no S2. Returns the path, profile and `TargetGrid` of the reprojected
+    image (the first one if there are several), the paths of all the reprojected images, the paths of the source-index
+    sidecars of those that are mosaics (see `floodsnet.mosaic`), and the satellite."""
+    if len(s2_lst) > 1:  # if there are more than 1 files per gt_name so (1), (2) etc.
+        # reproject with merge
+        print("reprojecting with merge, s2_lst ", len(s2_lst), s2_lst)
+        s_outpath, profile = reproj_rename_s2(img_path=s2_lst.copy(),
+                                              dt_set=dt_set,
+                                              gt_name=gt_name,
+                                              out_dir=out_dir,
+                                              sat='S2',
+                                              generated_img_path=generated_img_path)
+        sat = 'S2'
+    elif len(s2_lst) == 1:
+        # REPROJECT
+        s_outpath, profile = reproj_rename_s2(img_path=s2_lst[0],
+                                              dt_set=dt_set,
+                                              gt_name=gt_name,
+                                              out_dir=out_dir,
+                                              sat='S2',
+                                              generated_img_path=generated_img_path)
+        sat = 'S2'
+    else:  # no s2 images, at least 1 s1
+        # REPROJECT / GET S1 PROFILE
+        s_outpath, profile = reproj_rename_s2(img_path=s1_lst.copy(),
+                                              dt_set=dt_set,
+                                              gt_name=gt_name,
+                                              out_dir=out_dir,
+                                              sat='S1',
+                                              generated_img_path=generated_img_path)
+        sat = 'S1'
+
+    paths = [str(s_outpath)]
+    if sat == 'S2':
+        paths.extend(s2_path for s2_path in glob(f'{out_dir}/{dt_set}_{gt_name}*S2.tif') if s2_path != str(s_outpath))
+    sources = [source_path(fp) for fp in paths if Path(source_path(fp)).exists()]
+    return {'path': str(s_outpath), 'paths': paths, 'sources': sources, 'profile': profile,
+            'grid': target_grid(s_outpath), 'sat': sat}
+
+
+def _load_reproject(paths: list, sat: str) -> dict:
+    sources = [source_path(fp) for fp in paths if source_path(fp) in paths]
+    paths = [fp for fp in paths if fp not in sources]
+    profile = _get_rio_profile(paths[0])
+    profile['nodata'] = None
+    return {'path': paths[0], 'paths': paths, 'sources': sources, 'profile': profile, 'grid': target_grid(paths[0]),
+            'sat': sat}
+
+
+def _stage_ndwi(reproj: dict, dt_set: str, out_dir: Union[str, Path]) -> list:
+    if reproj['sat'] != 'S2':
+        return []
+    print("s2_dwnld_path_lst:", reproj['paths'])
+    ndwi_paths = []
+    # calculate ndwi for each s2 image
+    for s2_path in reproj['paths']:
+        s2_name = Path(s2_path).stem.replace("_S2", "")
+        print(f's2_path: {s2_path}')
+        print(f's2_name: {s2_name}')
+        # CALCULATE NDWI
+        ndwi_paths.append(calc_ndwi(s2_path=reproj['path'],
+                                    dt_set=dt_set,
+                                    s2_name=s2_name,
+                                    out_dir=out_dir,
+                                    profile=reproj['profile'].copy()))
+    return ndwi_paths
+
+
+def _stage_features(reproj: dict, dt_set: str, out_dir: Union[str, Path], features: dict, separate: bool) -> list:
+    if reproj['sat'] != 'S2' or len(features) == 0:
+        return []
+    feature_paths = []
+    # calculate all the indices of each s2 image in one pass
+    for s2_path in reproj['paths']:
+        s2_name = Path(s2_path).stem.replace("_S2", "")
+        feature_paths.extend(calc_features(s2_path=s2_path,
+                                           dt_set=dt_set,
+                                           s2_name=s2_name,
+                                           out_dir=out_dir,
+                                           profile=reproj['profile'].copy(),
+                                           features=features,
+                                           separate=separate))
+    return feature_paths
+
+
+def _stage_resample_s1(reproj: dict, s1_lst: list, dt_set: str, gt_name: str, out_dir: Union[str, Path],
+                       generated_img_path: Union[str, Path]) -> list:
+    if reproj['sat'] != 'S2':  # without S2, S1 is the reference image itself
+        return []
+    if len(s1_lst) == 0:
+        print(f'No S1 images for {gt_name}')
+        return []
+    s1_resamp_paths = []
+    for s1_path in s1_lst:
+        # resample s1 to s2 profile
+        s1_resamp_path = resample_to_s2(in_path=s1_path,
+                                        s2_path=reproj['path'],
+                                        gt_name=gt_name,
+                                        out_dir=out_dir,
+                                        tag='S1',
+                                        dt_set=dt_set,
+                                        generated_img_path=generated_img_path,
+                                        grid=reproj['grid'])
+        print('s1_resamp_path: ', s1_resamp_path)
+        s1_resamp_paths.append(s1_resamp_path)
+    return s1_resamp_paths
+
+
+def _stage_resample(reproj: dict, in_path: str, tag: str, dt_set: str, gt_name: str, out_dir: Union[str, Path],
+                    generated_img_path: Union[str, Path]) -> str:
+    if in_path is None:
+        raise FileNotFoundError(f'No {tag} image found for {gt_name}.')
+    # resample gt/jrc to s2 profile
+    return resample_to_s2(in_path=in_path,
+                          s2_path=reproj['path'],
+                          gt_name=gt_name,
+                          tag=tag,
+                          out_dir=out_dir,
+                          dt_set=dt_set,
+                          generated_img_path=generated_img_path,
+                          grid=reproj['grid'])
+
+
+def _stage_classes(reproj: dict, gt_resamp_path: str, jrc_resamp_path: str, dt_set: str, gt_name: str,
+                   out_dir: Union[str, Path]) -> str:
+    # CLASSIFY IMAGE
+    return calc_classes(dt_set=dt_set, s2_name=gt_name, out_dir=out_dir, profile=reproj['profile'].copy(),
+                        gt_path=gt_resamp_path, jrc_path=jrc_resamp_path)
+
+
+def _stage_chips(reproj: dict, ndwi_paths: list, s1_resamp_paths: list, jrc_resamp_path: str, class_path: str,
+                 dt_set: str, gt_name: str, out_dir: Union[str, Path], size: int, overlap: int) -> list:
+    if size is None or class_path is None:
+        return []
+    # CUT CHIPS of the layers that are on the S2 grid
+    paths = reproj['paths'] + list(ndwi_paths) + list(s1_resamp_paths) + [jrc_resamp_path, class_path]
+    return make_chips(name_layers(paths), dt_set=dt_set, event=gt_name, out_dir=out_dir, size=size,
+                      overlap=overlap)
+
+
+def _stage_paths(stage: str, result) -> list:
+    """Output paths of a stage, given its result."""
+    if result is None:
+        return []
+    if stage == 'reproject':
+        return result['paths'] + result['sources']
+    if isinstance(result, list):
+        return [str(fp) for fp in result]
+    return [str(result)]
+
+
+def event_dag(dt_set: str, gt_name: str, gt_path: str, s2_lst: list, s1_lst: list, jrc_path: str,
+              out_dir: Union[str, Path], generated_img_path: Union[str, Path], done: dict = None,
+              features: list = (), separate_features: bool = False, chip_size: int = None,
+              chip_overlap: int = 0) -> Dag:
+    """Declares the stages of an event as a DAG (see `floodsnet.ledger.STAGE_DEPENDENCIES`), with the files each stage
+    reads, its parameters and code version. `done` maps the stages recorded in the ledger to their outputs, which are
+    used to load the result of the stages that are up to date. `features` are the spectral indices (see
+    `floodsnet.calculate_features.SPECTRAL_INDICES`) of the features stage, and `chip_size` and `chip_overlap` those
+    of the chips stage (no chips if `chip_size` is None)."""
+    done = done if done is not None else {}
+    common = dict(dt_set=dt_set, gt_name=gt_name, out_dir=str(out_dir), generated_img_path=str(generated_img_path))
+    sat = 'S2' if len(s2_lst) > 0 else 'S1'
+    nodes = [
+        Node('reproject', _stage_reproject, inputs=s2_lst if sat == 'S2' else s1_lst,
+             params=dict(common, s2_lst=s2_lst, s1_lst=s1_lst),
+             version=code_version(_stage_reproject, reproj_rename_s2, _reproj_merge),
+             load=lambda: _load_reproject(done['reproject'], sat)),
+        Node('ndwi', _stage_ndwi,
+             params=dict(dt_set=dt_set, out_dir=str(out_dir)),
+             version=code_version(_stage_ndwi, calc_ndwi, _get_ndwi_formula),
+             load=lambda: done.get('ndwi', [])),
+        Node('features', _stage_features,
+             params=dict(dt_set=dt_set, out_dir=str(out_dir), separate=separate_features,
+                         features={name: SPECTRAL_INDICES[name] for name in features}),
+             version=code_version(_stage_features, calc_features, compile_expression),
+             load=lambda: done.get('features', [])),
+        Node('resample_s1', _stage_resample_s1, inputs=s1_lst,
+             params=dict(common, s1_lst=s1_lst),
+             version=code_version(_stage_resample_s1, resample_to_s2),
+             load=lambda: done.get('resample_s1', [])),
+        Node('resample_gt', _stage_resample, inputs=[gt_path],
+             params=dict(common, in_path=gt_path, tag='GT'),
+             version=code_version(_stage_resample, resample_to_s2),
+             load=lambda: done['resample_gt'][0]),
+        Node('resample_jrc', _stage_resample, inputs=[jrc_path],
+             params=dict(common, in_path=jrc_path, tag='JRC'),
+             version=code_version(_stage_resample, resample_to_s2),
+             load=lambda: done['resample_jrc'][0]),
+        Node('classes', _stage_classes,
+             params=dict(dt_set=dt_set, gt_name=gt_name, out_dir=str(out_dir)),
+             version=code_version(_stage_classes, calc_classes),
+             load=lambda: (done.get('classes') or [None])[0]),
+        Node('chips', _stage_chips,
+             params=dict(dt_set=dt_set, gt_name=gt_name, out_dir=str(out_dir), size=chip_size, overlap=chip_overlap),
+             version=code_version(_stage_chips, make_chips, name_layers),
+             load=lambda: done.get('chips', [])),
+    ]
+    for node in nodes:
+        node.deps = STAGE_DEPENDENCIES[node.name]
+    return Dag(nodes)
+
+
+def process_event(dt_set: str, gt_name: str, gt_path: str, s2_lst: list, s1_lst: list, jrc_path: str,
+                  out_dir: Union[str, Path], generated_img_path: Union[str, Path], done: dict = None,
+                  stored_keys: dict = None, stage_workers: int = 1, features: list = (),
+                  separate_features: bool = False, chip_size: int = None, chip_overlap: int = 0):
+    """Runs the chain of stages for a single event: reproject/merge S2 (or S1 if there is no S2), calculate NDWI and
+    the spectral indices in `features` (in one file, or one file per index if `separate_features`), resample S1, GT
+    and JRC to the S2 grid, classify, and cut training chips of `chip_size` pixels overlapping by `chip_overlap` (if
+    `chip_size` is given).
+    The stages are run as a DAG (see `event_dag`): given the outputs (`done`) and keys (`stored_keys`) of each stage
+    recorded in the ledger, only the stages whose inputs, parameters or code changed since are run again, after their
+    old outputs are deleted. Stages without a recorded key are run, but skip outputs that already exist. Independent
+    stages run in parallel on up to `stage_workers` threads.
+    Returns the (stage, path) pairs of the outputs of the stages that were run, and the keys of those stages.
+    """
+    done = done if done is not None else {}
+    stored_keys = stored_keys if stored_keys is not None else {}
+    print(f'{gt_name}')
+    print(f's2_lst: {len(s2_lst)}')
+    print(f's1_lst: {len(s1_lst)}\n')
+    if len(s2_lst) == 0 and len(s1_lst) == 0:
+        print(f"no s2 or s1 images for {gt_name}\n")
+        return [], {}
+
+    dag = event_dag(dt_set, gt_name, gt_path, s2_lst, s1_lst, jrc_path, out_dir, generated_img_path, done,
+                    features=features, separate_features=separate_features, chip_size=chip_size,
+                    chip_overlap=chip_overlap)
+    # a recorded key is only trusted if the outputs that other stages need are recorded too
+    has_dependents = {dep for node in dag.nodes.values() for dep in node.deps}
+    stored_keys = {stage: key for stage, key in stored_keys.items() if stage in done or stage not in has_dependents}
+
+    def remove_outputs(stage):
+        print(f'{stage} of {gt_name} is out of date. Recomputing it.')
+        for fp in done.get(stage, []):
+            if Path(fp).exists():
+                Path(fp).unlink()
+
+    results, keys, ran = dag.run(stored_keys, max_workers=stage_workers, on_stale=remove_outputs,
+                                 trace_attrs={'event': gt_name})
+    outputs = [(stage, fp) for stage in ran for fp in _stage_paths(stage, results[stage])]
+    return outputs, {stage: keys[stage] for stage in ran}
+
+
+def _run_event(event: dict, checksum_outputs: bool = False, **kwargs) -> tuple:
+    """Processes an event and returns the ledger records of its new outputs (with a checksum of their content if
+    `checksum_outputs`, see `describe_output`) and the keys of the stages that ran."""
+    with span('event', 'event', event=event['gt_name']):
+        outputs, keys = process_event(**event, **kwargs)
+    return [describe_output(stage, path, checksum=checksum_outputs) for stage, path in outputs], keys
+
+
+def _run_event_safe(event: dict, **kwargs):
+    """Wraps `_run_event` so that an exception in a worker is returned as a formatted traceback instead of being
+    raised, which lets the remaining events of the pool carry on. Returns (records, keys, traceback or None, spans),
+    with the spans traced in the worker (see `floodsnet.tracing`)."""
+    try:
+        records, keys = _run_event(event, **kwargs)
+        err = None
+    except Exception:
+        records, keys, err = [], {}, traceback.format_exc()
+    return records, keys, err, tracing.collect()
+
+
+def _init_worker(trace: bool, storage_settings: dict):
+    tracing.init_worker(trace)
+    storage.init_worker(storage_settings)
+
+
+def _record_event(ledger: RunLedger, dt_set: str, gt_name: str, records: list, keys: dict, err: str = None):
+    if ledger is None:
+        return
+    for stage in keys:  # the outputs of the stages that ran replace the recorded ones
+        ledger.forget_stage(dt_set, gt_name, stage, remove_files=False)
+    ledger.record_outputs(dt_set, gt_name, records)
+    ledger.record_stage_keys(dt_set, gt_name, keys)
+    ledger.record_event(dt_set, gt_name, 'failed' if err is not None else 'done', err)
+
+
+def _ledger_state(ledger: RunLedger, dt_set: str):
+    if ledger is None:
+        return {}, {}
+    # stages whose recorded outputs were deleted or changed are run again
+    ledger.forget_changed_stages(dt_set)
+    return ledger.done_stages(dt_set), ledger.stage_keys(dt_set)
+
+
+def run_events(events: list, dt_set: str, out_dir: Union[str, Path], generated_img_path: Union[str, Path],
+               jobs: int = 1, ledger: RunLedger = None, stage_workers: int = 1, features: list = (),
+               separate_features: bool = False, chip_size: int = None, chip_overlap: int = 0,
+               checksum_outputs: bool = False, failed: dict = None) -> dict:
+    """Processes each event in `events` (a list of dicts with the `process_event` event arguments, i.e., gt_name,
+    gt_path, s2_lst, s1_lst and jrc_path).
+    `failed` maps the gt_name of the events that already failed (e.g., because one of their downloads is not valid) to
+    their error; they are not processed, but are recorded and reported with the other failures.
+    With `jobs` <= 1 events are processed one at a time in this process and any exception is raised, once the event
+    is recorded as failed in the `ledger`. Otherwise, each event is sent to a pool of `jobs` worker processes;
+    failures are collected and reported once all events are done.
+    If a `ledger` is given, only the stages that are out of date according to it are run, and the new outputs are
+    recorded in it, with a checksum of their content if `checksum_outputs` (their size and modification time
+    otherwise). Within an event, independent stages run on up to `stage_workers` threads. `features`,
+    `separate_features`, `chip_size` and `chip_overlap` are passed on to `process_event`.
+    Returns a dict mapping the gt_name of each failed event to its traceback.
+    """
+    kwargs = dict(dt_set=dt_set, out_dir=out_dir, generated_img_path=generated_img_path, stage_workers=stage_workers,
+                  features=features, separate_features=separate_features, chip_size=chip_size,
+                  chip_overlap=chip_overlap, checksum_outputs=checksum_outputs)
+    done, stored_keys = _ledger_state(ledger, dt_set)
+    failed = dict(failed) if failed is not None else {}
+    for gt_name, err in failed.items():
+        _record_event(ledger, dt_set, gt_name, [], {}, err)
+    events = [event for event in events if event['gt_name'] not in failed]
+    if jobs <= 1:
+        for event in events:
+            gt_name = event['gt_name']
+            try:
+                records, keys = _run_event(event, done=done.get(gt_name), stored_keys=stored_keys.get(gt_name),
+                                           **kwargs)
+            except Exception:
+                _record_event(ledger, dt_set, gt_name, [], {}, traceback.format_exc())
+                raise
+            _record_event(ledger, dt_set, gt_name, records, keys)
+        if len(failed) > 0:
+            report_failures(failed, dt_set)
+        return failed
+
+    print(f'Processing {len(events)} {dt_set} events with {jobs} workers.')
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(tracing.is_enabled(), storage.settings())) as executor:
+        futures = [executor.submit(_run_event_safe, event, done=done.get(event['gt_name']),
+                                   stored_keys=stored_keys.get(event['gt_name']), **kwargs)
+                   for event in events]
+        # collected in submission order so that the report is the same from run to run
+        for event, future in zip(events, futures):
+            try:
+                records, keys, err, spans = future.result()
+            except Exception:  # e.g., the worker process died
+                records, keys, err, spans = [], {}, traceback.format_exc(), []
+            tracing.add_spans(spans)
+            _record_event(ledger, dt_set, event['gt_name'], records, keys, err)
+            if err is not None:
+                failed[event['gt_name']] = err
+
+    report_failures(failed, dt_set)
+    return failed
+
+
+def _expand_gee_split(paths: list) -> list:
+    """Replaces each path in `paths` that does not exist by the files GEE split it into, if any."""
+    expanded = []
+    for fp in paths:
+        if Path(fp).exists():
+            expanded.append(fp)
+            continue
+        gee_did_split, fps = check_gee_split(fp)
+        if gee_did_split:
+            expanded.extend(sorted(str(f) for f in fps))
+        else:
+            expanded.append(fp)
+    return expanded
+
+
+def _sync_and_process_event(event: dict, downloads: list, validity_db: str = None, **kwargs):
+    """Waits for the GEE exports of the event in `downloads` to be synced and valid locally, then processes it.
+    Downloads found valid are remembered in the ledger database at `validity_db`, if given."""
+    store = ValidityStore(validity_db) if validity_db is not None else None
+    wait_for_downloads(downloads, validate=functools.partial(gdal_is_valid, store=store))
+    event = dict(event,
+                 s2_lst=_expand_gee_split(event['s2_lst']),
+                 s1_lst=_expand_gee_split(event['s1_lst']))
+    if event['jrc_path'] is not None:
+        event['jrc_path'] = _expand_gee_split([event['jrc_path']])[0]
+    return _run_event_safe(event, **kwargs)
+
+
+def stream_events(events: list, event_downloads: dict, dt_set: str, out_dir: Union[str, Path],
+                  generated_img_path: Union[str, Path], jobs: int = 1, ledger: RunLedger = None,
+                  stage_workers: int = 1, features: list = (), separate_features: bool = False,
+                  chip_size: int = None, chip_overlap: int = 0, checksum_outputs: bool = False) -> dict:
+    """Processes each event in `events` (see `run_events`) as soon as its own GEE exports are done, so that the
+    processing of the events overlaps with the downloads of the others.
+    `event_downloads` maps the gt_name of each event to a dict with the (task, path) pairs of its 's2', 's1' and 'jrc'
+    exports. The exported paths are added to the event inputs; exports whose task does not complete are left out.
+    Events are processed by a pool of `jobs` worker processes (at least one), which also wait for the exported files
+    to be synced. If a `ledger` is given, it is used as in `run_events`.
+    Returns a dict mapping the gt_name of each failed event to its traceback.
+    """
+    kwargs = dict(dt_set=dt_set, out_dir=out_dir, generated_img_path=generated_img_path, stage_workers=stage_workers,
+                  features=features, separate_features=separate_features, chip_size=chip_size,
+                  chip_overlap=chip_overlap, checksum_outputs=checksum_outputs)
+    done, stored_keys = _ledger_state(ledger, dt_set)
+    validity_db = str(ledger.path) if ledger is not None else None
+    events = [dict(event) for event in events]
+    by_name = {event['gt_name']: event for event in events}
+    layer_keys = {'s2': 's2_lst', 's1': 's1_lst'}
+
+    pending = {}
+    task_events = {}
+    for gt_name, layers in event_downloads.items():
+        event = by_name[gt_name]
+        event['downloads'] = []
+        for layer, task_paths in layers.items():
+            for task, path in task_paths:
+                pending.setdefault(gt_name, set()).add(task)
+                task_events[task] = (gt_name, layer, path)
+                event['downloads'].append(path)
+                if layer == 'jrc':
+                    event['jrc_path'] = path
+                else:
+                    event[layer_keys[layer]].append(path)
+
+    failed = {}
+    futures = {}
+    print(f'Streaming {len(events)} {dt_set} events ({len(pending)} waiting for GEE) with {max(jobs, 1)} workers.')
+    with ProcessPoolExecutor(max_workers=max(jobs, 1), initializer=_init_worker,
+                             initargs=(tracing.is_enabled(), storage.settings())) as executor:
+        def submit(name):
+            event = dict(by_name[name])
+            downloads = event.pop('downloads', [])
+            futures[name] = executor.submit(_sync_and_process_event, event, downloads, validity_db=validity_db,
+                                            done=done.get(name), stored_keys=stored_keys.get(name), **kwargs)
+
+        def on_complete(task, status):
+            gt_name, layer, path = task_events[task]
+            if status['state'] != 'COMPLETED':
+                print(f'GEE task for {path} ended as {status["state"]}. Processing {gt_name} without it.')
+                event = by_name[gt_name]
+                event['downloads'].remove(path)
+                if layer == 'jrc':
+                    event['jrc_path'] = None
+                else:
+                    event[layer_keys[layer]].remove(path)
+            pending[gt_name].discard(task)
+            if len(pending[gt_name]) == 0:
+                del pending[gt_name]
+                submit(gt_name)
+
+        for event in events:
+            if event['gt_name'] not in pending:
+                submit(event['gt_name'])
+        check_on_tasks_in_queue(list(task_events), on_complete=on_complete)
+
+        for event in events:
+            gt_name = event['gt_name']
+            try:
+                records, keys, err, spans = futures[gt_name].result()
+            except Exception:
+                records, keys, err, spans = [], {}, traceback.format_exc(), []
+            tracing.add_spans(spans)
+            _record_event(ledger, dt_set, gt_name, records, keys, err)
+            if err is not None:
+                failed[gt_name] = err
+
+    report_failures(failed, dt_set)
+    return failed
+
+
+def report_failures(failed: dict, dt_set: str):
+    if len(failed) == 0:
+        print(f'All {dt_set} events processed without errors.')
+        return
+    print(f'{len(failed)} {dt_set} event(s) failed:')
+    for gt_name, err in failed.items():
+        print(f'--- {gt_name} ---\n{err}')
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Harmonized products of each event (S2, S1, NDWI, spectral features, CLASS, and resampled GT and JRC), found from the
+run ledger or, without one, from the file names in the output folders.
+
+"""
+import os
+from glob import glob
+from pathlib import Path
+from typing import Union
+
+from .paths import dataset_paths
+
+# stages whose outputs are not products of the event itself
+NOT_PRODUCT_STAGES = ['chips']
+
+
+def layer_tag(path: Union[str, Path]) -> str:
+    """Layer of a product from its file name, e.g., 'S2' for usgs_EVENT_20200101_T33TWL_S2.tif or 'GT' for
+    EVENT_resamp_GT.tif."""
+    return Path(path).stem.split('_')[-1]
+
+
+def name_layers(paths: list) -> dict:
+    """Maps each path to a layer name: its `layer_tag`, numbered (S2, S2_1, S2_2...) if several paths have the same
+    tag, in sorted order."""
+    layers = {}
+    for fp in sorted(str(fp) for fp in paths):
+        tag = layer_tag(fp)
+        name, i = tag, 0
+        while name in layers:
+            i += 1
+            name = f'{tag}_{i}'
+        layers[name] = fp
+    return layers
+
+
+def _scan_event_names(dt_set: str, out_dir: Union[str, Path]) -> list:
+    """Events with a CLASS product, i.e., processed to the end."""
+    prefix, suffix = f'{dt_set}_', '_CLASS'
+    stems = [Path(fp).stem for fp in glob(os.path.join(str(out_dir), f'{prefix}*{suffix}.tif'))]
+    return sorted(stem[len(prefix):-len(suffix)] for stem in stems)
+
+
+def scan_products(dt_set: str, out_dir: Union[str, Path], generated_img_path: Union[str, Path]) -> dict:
+    """Returns {event: [paths of its products]}, from the file names in `out_dir` and the `resampled` folder of
+    `dt_set`. Used when there is no ledger."""
+    resampled = dataset_paths(dt_set, generated_img_path)['resampled']
+    names = _scan_event_names(dt_set, out_dir)
+    products = {}
+    for gt_name in names:
+        # files of events whose name starts with this one (e.g., EMSR1_2 for EMSR1) are not this event's
+        longer = [f'{dt_set}_{other}_' for other in names if other != gt_name and other.startswith(f'{gt_name}_')]
+        paths = [fp for fp in glob(os.path.join(str(out_dir), f'{dt_set}_{gt_name}_*.tif'))
+                 if not any(Path(fp).name.startswith(prefix) for prefix in longer)]
+        paths += [str(fp) for fp in [Path(resampled) / f'{gt_name}_resamp_GT.tif',
+                                     Path(resampled) / f'{gt_name}_resamp_JRC.tif'] if fp.exists()]
+        products[gt_name] = sorted(paths)
+    return products
+
+
+def ledger_products(ledger, dt_set: str) -> dict:
+    """Returns {event: [paths of its products]} with the existing outputs recorded in `ledger` for `dt_set`."""
+    products = {}
+    for event, stages in sorted(ledger.done_stages(dt_set).items()):
+        paths = [fp for stage, paths in stages.items() if stage not in NOT_PRODUCT_STAGES for fp in paths
+                 if os.path.exists(fp)]
+        if len(paths) > 0:
+            products[event] = sorted(set(paths))
+    return products
+
+
+def event_products(dt_set: str, out_dir: Union[str, Path], generated_img_path: Union[str, Path],
+                   ledger=None) -> dict:
+    """Returns {event: {layer name: path}} (see `name_layers`) with the products of each event of `dt_set`, from the
+    `ledger` if given, or from the output folders otherwise."""
+    if ledger is not None:
+        products = ledger_products(ledger, dt_set)
+    else:
+        products = scan_products(dt_set, out_dir, generated_img_path)
+    return {event: name_layers(paths) for event, paths in products.items()}
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Training reader over the harmonized products: returns aligned windows of several layers of an event (e.g., S2 bands,
+S1 VV/VH, NDWI and CLASS) as NumPy arrays in one call.
+
+Datasets are kept open in an LRU handle cache, so that each sample only reads (and decodes) the blocks of its window.
+Hot events can also be copied, uncompressed, to a cache folder of .npy files, which are then read through memory maps
+without any decoding. A reader is meant to be used by one thread; each worker process (e.g., of a PyTorch DataLoader)
+opens its own datasets.
+
+>>> from floodsnet.products import event_products
+>>> reader = ProductReader(event_products('usgs', out_dir, generated_img_path, ledger))
+>>> event, window, arrays = reader.sample(256)
+>>> arrays['S2'].shape
+(13, 256, 256)
+"""
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+
+from .dag import input_fingerprint
+
+DEFAULT_LAYERS = ['S2', 'S1', 'NDWI', 'CLASS']
+
+
+class HandleCache:
+    """LRU cache of open rasterio datasets, with at most `maxsize` open at once. Handles inherited from a parent
+    process (after a fork) are dropped, not reused."""
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._handles = OrderedDict()
+        self._pid = os.getpid()
+
+    def get(self, path: str):
+        if self._pid != os.getpid():  # forked: the handles belong to the parent
+            self._handles = OrderedDict()
+            self._pid = os.getpid()
+        src = self._handles.get(path)
+        if src is None:
+            src = rio.open(path)
+            self._handles[path] = src
+            while len(self._handles) > self.maxsize:
+                _, old = self._handles.popitem(last=False)
+                old.close()
+        else:
+            self._handles.move_to_end(path)
+        return src
+
+    def close(self):
+        for src in self._handles.values():
+            src.close()
+        self._handles.clear()
+
+
+class ProductReader:
+    """Reads aligned windows of the `layers` of the events in `products` ({event: {layer name: path}}, see
+    `floodsnet.products.event_products`). Events without all the `layers` are left out. If `cache_dir` is given,
+    `cache_event` copies events there as uncompressed .npy files for memory-mapped reads."""
+
+    def __init__(self, products: dict, layers: list = None, max_open: int = 64,
+                 cache_dir: Union[str, Path] = None):
+        self.layers = list(layers) if layers is not None else list(DEFAULT_LAYERS)
+        self.products = {event: {name: str(layer_paths[name]) for name in self.layers}
+                         for event, layer_paths in products.items() if all(name in layer_paths for name in self.layers)}
+        self.events = sorted(self.products)
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.handles = HandleCache(max_open)
+        self._shapes = {}
+        self._memmaps = {}
+        self._not_cached = set()
+
+    def shape(self, event: str) -> tuple:
+        """(height, width) of the event, after checking that all its layers are on the same grid."""
+        if event not in self._shapes:
+            grids = {}
+            for name, fp in self.products[event].items():
+                src = self.handles.get(fp)
+                grids[name] = (src.height, src.width, tuple(src.transform))
+            if len(set(grids.values())) > 1:
+                raise ValueError(f'The layers of {event} are not aligned: {grids}')
+            self._shapes[event] = next(iter(grids.values()))[:2]
+        return self._shapes[event]
+
+    def read(self, event: str, window: Window) -> dict:
+        """Returns {layer name: array of shape (bands, height, width)} with `window` of each layer of `event`."""
+        memmaps = self._memmaps.get(event)
+        if memmaps is None and self.cache_dir is not None and event not in self._not_cached:
+            if self._is_cached(event):
+                memmaps = self._open_cached(event)
+            else:
+                self._not_cached.add(event)
+        if memmaps is not None:
+            rows, cols = window.toslices()
+            return {name: np.array(arr[:, rows, cols]) for name, arr in memmaps.items()}
+        return {name: self.handles.get(fp).read(window=window) for name, fp in self.products[event].items()}
+
+    def random_window(self, event: str, size: int, rng: np.random.Generator) -> Window:
+        height, width = self.shape(event)
+        if height < size or width < size:
+            raise ValueError(f'{event} ({height} x {width}) is smaller than the window ({size}).')
+        row = int(rng.integers(0, height - size + 1))
+        col = int(rng.integers(0, width - size + 1))
+        return Window(col, row, size, size)
+
+    def sample(self, size: int, rng: np.random.Generator = None) -> tuple:
+        """Reads a random `size` x `size` window of a random event. Returns (event, window, arrays)."""
+        rng = rng if rng is not None else np.random.default_rng()
+        event = self.events[int(rng.integers(len(self.events)))]
+        window = self.random_window(event, size, rng)
+        return event, window, self.read(event, window)
+
+    # memory-mapped cache tier
+
+    def _event_cache(self, event: str) -> Path:
+        return self.cache_dir / event
+
+    def _sources(self, event: str) -> dict:
+        return {name: input_fingerprint(fp) for name, fp in self.products[event].items()}
+
+    def _is_cached(self, event: str) -> bool:
+        sources_fp = self._event_cache(event) / 'sources.json'
+        return sources_fp.exists() and json.loads(sources_fp.read_text()) == self._sources(event)
+
+    def _open_cached(self, event: str) -> dict:
+        folder = self._event_cache(event)
+        memmaps = {name: np.load(folder / f'{name}.npy', mmap_mode='r') for name in self.layers}
+        self._memmaps[event] = memmaps
+        return memmaps
+
+    def cache_event(self, event: str):
+        """Copies the layers of `event` to uncompressed .npy files in the cache folder (if they are not there yet, or
+        their sources changed), block row by block row, so that the next reads of the event are memory-mapped."""
+        if self.cache_dir is None:
+            raise ValueError('The reader has no cache_dir.')
+        if self._is_cached(event):
+            return
+        folder = self._event_cache(event)
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / 'sources.json').unlink(missing_ok=True)  # incomplete until all the layers are written
+        for name, fp in self.products[event].items():
+            src = self.handles.get(fp)
+            arr = np.lib.format.open_memmap(folder / f'{name}.npy', mode='w+', dtype=src.dtypes[0],
+                                            shape=(src.count, src.height, src.width))
+            step = src.block_shapes[0][0]
+            for row in range(0, src.height, step):
+                window = Window(0, row, src.width, min(step, src.height - row))
+                arr[:, row:row + window.height, :] = src.read(window=window)
+            arr.flush()
+            del arr
+        (folder / 'sources.json').write_text(json.dumps(self._sources(event)))
+        self._memmaps.pop(event, None)
+        self._not_cached.discard(event)
+
+    def close(self):
+        self.handles.close()
+        self._memmaps.clear()
@@ -3,8 +3,10 @@
 Code related to Sentinel-2 images.
 
 """
+import functools
 import os
 import warnings
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Union
 
@@ -13,8 +15,11 @@ import rasterio as rio
 import rasterio.shutil
 from osgeo import gdal
 
+from .mosaic import mosaic_scenes
 from .paths import dataset_paths
-from .tools import compress_tiff, gdal_warp_compressed, gdal_set_descriptions, get_tiff_interleave
+from .storage import finalize, update_profile
+from .tools import compress_tiff, gdal_warp_compressed, gdal_warp_vrt, gdal_set_descriptions, get_tiff_interleave
+from .tracing import traced
 from .unosat_functions import get_utm_epsg_from_bounds
 
 
@@ -24,6 +29,42 @@ def _get_rio_profile(out_path: Union[str, Path]):
     return profile
 
 
+@dataclass(frozen=True)
+class TargetGrid:
+    """The grid of a reference (S2) raster that other rasters are resampled to, from its metadata only."""
+    crs: str
+    transform: tuple
+    bounds: tuple
+    height: int
+    width: int
+
+    @property
+    def res(self) -> int:
+        return int(round(self.transform[0]))
+
+    @classmethod
+    def from_raster(cls, path: Union[str, Path]) -> 'TargetGrid':
+        with rio.open(path, 'r') as src:
+            return cls(crs=str(src.crs), transform=tuple(src.transform), bounds=tuple(src.bounds),
+                       height=src.height, width=src.width)
+
+    def warp_options(self) -> dict:
+        """gdal.Warp options that resample to this grid."""
+        return dict(dstSRS=self.crs, outputBounds=self.bounds, xRes=self.res, yRes=self.res, height=self.height,
+                    width=self.width)
+
+
+@functools.lru_cache(maxsize=64)
+def _cached_target_grid(path: str, mtime_ns: int, size: int) -> TargetGrid:
+    return TargetGrid.from_raster(path)
+
+
+def target_grid(path: Union[str, Path]) -> TargetGrid:
+    """`TargetGrid` of the raster at `path`, cached until the file changes."""
+    st = os.stat(path)
+    return _cached_target_grid(str(path), st.st_mtime_ns, st.st_size)
+
+
 def _check_img_outpath(dt_set: str, gt_name: str, out_dir: str, sat: str, img_id: str, tile: str):
     # generate path for reprojected S2 image in the output directory
     if (dt_set == 'world_floods') or (dt_set == 'sen1_floods11' and sat == 'S2'):
@@ -55,9 +96,14 @@ def _castdown_dtype(ds):
 
 
 def _reproj_merge(img_lst: list, out_dir: Union[Path, str], gt_name: str, dt_set: str, sat: str,
-                  generated_img_path: Union[Path, str], tile: str = ''):
+                  generated_img_path: Union[Path, str], tile: str = '', keep_intermediates: bool = False):
     '''
         Reprojects, merges, renames, and saves S2 or S1 images in a list
+        S2 images with the same id are composited into a cloud-aware best-pixel mosaic (see `floodsnet.mosaic`), with
+        a _MOSAICSRC.tif sidecar of the image of each pixel. S1 images with the same id are warped as in-memory VRTs
+        and mosaicked, so that the merged image is computed and compressed in a single write. With
+        `keep_intermediates` (for debugging), each reprojected image is also saved to the `reprojected` folder, and
+        the mosaic is made from those (as a VRT, also for S2).
         Returns path of saved images
     '''
     print("img_path is a list. dt_set is:", dt_set)
@@ -85,38 +131,43 @@ def _reproj_merge(img_lst: list, out_dir: Union[Path, str], gt_name: str, dt_set
         if not os.path.exists(out_path):
             print('outpath does NOT exist')
             # if there is more than 1 image (s1 or s2) with the same ID (image date, processing date, and VV/VH and ASC/DESC for s1)
-            if len(img_id_lst) > 1:
+            if len(img_id_lst) > 1 and sat == 'S2' and not keep_intermediates:
+                # best-pixel mosaic, warped to the CRS of the first image block by block
+                if id_count == 0:
+                    with rio.open(img_id_lst[0]) as src:
+                        destCRS = src.crs
+                    profile_outpath = out_path
+                mosaic_scenes(img_id_lst, out_path, crs=destCRS)
+            elif len(img_id_lst) > 1:
                 print('len(img_id_lst)')
                 # reproj and merge
                 vrt_lst = [0] * len(img_id_lst)
-                vrt_lst_lzw = [0] * len(img_id_lst)
                 for i in range(len(img_id_lst)):
-                    reproj_path = str(reproj_base_path / Path(img_id_lst[i]).name)
                     with rio.open(img_id_lst[i]) as src:
                         if i == 0 and id_count == 0:
                             destCRS = src.crs
                             profile_outpath = out_path
-                        if i == 0:
-                            vrt_lst[i] = reproj_path
-                            gdal_warp_compressed(reproj_path,
-                                                 img_id_lst[i], format='GTiff',
-                                                 xRes=10, yRes=10, outputType=gdal.GDT_UInt16)
-                        else:
-                            srcCRS = src.crs
-                    if i > 0:
-                        # reproject
-                        gdal_warp_compressed(reproj_path,
-                                             img_id_lst[i], format='GTiff', srcSRS=srcCRS, dstSRS=destCRS,
-                                             xRes=10, yRes=10, outputType=gdal.GDT_UInt16)
-
-                        vrt_lst[i] = reproj_path
+                        warp_kwargs = dict(xRes=10, yRes=10, outputType=gdal.GDT_UInt16)
+                        if i > 0:
+                            warp_kwargs.update(srcSRS=src.crs, dstSRS=destCRS)
+                    # reproject
+                    if keep_intermediates:
+                        vrt_lst[i] = str(reproj_base_path / Path(img_id_lst[i]).name)
+                        gdal_warp_compressed(vrt_lst[i], img_id_lst[i], format='GTiff', **warp_kwargs)
+                    else:
+                        vrt_lst[i] = gdal_warp_vrt(f'/vsimem/{gt_name}_{img_id}_{i}.vrt', img_id_lst[i],
+                                                   **warp_kwargs)
                 # merge
-                vrt_path = f'/vsimem/{gt_name}.vrt'
+                vrt_path = f'/vsimem/{gt_name}_{img_id}.vrt'
                 vrt = gdal.BuildVRT(vrt_path, vrt_lst, srcNodata=0)
                 vrt = None
                 compress_tiff(vrt_path, out_path,
                               interleave=get_tiff_interleave(img_id_lst[0]))
                 gdal_set_descriptions(out_path, copy_from=img_id_lst[0])
+                gdal.Unlink(vrt_path)
+                for fp in vrt_lst:
+                    if fp.startswith('/vsimem/'):
+                        gdal.Unlink(fp)
 
             else:
                 print('len(img_id_lst) <=1')
@@ -130,10 +181,9 @@ def _reproj_merge(img_lst: list, out_dir: Union[Path, str], gt_name: str, dt_set
                     profile = src.profile.copy()
                     profile.update(
                         dtype=cast_to,
-                        compress='lzw',
                         interleave='band',
-                        tiled=True,
                     )
+                    update_profile(profile, out_path)
                     with rio.open(out_path, 'w', **profile) as dst:
                         # arr = src.read()
                         # if 'float' in src.meta['dtype'] and 'int' in cast_to:
@@ -145,6 +195,7 @@ def _reproj_merge(img_lst: list, out_dir: Union[Path, str], gt_name: str, dt_set
                         # dst.write(arr.astype(cast_to))
                         dst.write(src.read().astype(cast_to))
                         dst.descriptions = src.descriptions
+            finalize(out_path)
         else:
             print('outpath does exist')
             if id_count == 0:
@@ -160,12 +211,14 @@ def _reproj_merge(img_lst: list, out_dir: Union[Path, str], gt_name: str, dt_set
     return profile_outpath
 
 
+@traced('reproj_rename_s2')
 def reproj_rename_s2(img_path: Union[str, list], dt_set: str, gt_name: str, out_dir: Union[str, Path],
-                     sat: str, generated_img_path: Union[str, Path], tile: str = ''):
+                     sat: str, generated_img_path: Union[str, Path], tile: str = '', keep_intermediates: bool = False):
     """If the dataset already comes w S2 we just make sure they are in UTM, 10m,
     reproject, rename, and save S2 tif to the common naming convention
     saved to the local_out_dir folder.
     Return UTM profile for other rasters.
+    `keep_intermediates` is passed on to `_reproj_merge` when `img_path` is a list.
     """
     if not isinstance(img_path, list):
         if sat == 'S2':
@@ -196,17 +249,18 @@ def reproj_rename_s2(img_path: Union[str, list], dt_set: str, gt_name: str, out_
                 profile = src.profile.copy()
                 profile.update(
                     dtype=cast_to,
-                    compress='lzw',
                     interleave='band',
-                    tiled=True,
                 )
+                update_profile(profile, out_path)
                 with rio.open(out_path, 'w', **profile) as dst:
                     dst.write(src.read().astype(cast_to))
                     dst.descriptions = src.descriptions
+        finalize(out_path)
 
     else:  # img_path is a list
         out_path = _reproj_merge(img_lst=img_path, out_dir=out_dir, gt_name=gt_name,
-                                 dt_set=dt_set, sat=sat, generated_img_path=generated_img_path, tile=tile)
+                                 dt_set=dt_set, sat=sat, generated_img_path=generated_img_path, tile=tile,
+                                 keep_intermediates=keep_intermediates)
 
     profile = _get_rio_profile(out_path)
     profile['nodata'] = None
@@ -214,10 +268,12 @@ def reproj_rename_s2(img_path: Union[str, list], dt_set: str, gt_name: str, out_
     return out_path, profile
 
 
+@traced('resample_to_s2')
 def resample_to_s2(in_path: str, s2_path: str, gt_name: str, out_dir: str, tag: str, dt_set: str,
-                   generated_img_path: Union[str, Path]):
+                   generated_img_path: Union[str, Path], grid: TargetGrid = None):
     # code smell: some of the above str can in fact be pathlib.Path
-    """Resamples data to the S2 10x10m resolution."""
+    """Resamples data to the S2 10x10m resolution. `grid` is the `TargetGrid` of `s2_path`; pass it when resampling
+    several images to the same S2 image so that it is not reopened each time."""
     # generate path for reprojected gt image in the output directory
     if tag == 'S1' and dt_set == 'sen1_floods11' and Path(in_path).stem.split('_')[-1] != 'S1':
         out_path = Path(out_dir) / f'{dt_set}_{Path(in_path).stem}_{tag}.tif'
@@ -231,18 +287,11 @@ def resample_to_s2(in_path: str, s2_path: str, gt_name: str, out_dir: str, tag:
     if out_path.exists():
         print(f'{out_path} exists.')
     else:
-        with rio.open(s2_path) as src:
-            res = int(round(src.profile['transform'][0]))
-            srs = str(src.profile['crs'])
-            height_width = src.read(1).shape
-            profile = src.profile
-            bounds = src.bounds
-        out_bounds = (bounds[0], bounds[1], bounds[2], bounds[3])
-        gdal_warp_compressed(out_path, in_path,
-                             dstSRS=srs, outputBounds=out_bounds,
-                             xRes=res, yRes=res, height=height_width[0], width=height_width[1],
-                             outputType=gdal.GDT_Float32)
+        if grid is None:
+            grid = target_grid(s2_path)
+        gdal_warp_compressed(out_path, in_path, outputType=gdal.GDT_Float32, **grid.warp_options())
         gdal_set_descriptions(out_path, copy_from=in_path)
+        finalize(out_path)
         if tag == 'S1':
             print(f'{out_path} saved.')
     return out_path
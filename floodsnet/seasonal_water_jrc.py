@@ -1,18 +1,17 @@
 import os
 from typing_extensions import deprecated
 
-import ee
-import geetools
+from .earthengine import get_ee
+from .tracing import traced
 
 # from .timeout_decorator import timeout
 # from tenacity import retry, stop_after_attempt, wait_fixed
 
-ee.Initialize()
-
 
 # Modified from WorldFloods GitHub:
 # https://github.com/spaceml-org/ml4floods/blob/main/ml4floods/data/ee_download.py
 def _get_collection(collection_name, date_start, bounds, season=True):
+    ee = get_ee()
     collection = ee.ImageCollection(collection_name)
     if season:
         yr = int(date_start[:4])
@@ -50,13 +49,15 @@ def _get_collection(collection_name, date_start, bounds, season=True):
 
 # @retry(stop=stop_after_attempt(2), wait=wait_fixed(2))
 # @timeout(15)
-def download_seasonal_jrc_imgs(flood_date: str, bounds: ee.Geometry,
+@traced('submit_jrc', 'gee')
+def download_seasonal_jrc_imgs(flood_date: str, bounds: 'ee.Geometry',
                                collection_name: str = "JRC/GSW1_3/MonthlyHistory",
                                dt_set: str = '', img_name: str = '',
                                tile=None, monthly=False):
     '''
         Use GEE Python API to batch download JRC images
     '''
+    ee = get_ee()
     dt_set_fldr = {
         'world_floods': 'JRC_WORLDFLOODS',
         'sen1_floods11': 'JRC_SEN1FLOODS11',
@@ -183,7 +184,7 @@ def download_seasonal_jrc_imgs(flood_date: str, bounds: ee.Geometry,
 @deprecated('Seems to be an outdated version of other function. '
             'Also, seems to be calling an older version of _get_collection '
             'with a different signature than the current version')
-def download_jrc_imgs(date_start: str, date_end: str, bounds=ee.Geometry,
+def download_jrc_imgs(date_start: str, date_end: str, bounds: 'ee.Geometry' = None,
                       collection_name: str = "JRC/GSW1_3/YearlyHistory",
                       fldr: str = '', img_name: str = '', hls_tiles=None):
     """Use GEE Python API to batch download JRC images
@@ -196,6 +197,8 @@ def download_jrc_imgs(date_start: str, date_end: str, bounds=ee.Geometry,
     # GEE doesnt like time zones
     # date_start = date_start.replace(tzinfo=None)
     # date_end = date_end.replace(tzinfo=None)
+    import geetools
+    ee = get_ee()
     if hls_tiles is None:
         img_col_all, n_images_col = _get_collection(collection_name, date_start, date_end, bounds)
         if n_images_col <= 0:
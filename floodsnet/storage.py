@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Output format of the harmonized products. By default they are tiled GeoTIFFs, as written by each stage. With the 'cog'
+format, each product is converted, once written, to a Cloud-Optimized GeoTIFF with internal overviews, so that windowed
+and low-resolution reads (e.g., thumbnails or chips) only read the bytes they need.
+
+The storage layout of each product type (codec, predictor, block size and interleave) is set by a `StorageProfile`,
+which all the GeoTIFF writers use. The defaults keep the previous layout (LZW, 256 x 256 tiles); other profiles can
+be chosen per product type from the measurements of `floodsnet.autotune` and loaded from a JSON file:
+    {"S2": {"compress": "ZSTD", "level": 9, "predictor": "auto", "blocksize": 512, "interleave": "PIXEL"}, ...}
+
+The format and profiles are set for the whole run with `configure` (and in worker processes with `init_worker`).
+"""
+import json
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Union
+
+import rasterio as rio
+import rasterio.shutil
+
+OUTPUT_FORMATS = ['gtiff', 'cog']
+# products with categorical values, whose overviews must not mix classes
+CATEGORICAL_TAGS = ['CLASS', 'GT', 'JRC', 'MOSAICSRC']
+
+# product types with their own storage profile (see `product_type`)
+PRODUCT_TYPES = ['S2', 'S1', 'CLASS', 'NDWI', 'GT', 'JRC']
+# spectral index products (see `floodsnet.calculate_features`), stored with the NDWI profile
+INDEX_TAGS = ['NDWI', 'MNDWI', 'NDVI', 'AWEISH', 'FEATURES']
+CODECS = ['LZW', 'DEFLATE', 'ZSTD', 'LERC', 'LERC_DEFLATE', 'LERC_ZSTD']
+# creation option of the compression level of each codec
+_LEVEL_OPTIONS = {'DEFLATE': 'zlevel', 'ZSTD': 'zstd_level', 'LERC_DEFLATE': 'zlevel', 'LERC_ZSTD': 'zstd_level'}
+
+_settings = {'output_format': 'gtiff', 'blocksize': 512, 'level': 6, 'profiles': {}}
+
+
+@dataclass(frozen=True)
+class StorageProfile:
+    """GeoTIFF layout of a product. `predictor` is 1 (none), 2 (horizontal), 3 (floating point) or 'auto' (3 for
+    float data, 2 otherwise); LERC codecs are lossless (MAX_Z_ERROR=0) and take no predictor. `level` is the
+    DEFLATE or ZSTD level (the GDAL default if None), and `interleave` 'PIXEL' or 'BAND' (as written by each stage
+    if None)."""
+    compress: str = 'LZW'
+    predictor: object = 'auto'
+    blocksize: int = 256
+    interleave: str = None
+    level: int = None
+
+    def __post_init__(self):
+        if self.compress.upper() not in CODECS:
+            raise ValueError(f'compress {self.compress} not valid. Options are {CODECS}.')
+        if self.predictor not in [1, 2, 3, 'auto']:
+            raise ValueError(f'predictor {self.predictor} not valid. Options are 1, 2, 3 and "auto".')
+        if self.interleave is not None and self.interleave.upper() not in ['PIXEL', 'BAND']:
+            raise ValueError(f'interleave {self.interleave} not valid. Options are PIXEL and BAND.')
+
+    def creation_options(self, dtype: str) -> dict:
+        """Rasterio creation options (lowercase keys) for data of `dtype` (e.g., 'uint16' or 'Float32')."""
+        compress = self.compress.upper()
+        options = dict(compress=compress, tiled=True, blockxsize=self.blocksize, blockysize=self.blocksize)
+        if compress.startswith('LERC'):
+            options['max_z_error'] = 0
+        else:
+            predictor = self.predictor
+            if predictor == 'auto':
+                predictor = 3 if 'float' in str(dtype).lower() else 2
+            options['predictor'] = predictor
+        if self.level is not None and compress in _LEVEL_OPTIONS:
+            options[_LEVEL_OPTIONS[compress]] = self.level
+        if self.interleave is not None:
+            options['interleave'] = self.interleave.upper()
+        return options
+
+    def gdal_options(self, dtype: str) -> list:
+        """`creation_options` as GDAL creation options (e.g., for gdal.Translate)."""
+        return [f'{key.upper()}={"YES" if value is True else value}'
+                for key, value in self.creation_options(dtype).items()]
+
+
+DEFAULT_PROFILE = StorageProfile()
+
+
+def configure(output_format: str = 'gtiff', blocksize: int = 512, level: int = 6, profiles: dict = None):
+    """Sets the output format, the block size (in pixels) and DEFLATE level of the COGs, and the storage profiles
+    ({product type: dict of `StorageProfile` fields}, see `load_profiles`) of the product types that do not use the
+    default one."""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'output_format {output_format} not valid. Options are {OUTPUT_FORMATS}.')
+    profiles = dict(profiles) if profiles is not None else {}
+    for name, fields in profiles.items():
+        if name not in PRODUCT_TYPES:
+            raise ValueError(f'Product type {name} not valid. Options are {PRODUCT_TYPES}.')
+        StorageProfile(**fields)  # fails early on invalid profiles
+    _settings.update(output_format=output_format, blocksize=blocksize, level=level, profiles=profiles)
+
+
+def settings() -> dict:
+    return dict(_settings)
+
+
+def init_worker(settings: dict):
+    """Initializer of worker processes: uses the same output format as the main process."""
+    configure(**settings)
+
+
+def load_profiles(path: Union[str, Path]) -> dict:
+    """Reads the storage profiles of a JSON file ({product type: {field: value}}), e.g., as saved by
+    `floodsnet.autotune`."""
+    return json.loads(Path(path).read_text())
+
+
+def save_profiles(profiles: dict, path: Union[str, Path]):
+    """Saves `profiles` ({product type: `StorageProfile`}) to a JSON file that `load_profiles` reads."""
+    Path(path).write_text(json.dumps({name: asdict(profile) for name, profile in profiles.items()}, indent=2))
+
+
+def product_type(path: Union[str, Path]) -> str:
+    """Product type (one of `PRODUCT_TYPES`) of the product at `path`, from the tag at the end of its name (e.g.,
+    'S2' for usgs_EVENT_20200101_T33TWL_S2.tif, 'NDWI' for spectral indices), or None if it is not a product."""
+    tag = Path(path).stem.split('_')[-1]
+    if tag in INDEX_TAGS or tag.startswith('FEAT-'):  # FEAT-{index}: indices saved one per file
+        return 'NDWI'
+    return tag if tag in PRODUCT_TYPES else None
+
+
+def storage_profile(path: Union[str, Path]) -> StorageProfile:
+    """The `StorageProfile` of the product at `path`: the one configured for its type, or `DEFAULT_PROFILE`."""
+    fields = _settings['profiles'].get(product_type(path))
+    return StorageProfile(**fields) if fields is not None else DEFAULT_PROFILE
+
+
+def creation_options(path: Union[str, Path], dtype: str) -> dict:
+    """Rasterio creation options to write the product at `path` with data of `dtype` (see `storage_profile`)."""
+    return storage_profile(path).creation_options(dtype)
+
+
+def update_profile(profile: dict, path: Union[str, Path]) -> dict:
+    """Updates the rasterio `profile` (with the dtype to write) of the product at `path` with its creation options
+    (see `creation_options`). Options of another layout, e.g., copied from the input profile, are dropped first."""
+    for key in ['compress', 'predictor', 'zlevel', 'zstd_level', 'max_z_error', 'tiled', 'blockxsize', 'blockysize']:
+        profile.pop(key, None)
+    profile.update(creation_options(path, profile['dtype']))
+    return profile
+
+
+def overview_resampling(path: Union[str, Path]) -> str:
+    """Nearest for categorical products (CLASS, GT, JRC and mosaic sources, see `CATEGORICAL_TAGS`), average for the
+    rest (S1, S2 and spectral indices)."""
+    tag = Path(path).stem.split('_')[-1]
+    return 'NEAREST' if tag in CATEGORICAL_TAGS else 'AVERAGE'
+
+
+def cog_options(path: Union[str, Path]) -> dict:
+    """Creation options of the COG of `path`: DEFLATE, or the codec and predictor of the storage profile configured
+    for its type, if any."""
+    options = dict(blocksize=_settings['blocksize'], compress='DEFLATE', level=_settings['level'], predictor='YES',
+                   overviews='AUTO', overview_resampling=overview_resampling(path), num_threads='ALL_CPUS')
+    if product_type(path) in _settings['profiles']:
+        profile = storage_profile(path)
+        options.update(compress=profile.compress.upper(), predictor='YES' if profile.predictor != 1 else 'NO')
+        options.pop('level')
+        if profile.compress.upper().startswith('LERC'):
+            options.update(max_z_error=0)
+            options.pop('predictor')
+        elif profile.level is not None:
+            options['level'] = profile.level
+    return options
+
+
+def is_cog(path: Union[str, Path]) -> bool:
+    with rio.open(path) as src:
+        return src.tags(ns='IMAGE_STRUCTURE').get('LAYOUT') == 'COG'
+
+
+def finalize(path: Union[str, Path]):
+    """Converts the GeoTIFF at `path` to a COG in place if the output format is 'cog'. The conversion streams the
+    image, block by block, to a temporary file that then replaces `path`. Does nothing for GeoTIFF outputs, or if
+    `path` is already a COG."""
+    if _settings['output_format'] != 'cog' or is_cog(path):
+        return path
+    path = str(path)
+    tmp_path = f'{path[:-4]}.cog.tmp.tif'
+    try:
+        rio.shutil.copy(path, tmp_path, driver='COG', **cog_options(path))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
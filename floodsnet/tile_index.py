@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial index of the HLS/S2 land tiles (`--s2_tile_path`), to find the tiles that intersect a flood without clipping
+the whole global tile layer.
+
+The tile layer is parsed once and cached next to it as GeoParquet (rebuilt when the source changes), and its
+geometries are indexed in an STRtree: a query checks the bounding boxes in the tree first, and then the exact
+intersection with the few candidates only.
+
+>>> index = load_tile_index(config.s2_tile_path)
+>>> flood_hls = index.clip(gdf_union)  # same as gpd.clip(hls_tiles, gdf_union)
+"""
+import functools
+import os
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+
+class TileIndex:
+    """STRtree over the geometries of `tiles` (a GeoDataFrame)."""
+
+    def __init__(self, tiles):
+        from shapely import STRtree
+        self.tiles = tiles
+        self.tree = STRtree(tiles.geometry.values)
+
+    def query(self, geom) -> np.ndarray:
+        """Positions (in `tiles`) of the tiles that intersect `geom`, in order."""
+        return np.sort(self.tree.query(geom, predicate='intersects'))
+
+    def _clipped(self, positions: np.ndarray, geom):
+        clipped = self.tiles.iloc[positions].copy()
+        clipped['geometry'] = clipped.geometry.intersection(geom)
+        return clipped[~clipped.geometry.is_empty]
+
+    def clip(self, geom):
+        """The tiles that intersect `geom`, clipped to it (as `gpd.clip(tiles, geom)`)."""
+        return self._clipped(self.query(geom), geom)
+
+    def clip_many(self, geoms: dict) -> dict:
+        """`clip` for each geometry in `geoms` ({key: geometry}, e.g., the flood layers of a geodatabase), with all the
+        tree queries done at once. Returns {key: clipped tiles}."""
+        keys = list(geoms)
+        geom_idx, tile_idx = self.tree.query([geoms[key] for key in keys], predicate='intersects')
+        return {key: self._clipped(np.sort(tile_idx[geom_idx == i]), geoms[key]) for i, key in enumerate(keys)}
+
+
+def _cache_path(tile_path: Union[str, Path]) -> Path:
+    return Path(tile_path).with_suffix('.index.parquet')
+
+
+@functools.lru_cache(maxsize=4)
+def _load_tile_index(tile_path: str, mtime_ns: int, size: int) -> TileIndex:
+    import geopandas as gpd
+    cache = _cache_path(tile_path)
+    if cache.exists() and cache.stat().st_mtime_ns >= mtime_ns:
+        tiles = gpd.read_parquet(cache)
+    else:
+        print(f'Building the tile index of {tile_path}')
+        tiles = gpd.read_file(tile_path)
+        try:
+            tiles.to_parquet(cache, index=True)
+        except OSError as err:  # e.g., a read-only folder: the index is still used for this run
+            print(f'Cannot save the tile index to {cache}: {err}')
+    return TileIndex(tiles)
+
+
+def load_tile_index(tile_path: Union[str, Path]) -> TileIndex:
+    """`TileIndex` of the tile layer at `tile_path`, from its GeoParquet cache if it is newer than the layer."""
+    st = os.stat(tile_path)
+    return _load_tile_index(str(tile_path), st.st_mtime_ns, st.st_size)
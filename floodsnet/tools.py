@@ -1,38 +1,121 @@
-import re
+import functools
+import os
+import struct
 import time
 import warnings
+from collections import OrderedDict
+from dataclasses import dataclass, replace
 from hashlib import sha256
 from pathlib import Path
 
-import pandas as pd
 from osgeo import gdal
 from osgeo import gdalconst
 
 from .geetasks import check_gee_split
-
-
-def gdal_is_valid(fp, print_err=False):
-    """Checks if `fp` is  valid file as tested from gdal's checksum function. Not an infalible check, but it is
-    quick and should capture most cases.
+from .storage import storage_profile
+from .tracing import span, traced
+
+
+# files found valid by `gdal_is_valid` in this process, by (path, size, mtime): {key: True if checked with deep=True},
+# least recently used first
+_VALID_FILES = OrderedDict()
+_VALID_FILES_MAXSIZE = 4096
+
+
+def _remember_valid(key: tuple, deep: bool):
+    _VALID_FILES[key] = deep or _VALID_FILES.get(key, False)
+    _VALID_FILES.move_to_end(key)
+    while len(_VALID_FILES) > _VALID_FILES_MAXSIZE:
+        _VALID_FILES.popitem(last=False)
+
+
+def _tiff_header_ok(fp: str, size: int) -> bool:
+    """Checks the TIFF header of `fp`: byte order, version (TIFF or BigTIFF), and an offset of the first IFD that lies
+    within the file. Files that are not TIFFs pass, GDAL checks them when it opens them."""
+    with open(fp, 'rb') as f:
+        header = f.read(16)
+    if header[:2] not in (b'II', b'MM'):
+        return True
+    order = '<' if header[:2] == b'II' else '>'
+    if len(header) < 8:
+        return False
+    version = struct.unpack(f'{order}H', header[2:4])[0]
+    if version == 42:
+        ifd_offset = struct.unpack(f'{order}I', header[4:8])[0]
+    elif version == 43 and len(header) == 16:  # BigTIFF
+        ifd_offset = struct.unpack(f'{order}Q', header[8:16])[0]
+    else:
+        return False
+    return 8 <= ifd_offset < size
+
+
+def _last_blocks_ok(ds) -> bool:
+    """Reads the last block (strip or tile) of each band, which is the last data a download writes."""
+    for i in range(ds.RasterCount):
+        band = ds.GetRasterBand(i + 1)
+        xsize, ysize = band.GetBlockSize()
+        xoff = (ds.RasterXSize - 1) // xsize * xsize
+        yoff = (ds.RasterYSize - 1) // ysize * ysize
+        if band.ReadRaster(xoff, yoff, ds.RasterXSize - xoff, ds.RasterYSize - yoff) is None:
+            return False
+    return True
+
+
+def gdal_is_valid(fp, print_err=False, deep=False, settle=0, store=None):
+    """Checks if `fp` is a valid (and completely downloaded) raster. Not an infalible check, but it is quick and should
+    capture most cases:
+        1. if `settle` > 0, the size and modification time of the file do not change for `settle` seconds (callers
+           that already wait for files to be stable, like `floodsnet.watcher.wait_for_downloads`, leave it at 0),
+        2. the TIFF header points to an IFD within the file, and GDAL can open it,
+        3. the last block of each band can be read and decoded.
+    With `deep`, the checksum of every band is also computed, which decodes the whole file (slow for large files).
+    Valid files are remembered by path, size and modification time, so they are not checked again until they change:
+    in this process (the last few thousand), and across runs in `store` (a `floodsnet.ledger.ValidityStore`), if given.
     Adapted from https://lists.osgeo.org/pipermail/gdal-dev/2013-November/037520.html
     """
     fp = str(fp)
     try:
+        st = os.stat(fp)
+        key = (fp, st.st_size, st.st_mtime_ns)
+        if key in _VALID_FILES and (_VALID_FILES[key] or not deep):
+            _VALID_FILES.move_to_end(key)
+            return True
+        if store is not None:
+            stored = store.get(*key)
+            if stored is not None and (stored or not deep):
+                _remember_valid(key, stored)
+                return True
+        if settle > 0:
+            time.sleep(settle)
+            st = os.stat(fp)
+            if (fp, st.st_size, st.st_mtime_ns) != key:
+                raise RuntimeError(f'{fp} is still being written')
+        if not _tiff_header_ok(fp, st.st_size):
+            raise RuntimeError(f'Invalid TIFF header in {fp}')
         ds = gdal.Open(fp)
-        for i in range(ds.RasterCount):
-            ds.GetRasterBand(i + 1).Checksum()
-    except RuntimeError:
+        if ds is None:  # gdal exceptions are not enabled
+            raise RuntimeError(f'Cannot open {fp}')
+        if not _last_blocks_ok(ds):
+            raise RuntimeError(f'Cannot read the last block of {fp}')
+        if deep:
+            for i in range(ds.RasterCount):
+                ds.GetRasterBand(i + 1).Checksum()
+        ds = None
+    except (RuntimeError, OSError) as err:
         valid = False
         if print_err:
-            print('GDAL error: ', gdal.GetLastErrorMsg())
+            print('GDAL error: ', gdal.GetLastErrorMsg() or err)
     else:
         valid = True
+        _remember_valid(key, deep)
+        if store is not None:
+            store.add(*key, deep=_VALID_FILES[key])
     return valid
 
 
-def gdal_wait(fp, wait=10, maxwait=600):
-    """Waits until file `fp` becomes valid as tested from gdal's checksum function. Not an infalible check, but it is
-    quick and should capture most cases. Waits for `wait` seconds between checks, up to a maximum of `maxwait` seconds.
+def gdal_wait(fp, wait=10, maxwait=600, deep=False):
+    """Waits until file `fp` becomes valid as tested by `gdal_is_valid` (with a full checksum if `deep`). Waits for
+    `wait` seconds between checks, up to a maximum of `maxwait` seconds.
     Assumes `fp` already exists on disk, otherwise stops execution.
     """
     gdal.UseExceptions()
@@ -55,10 +138,10 @@ def gdal_wait(fp, wait=10, maxwait=600):
         fp = [fp]
 
     for fpath in fp:
-        if not gdal_is_valid(fpath):
+        if not gdal_is_valid(fpath, deep=deep):
             print(f'This file exists but it is not valid: {fpath} \n'
                   f'Will wait a bit (up to {maxwait} s) until it becomes valid.')
-            while not gdal_is_valid(fpath):
+            while not gdal_is_valid(fpath, deep=deep):
                 if slept >= maxwait:
                     warnings.warn(f'Waited too long ({maxwait} s) for this file to become valid: {fpath} \nMoving on.',
                                   RuntimeWarning)
@@ -109,33 +192,78 @@ def rename_from_dict(fdir, rename_dict, tiles=None):
         batch_rename_prefix(fdir, old, new, tiles)
 
 
-def get_info_key(fp, key, findn=1):
-    finfo = gdal.Info(fp)
-    ftype = re.findall(rf'({key}\s?=\s?\w+)', finfo)
-    ftype = [f.split('=')[1].strip() for f in ftype]
-    if findn != 'all':
-        ftype = ftype[:findn]
-    return ftype
+@dataclass(frozen=True)
+class RasterMeta:
+    """Metadata of a raster, per band where it applies. `dtypes` are GDAL data type names (e.g., 'UInt16'), and
+    `transform` is the GDAL geotransform."""
+    width: int
+    height: int
+    dtypes: tuple
+    interleave: str
+    descriptions: tuple
+    nodata: tuple
+    crs: str
+    transform: tuple
+    block_size: tuple
+
+
+def _read_raster_meta(fp: str) -> RasterMeta:
+    ds = gdal.Open(fp)
+    if ds is None:  # gdal exceptions are not enabled
+        raise RuntimeError(f'Cannot open {fp}')
+    bands = [ds.GetRasterBand(i + 1) for i in range(ds.RasterCount)]
+    meta = RasterMeta(
+        width=ds.RasterXSize,
+        height=ds.RasterYSize,
+        dtypes=tuple(gdal.GetDataTypeName(b.DataType) for b in bands),
+        interleave=ds.GetMetadataItem('INTERLEAVE', 'IMAGE_STRUCTURE'),
+        descriptions=tuple(b.GetDescription() for b in bands),
+        nodata=tuple(b.GetNoDataValue() for b in bands),
+        crs=ds.GetProjection(),
+        transform=tuple(ds.GetGeoTransform()),
+        block_size=tuple(bands[0].GetBlockSize()) if bands else (),
+    )
+    bands = ds = None
+    return meta
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_raster_meta(fp: str, mtime_ns: int, size: int) -> RasterMeta:
+    return _read_raster_meta(fp)
+
+
+def raster_meta(fp) -> RasterMeta:
+    """Reads the metadata of the raster at `fp` with a single open. Local files are cached until they change (by
+    modification time and size); GDAL virtual files (/vsimem/ etc.) are read every time."""
+    fp = str(fp)
+    if fp.startswith('/vsi'):
+        return _read_raster_meta(fp)
+    st = os.stat(fp)
+    return _cached_raster_meta(fp, st.st_mtime_ns, st.st_size)
 
 
 def get_tiff_type(fp):
-    """Uses gdalinfo to retrieve the data type within the dataset located in the `fp` path."""
-    ftypes = pd.unique(get_info_key(fp, 'Type', 'all'))
+    """Retrieves the data type within the dataset located in the `fp` path."""
+    ftypes = list(dict.fromkeys(raster_meta(fp).dtypes))  # unique, in order
     if len(ftypes) > 1:
         warnings.warn(f'The file {fp} has more than one data type: {ftypes}. Using only the first one ({ftypes[0]}).')
     return ftypes[0]
 
 
 def get_tiff_interleave(fp):
-    return get_info_key(fp, 'INTERLEAVE')[0]
+    interleave = raster_meta(fp).interleave
+    return interleave if interleave is not None else 'BAND'  # single-band files do not report it
 
 
 def get_tiff_descriptions(fp):
-    return get_info_key(fp, 'Description', 'all')
+    return list(raster_meta(fp).descriptions)
 
 
-def compress_tiff(fp, outfp=None, ftype=None, compress_method='LZW', interleave='BAND'):
-    """Compresses a tiff file. Defaults to LZW. ZSTD requires GDAL >= 2.3.
+@traced('compress', 'gdal')
+def compress_tiff(fp, outfp=None, ftype=None, compress_method=None, interleave='BAND'):
+    """Compresses a tiff file with the storage profile of the product at `outfp` (see
+    `floodsnet.storage.storage_profile`), LZW by default. `compress_method` overrides the codec of the profile (ZSTD
+    requires GDAL >= 2.3), and `interleave` is used if the profile does not set one.
         Uses gdal_translate: https://gdal.org/programs/gdal_translate.html
         GeoTiff creation options: https://gdal.org/drivers/raster/gtiff.html#creation-options
         """
@@ -144,22 +272,15 @@ def compress_tiff(fp, outfp=None, ftype=None, compress_method='LZW', interleave=
 
     ftype = ftype if ftype is not None else get_tiff_type(fp)
 
-    if 'float' in ftype.lower():
-        predictor = 3
-    else:
-        predictor = 2
+    profile = storage_profile(outfp)
+    if compress_method is not None:
+        profile = replace(profile, compress=compress_method)
+    if profile.interleave is None:
+        profile = replace(profile, interleave=interleave)
 
     translate_options = gdal.TranslateOptions(format='GTiff', strict=True,
-                                              creationOptions=[
-                                                  'TFW=NO',
-                                                  # 'COMPRESS=ZSTD',
-                                                  f'COMPRESS={compress_method}',
-                                                  f'INTERLEAVE={interleave}',
-                                                  'NUM_THREADS=ALL_CPUS',
-                                                  f'PREDICTOR={predictor}',
-                                                  'ZSTD_LEVEL=15',
-                                                  'TILED=YES',
-                                              ])
+                                              creationOptions=['TFW=NO', 'NUM_THREADS=ALL_CPUS']
+                                              + profile.gdal_options(ftype))
 
     ds = gdal.Translate(outfp, fp, options=translate_options)
     ds = None
@@ -168,7 +289,8 @@ def compress_tiff(fp, outfp=None, ftype=None, compress_method='LZW', interleave=
 
 def gdal_warp_compressed(out_path, in_path, interleave=None, **kwargs):
     vrt = f'/vsimem/{Path(out_path).stem}.vrt'
-    g = gdal.Warp(vrt, in_path, **kwargs)
+    with span('warp', 'gdal'):  # only sets up the warp; the pixels are warped while compressing
+        g = gdal.Warp(vrt, in_path, **kwargs)
     interleave = interleave if interleave is not None else get_tiff_interleave(in_path)
     compress_tiff(vrt, out_path,
                   ftype=get_tiff_type(in_path),
@@ -179,6 +301,18 @@ def gdal_warp_compressed(out_path, in_path, interleave=None, **kwargs):
     return out_path
 
 
+def gdal_warp_vrt(vrt_path, in_path, **kwargs):
+    """Warps `in_path` to a VRT at `vrt_path` (e.g., in /vsimem) without computing any pixel: they are warped when the
+    VRT is read. `kwargs` are gdal.Warp options."""
+    in_path = str(in_path)
+    if not in_path.startswith('/vsi'):  # the VRT refers to its source by path, so it cannot be relative to the cwd
+        in_path = str(Path(in_path).absolute())
+    with span('warp', 'gdal'):
+        ds = gdal.Warp(str(vrt_path), in_path, format='VRT', **kwargs)
+    ds = None  # writes the VRT
+    return str(vrt_path)
+
+
 def gdal_set_descriptions(fp, descriptions=None, band=None, copy_from=None):
     """Adapted from: https://github.com/scottstanie/apertools/blob/master/apertools/sario.py
     """
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Span-based tracing of the processing stages. Each span records its wall and CPU time, the bytes the process read and
+wrote while it was open (from /proc/self/io, on Linux), and the peak memory of the process when it closed.
+
+Tracing is off by default, in which case `span` costs a single check. Spans of worker processes are sent back to the
+main process (see `collect` and `add_spans`), which can export them all as a Chrome trace (chrome://tracing or
+https://ui.perfetto.dev) and print a per-stage summary table.
+
+>>> enable()
+>>> with span('reproject', event='EMSR123'):
+...     ...
+>>> write_report('trace.json')
+"""
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Union
+
+_enabled = False
+_spans = []
+_lock = threading.Lock()
+
+
+def enable(flag: bool = True):
+    global _enabled
+    _enabled = flag
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def init_worker(flag: bool):
+    """Initializer of worker processes: enables tracing as in the main process and drops the spans inherited from
+    it (if the worker was forked)."""
+    enable(flag)
+    collect()
+
+
+def _io_bytes() -> tuple:
+    """Bytes read and written by the process so far, including reads served from the page cache."""
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _max_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10  # bytes on macOS, KiB on Linux
+
+
+@contextmanager
+def span(name: str, cat: str = 'stage', **attrs):
+    """Records the time, I/O and memory of the code in the `with` block as a span called `name`. `attrs` (e.g., the
+    event name) are kept with the span. CPU time and I/O are of the whole process, so they include those of other
+    threads running at the same time (e.g., GDAL's)."""
+    if not _enabled:
+        yield
+        return
+    start = time.time()
+    t0, c0 = time.perf_counter(), time.process_time()
+    r0, w0 = _io_bytes()
+    try:
+        yield
+    finally:
+        r1, w1 = _io_bytes()
+        record = {
+            'name': name,
+            'cat': cat,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'start': start,
+            'wall_s': time.perf_counter() - t0,
+            'cpu_s': time.process_time() - c0,
+            'read_bytes': r1 - r0,
+            'write_bytes': w1 - w0,
+            'max_rss_mb': _max_rss_mb(),
+            'args': {key: str(val) for key, val in attrs.items()},
+        }
+        with _lock:
+            _spans.append(record)
+
+
+def traced(name: str, cat: str = 'stage'):
+    """Decorator that records each call of the function as a span called `name`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with span(name, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def collect() -> list:
+    """Returns and forgets the spans recorded so far, e.g., to send those of a worker to the main process."""
+    with _lock:
+        spans = list(_spans)
+        _spans.clear()
+    return spans
+
+
+def add_spans(spans: list):
+    """Adds spans recorded elsewhere (e.g., returned by a worker process)."""
+    with _lock:
+        _spans.extend(spans)
+
+
+def spans() -> list:
+    with _lock:
+        return list(_spans)
+
+
+def export_chrome_trace(path: Union[str, Path], records: list = None):
+    """Writes the spans as a Chrome trace (JSON, "X" complete events)."""
+    records = records if records is not None else spans()
+    events = []
+    for rec in records:
+        args = dict(rec['args'], cpu_s=round(rec['cpu_s'], 6), read_bytes=rec['read_bytes'],
+                    write_bytes=rec['write_bytes'], max_rss_mb=round(rec['max_rss_mb'], 1))
+        events.append({'name': rec['name'], 'cat': rec['cat'], 'ph': 'X', 'pid': rec['pid'], 'tid': rec['tid'],
+                       'ts': rec['start'] * 1e6, 'dur': rec['wall_s'] * 1e6, 'args': args})
+    Path(path).write_text(json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}))
+
+
+def summary(records: list = None) -> list:
+    """Aggregates the spans by name: number of spans, total and max wall time, total CPU time, total bytes read and
+    written, and peak memory. Sorted by total wall time."""
+    records = records if records is not None else spans()
+    rows = {}
+    for rec in records:
+        row = rows.setdefault(rec['name'], {'name': rec['name'], 'count': 0, 'wall_s': 0.0, 'max_wall_s': 0.0,
+                                            'cpu_s': 0.0, 'read_mb': 0.0, 'write_mb': 0.0, 'max_rss_mb': 0.0})
+        row['count'] += 1
+        row['wall_s'] += rec['wall_s']
+        row['max_wall_s'] = max(row['max_wall_s'], rec['wall_s'])
+        row['cpu_s'] += rec['cpu_s']
+        row['read_mb'] += rec['read_bytes'] / 2 ** 20
+        row['write_mb'] += rec['write_bytes'] / 2 ** 20
+        row['max_rss_mb'] = max(row['max_rss_mb'], rec['max_rss_mb'])
+    return sorted(rows.values(), key=lambda row: row['wall_s'], reverse=True)
+
+
+def summary_table(records: list = None) -> str:
+    """`summary` as a text table. Nested spans (e.g., compress within reproject) are counted in both."""
+    lines = [f"{'stage':<20} {'count':>6} {'wall s':>10} {'max s':>9} {'cpu s':>10} {'read MB':>10} {'write MB':>10} "
+             f"{'peak MB':>9}"]
+    for row in summary(records):
+        lines.append(f"{row['name']:<20} {row['count']:>6} {row['wall_s']:>10.1f} {row['max_wall_s']:>9.1f} "
+                     f"{row['cpu_s']:>10.1f} {row['read_mb']:>10.1f} {row['write_mb']:>10.1f} "
+                     f"{row['max_rss_mb']:>9.1f}")
+    return '\n'.join(lines)
+
+
+def write_report(path: Union[str, Path]):
+    """Writes the Chrome trace to `path`, the summary as JSON next to it, and prints the summary table."""
+    records = spans()
+    if len(records) == 0:
+        return
+    path = Path(path)
+    export_chrome_trace(path, records)
+    path.with_suffix('.summary.json').write_text(json.dumps(summary(records), indent=2))
+    print(f'Trace saved to {path}')
+    print(summary_table(records))
@@ -1,19 +1,17 @@
 import os
 import re
 from pathlib import Path
-from tempfile import TemporaryDirectory
 
-import fiona
-import geopandas as gpd
 import numpy as np
-from osgeo import gdal
-from osgeo import ogr
 from rasterio.crs import CRS
-from shapely import Polygon
 from typing_extensions import deprecated
 
+# geopandas, fiona and shapely are imported in the functions that use them, as they are slow to import and not needed
+# to process the rasters
+
 
 def get_flood_layers_from_unosat_gdbs(unosat_lst):
+    import fiona
     flood_lst = []
     for gdb in unosat_lst:
         layers = fiona.listlayers(gdb)
@@ -42,6 +40,7 @@ def save_flood_shapefiles(flood_hls, flood_layer):
 
 @deprecated('Seems to be unused.')
 def process_flood_layers(flood_lst, dt_set, hls_tiles):
+    import geopandas as gpd
     for gdb, flood_layer in flood_lst:
         gdf = gpd.read_file(gdb, layer=flood_layer)
         gdf_union = gdf.unary_union
@@ -71,6 +70,8 @@ def get_utm_epsg_from_bounds(bounds, crs):
     """
     Get the EPSG code for the UTM Zone based on an input bounding box.
     """
+    import geopandas as gpd
+    from shapely import Polygon
     bbox = Polygon([
         [bounds[0], bounds[1]],
         [bounds[2], bounds[1]],
@@ -82,7 +83,7 @@ def get_utm_epsg_from_bounds(bounds, crs):
     return epgs
 
 
-def rasterize_shp(flood_shp: gpd.GeoDataFrame, out_dir: str, gt_name: str, s2_path: str, date_info: str):
+def rasterize_shp(flood_shp: 'gpd.GeoDataFrame', out_dir: str, gt_name: str, s2_path: str, date_info: str):
     tile = flood_shp.identifier.values[0]
     # START rasterize
     out_gt_path = f'{out_dir}/{gt_name}_{date_info}_{tile}_GT.tif'
@@ -94,41 +95,81 @@ def rasterize_shp(flood_shp: gpd.GeoDataFrame, out_dir: str, gt_name: str, s2_pa
     return out_gt_path
 
 
+def rasterize_flood_tiles(flood_tiles: 'gpd.GeoDataFrame', out_dir: str, gt_name: str, s_paths: list,
+                          date_info: str) -> list:
+    """Rasterizes the flood of each tile (row) of `flood_tiles` onto the grid of its S2 (or S1) image in `s_paths`, in
+    one call: the geometries are reprojected together (one `to_crs` per UTM zone) and burnt from memory.
+    Returns the GT path of each tile."""
+    out_gt_paths = [f'{out_dir}/{gt_name}_{date_info}_{tile}_GT.tif' for tile in flood_tiles.identifier.values]
+    todo = [i for i, fp in enumerate(out_gt_paths) if not os.path.exists(fp)]
+    for i in set(range(len(out_gt_paths))) - set(todo):
+        print(f'{out_gt_paths[i]} exists.')
+    if len(todo) == 0:
+        return out_gt_paths
+
+    import rasterio as rio
+    templates = []
+    for i in todo:
+        with rio.open(s_paths[i]) as src:
+            templates.append(dict(crs=src.crs, transform=src.transform, width=src.width, height=src.height))
+    # reproject the geometries of the tiles that share a UTM zone at once
+    flood_geoms = _with_crs(flood_tiles.geometry)
+    geoms = {}
+    for crs in {t['crs'].to_wkt() for t in templates}:
+        rows = [i for i, t in zip(todo, templates) if t['crs'].to_wkt() == crs]
+        geoms.update(zip(rows, flood_geoms.iloc[rows].to_crs(crs).values))
+    for i, template in zip(todo, templates):
+        _burn_geometries([geoms[i]], template, out_gt_paths[i])
+    return out_gt_paths
+
+
+def _with_crs(geoms: 'gpd.GeoSeries') -> 'gpd.GeoSeries':
+    # the HLS tiles are in lon/lat
+    return geoms if geoms.crs is not None else geoms.set_crs('epsg:4326')
+
+
 def _rasterize_shp_layer(flood_shp, s2_path, out_gt_path):
-    s2_utm_crs = get_utm_epsg_from_bounds(flood_shp.bounds.values[0], flood_shp.crs)
-    flood_reproj = gpd.GeoDataFrame(index=[0], crs='epsg:4326', geometry=[flood_shp.geometry.values[0]]).to_crs(s2_utm_crs)
-    # open the downloaded s2 image to use as a template
-    dataSrc = gdal.Open(s2_path)
-    temp_shp = '../temp.shp'
-    flood_reproj.to_file(temp_shp)
-    shp = ogr.Open(temp_shp)
-    # with TemporaryDirectory() as tempdir:
-    #     temp_shp = str(Path(tempdir) / 'temp.shp')
-    #     flood_reproj.to_file(temp_shp)
-    #     shp = ogr.Open(temp_shp)
-    lyr = shp.GetLayer()
-    driver = gdal.GetDriverByName('GTiff')
-
-    dst_ds = driver.Create(
-        out_gt_path,
-        dataSrc.RasterXSize,
-        dataSrc.RasterYSize,
-        1,
-        gdal.GDT_Byte,
-        options=[
-            'TFW=NO',
-            # 'COMPRESS=ZSTD',
-            f'COMPRESS=LZW',
-            'NUM_THREADS=ALL_CPUS',
-            f'PREDICTOR=2',
-            # 'ZSTD_LEVEL=15',
-            'TILED=YES',
-        ])
-    dst_ds.SetGeoTransform(dataSrc.GetGeoTransform())
-    dst_ds.SetProjection(dataSrc.GetProjection())
-    gdal.RasterizeLayer(dst_ds, [1], lyr, burn_values=[1])
-
-    dst_ds, shp, lyr = None, None, None
+    """Rasterizes the (single) geometry of `flood_shp` onto the grid of `s2_path`."""
+    import rasterio as rio
+    with rio.open(s2_path) as src:
+        template = dict(crs=src.crs, transform=src.transform, width=src.width, height=src.height)
+    geom = _with_crs(flood_shp.geometry.iloc[[0]]).to_crs(template['crs']).values[0]
+    _burn_geometries([geom], template, out_gt_path)
+
+
+def _burn_geometries(geoms: list, template: dict, out_gt_path: str, strip_rows: int = 1024):
+    """Burns `geoms` (in the CRS of `template`) as 1 on a 0 background onto the grid of `template` (a dict with the crs,
+    transform, width and height), in strips of `strip_rows` rows, each with the geometries clipped to it. The output
+    is written to a temporary file that replaces `out_gt_path` once done, so that concurrent runs never read or write
+    a partial file."""
+    import threading
+    import rasterio as rio
+    import shapely
+    from rasterio import features
+    from rasterio.windows import Window, bounds as window_bounds
+
+    from .storage import update_profile
+
+    profile = update_profile(dict(driver='GTiff', count=1, dtype='uint8', nodata=None, **template), out_gt_path)
+    tmp_path = f'{out_gt_path[:-4]}.{os.getpid()}_{threading.get_ident()}.tmp.tif'
+    geoms = [geom for geom in geoms if geom is not None and not geom.is_empty]
+    try:
+        with rio.open(tmp_path, 'w', **profile) as dst:
+            for row in range(0, dst.height, strip_rows):
+                window = Window(0, row, dst.width, min(strip_rows, dst.height - row))
+                strip_bounds = window_bounds(window, dst.transform)
+                shapes = [(g, 1) for g in (shapely.clip_by_rect(geom, *strip_bounds) for geom in geoms)
+                          if not g.is_empty]
+                if len(shapes) > 0:
+                    arr = features.rasterize(shapes, out_shape=(window.height, window.width),
+                                             transform=dst.window_transform(window), fill=0, dtype='uint8')
+                else:
+                    arr = np.zeros((window.height, window.width), dtype='uint8')
+                dst.write(arr, 1, window=window)
+        os.replace(tmp_path, out_gt_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
     print(f'{out_gt_path} saved.')
 
 
@@ -138,14 +179,15 @@ def validate_date(dt, layer_name):
     StartDate is of the format YYYYMMDD and it is returned as the start date of the flood event. EndDay is of the format
     DD and it is assumed to be the end day of the flood event, with same YYYYMM as the start date.
     """
-    if dt is gpd.pd.NaT:
+    import pandas as pd
+    if dt is pd.NaT:
         if 'Cumulative' in layer_name:
             print(f'Layer {layer_name} does not have a valid sensor time. '
                   f'Deriving start and end dates from the layer name.')
             parts = layer_name.split('_')
-            start = gpd.pd.to_datetime(parts[0]).strftime("%Y-%m-%d")
+            start = pd.to_datetime(parts[0]).strftime("%Y-%m-%d")
             # todo: handle cases where the end day is in the month following the start date
-            end = gpd.pd.to_datetime(parts[0][:-2] + parts[1]).strftime("%Y-%m-%d")
+            end = pd.to_datetime(parts[0][:-2] + parts[1]).strftime("%Y-%m-%d")
             valid_date = [start, end]
         else:
             # todo: handle other layer types
@@ -1,8 +1,10 @@
-import ee 
 import xml.etree.ElementTree as ET
 
+from .earthengine import get_ee
+
 
 def get_usgs_img_date_bbox(xml_path):
+    ee = get_ee()
     tree = ET.parse(xml_path)
     root = tree.getroot()
     caldate = root.findall('./dataqual/lineage/srcinfo/srctime/timeinfo/sngdate/caldate')[0].text
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Watches the folders GEE exports are synced to, and reports each expected file once it is complete and stable.
+
+On Linux the folders are watched with inotify; elsewhere (e.g., Google Drive on macOS) they are polled.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+from .tracing import span
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_inotify():
+    """Returns libc if it has inotify (i.e., on Linux), otherwise None."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def is_gee_split_of(name: str, expected: Path) -> bool:
+    """Checks if file `name` is one of the segments GEE splits large exports of `expected` into, i.e., has the same name
+    with an additional suffix of the style -0000000000-0000000000 before the extension (see `check_gee_split`)."""
+    return name.startswith(expected.stem) and name.endswith(expected.suffix) and \
+        '-' in name[len(expected.stem):-len(expected.suffix)]
+
+
+class DownloadWatcher:
+    """Watches the folders of the expected downloads and reports each expected path once its file (or all the files
+    GEE split it into) exists and has had the same size and modification time for `settle` seconds.
+    Files are noticed through inotify (close-write, moved-to) where available, or by polling the folders every
+    `poll_interval` seconds otherwise (`use_inotify=False` forces polling).
+
+    >>> watcher = DownloadWatcher(expected_paths)
+    >>> for path, files in watcher.completed(timeout=3600):
+    ...     print(path, 'is ready as', files)
+    """
+
+    def __init__(self, expected=(), settle=2.0, poll_interval=5.0, use_inotify=True):
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.expected = {}
+        self._seen = {}  # file path -> (size, mtime, time it was first seen with that size and mtime)
+        self._libc = _load_inotify() if use_inotify else None
+        self._fd = None
+        self._watches = {}
+        self._last_scan = time.monotonic()
+        if self._libc is not None:
+            fd = self._libc.inotify_init1(IN_NONBLOCK)
+            if fd < 0:
+                self._libc = None
+            else:
+                self._fd = fd
+        for path in expected:
+            self.expect(path)
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._fd is not None
+
+    def expect(self, path):
+        """Adds `path` to the expected files and starts watching its folder."""
+        path = Path(path)
+        self.expected[str(path)] = path
+        folder = str(path.parent)
+        if self._fd is not None and folder not in self._watches:
+            wd = self._libc.inotify_add_watch(self._fd, folder.encode(),
+                                              IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY)
+            if wd >= 0:
+                self._watches[folder] = wd
+        self._scan_folder(path.parent)
+
+    def retry(self, path, files: list):
+        """Expects `path` again, e.g., after its `files` turned out not to be valid: it is reported again once the
+        files have been stable for `settle` seconds from now."""
+        for fpath in files:
+            self._seen.pop(str(fpath), None)
+        self.expect(path)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _matches(self, fname: str, folder: Path) -> bool:
+        for path in self.expected.values():
+            if path.parent == folder and (fname == path.name or is_gee_split_of(fname, path)):
+                return True
+        return False
+
+    def _observe(self, fpath: Path):
+        try:
+            st = fpath.stat()
+        except FileNotFoundError:
+            self._seen.pop(str(fpath), None)
+            return
+        key = str(fpath)
+        prev = self._seen.get(key)
+        if prev is None or prev[:2] != (st.st_size, st.st_mtime):
+            self._seen[key] = (st.st_size, st.st_mtime, time.monotonic())
+
+    def _scan_folder(self, folder: Path):
+        try:
+            entries = list(os.scandir(folder))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if self._matches(entry.name, folder):
+                self._observe(Path(entry.path))
+
+    def _read_events(self, timeout: float):
+        """Waits up to `timeout` seconds for inotify events and records the files they refer to."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return
+        folders = {wd: Path(folder) for folder, wd in self._watches.items()}
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buf):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            fname = buf[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+            offset += length
+            folder = folders.get(wd)
+            if folder is not None and fname and self._matches(fname, folder):
+                self._observe(folder / fname)
+
+    def _files_for(self, path: Path) -> list:
+        if str(path) in self._seen:
+            return [path]
+        return sorted(Path(fp) for fp in self._seen if is_gee_split_of(Path(fp).name, path)
+                      and Path(fp).parent == path.parent)
+
+    def _is_stable(self, files: list, now: float) -> bool:
+        for fpath in files:
+            self._observe(fpath)
+            seen = self._seen.get(str(fpath))
+            if seen is None or seen[0] == 0 or now - seen[2] < self.settle:
+                return False
+        return True
+
+    def poll(self, timeout: float = 0) -> list:
+        """Waits up to `timeout` seconds for changes and returns the (expected path, files) pairs that became complete.
+        Completed paths are no longer expected."""
+        if self._fd is not None:
+            self._read_events(timeout)
+        elif timeout > 0:
+            time.sleep(timeout)
+        # with inotify, folders are still rescanned every `poll_interval` s in case the folder is a network or FUSE
+        # mount (e.g., Google Drive) whose changes do not trigger inotify events
+        if self._fd is None or time.monotonic() - self._last_scan >= self.poll_interval:
+            for folder in {path.parent for path in self.expected.values()}:
+                self._scan_folder(folder)
+            self._last_scan = time.monotonic()
+
+        done = []
+        now = time.monotonic()
+        for key, path in list(self.expected.items()):
+            files = self._files_for(path)
+            if files and self._is_stable(files, now):
+                done.append((path, files))
+                del self.expected[key]
+        return done
+
+    def completed(self, timeout: float = None):
+        """Yields (expected path, files) pairs as the expected files become complete and stable, until none is left.
+        Raises FileNotFoundError if no expected file completes for `timeout` seconds."""
+        last_progress = time.monotonic()
+        # with inotify, files only need to be rechecked once they could have settled
+        wait = min(self.settle, self.poll_interval) if self._fd is not None else self.poll_interval
+        while self.expected:
+            if timeout is not None and time.monotonic() - last_progress > timeout:
+                raise FileNotFoundError(f'Waited too long ({timeout} s) for these files: {list(self.expected)} \n'
+                                        f'Cannot continue without them.')
+            for path, files in self.poll(wait):
+                last_progress = time.monotonic()
+                yield path, files
+
+
+def wait_for_downloads(paths: list, timeout: float = 720, settle: float = 2.0, validate=None,
+                       raise_on_invalid: bool = True) -> dict:
+    """Waits until all the files in `paths` (or the files GEE split them into) are complete and stable, and returns a
+    dict mapping each path to its list of files. Raises FileNotFoundError if none of the missing files completes for
+    `timeout` seconds. If `validate` is given (e.g., `gdal_is_valid`), each file is also checked with it once it is
+    stable; files that are not valid (e.g., a sync that paused halfway) are waited for again until they are. If they
+    are still not valid after `timeout` seconds, RuntimeError is raised, or, if not `raise_on_invalid`, their path is
+    left out of the returned dict so that the caller can skip what needs them.
+    """
+    ready = {}
+    invalid_since = {}
+    with span('sync', 'io', files=len(paths)), DownloadWatcher(paths, settle=settle) as watcher:
+        for path, files in watcher.completed(timeout=timeout):
+            if validate is not None:
+                invalid = []
+                for fpath in files:
+                    with span('validate', 'io', file=fpath):
+                        if not validate(fpath):
+                            invalid.append(fpath)
+                if invalid:
+                    if str(path) not in invalid_since:
+                        print(f'These files are stable but not valid yet: {[str(f) for f in invalid]} \n'
+                              f'Will wait a bit (up to {timeout} s) until they become valid.')
+                        invalid_since[str(path)] = time.monotonic()
+                    elif time.monotonic() - invalid_since[str(path)] > timeout:
+                        msg = (f'These files are complete but still not valid after {timeout} s: '
+                               f'{[str(f) for f in invalid]}')
+                        if raise_on_invalid:
+                            raise RuntimeError(f'{msg} \nCannot continue without them.')
+                        print(f'{msg} \nLeaving {path} out.')
+                        continue
+                    watcher.retry(path, files)
+                    continue
+            print(f'{path} is ready.')
+            ready[str(path)] = [str(f) for f in files]
+    return ready
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Export of the harmonized products to a single chunked, compressed Zarr store, so that training jobs open the dataset
+once and read chunk-aligned windows in parallel instead of opening and decoding each GeoTIFF.
+
+Layout (Zarr format 2, with consolidated metadata):
+    {store}/{dt_set}/{event}/{layer}    array of shape (bands, height, width), chunked (1, chunk, chunk)
+Each array keeps the CRS (WKT), affine transform, band names, nodata and source file of its GeoTIFF as attributes.
+Events whose products did not change since they were exported are skipped.
+
+>>> import zarr
+>>> root = zarr.open_consolidated('floodsnet.zarr')
+>>> root['usgs/EVENT/CLASS'][0, :512, :512]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Union
+
+import numcodecs
+import rasterio as rio
+import zarr
+from rasterio.windows import Window
+
+from .dag import input_fingerprint
+from .tracing import span
+
+# zarr-python 3 writes Zarr format 3 by default, which zarr-python 2 cannot read
+_FORMAT_KWARGS = {'zarr_format': 2} if int(zarr.__version__.split('.')[0]) >= 3 else {}
+DEFAULT_CHUNK = 512
+
+
+def open_store(store: Union[str, Path], mode: str = 'a'):
+    return zarr.open_group(str(store), mode=mode, **_FORMAT_KWARGS)
+
+
+def _write_layer(group, name: str, path: str, chunk: int):
+    with rio.open(path) as src:
+        nodata = src.nodata
+        arr = group.create_dataset(name, shape=(src.count, src.height, src.width), chunks=(1, chunk, chunk),
+                                   dtype=src.dtypes[0], fill_value=nodata if nodata is not None else 0,
+                                   compressor=numcodecs.Blosc(cname='zstd', clevel=5,
+                                                              shuffle=numcodecs.Blosc.BITSHUFFLE),
+                                   overwrite=True)
+        arr.attrs.update({
+            'crs': src.crs.to_wkt() if src.crs is not None else None,
+            'transform': list(src.transform)[:6],
+            'band_names': [d or f'Band {i + 1}' for i, d in enumerate(src.descriptions)],
+            'nodata': nodata,
+            'source': Path(path).name,
+        })
+        # chunk-aligned windows, so that each zarr chunk is written once
+        for row in range(0, src.height, chunk):
+            for col in range(0, src.width, chunk):
+                window = Window(col, row, min(chunk, src.width - col), min(chunk, src.height - row))
+                arr[:, row:row + window.height, col:col + window.width] = src.read(window=window)
+
+
+def export_event(root, dt_set: str, event: str, layers: dict, chunk: int = DEFAULT_CHUNK) -> bool:
+    """Writes the `layers` ({layer name: path}) of `event` to the group {dt_set}/{event} of `root`, replacing it.
+    Returns False, without writing, if the group already holds these files as they are now."""
+    sources = {name: input_fingerprint(fp) for name, fp in layers.items()}
+    path = f'{dt_set}/{event}'
+    if path in root and root[path].attrs.get('sources') == sources:
+        return False
+    with span('zarr_event', 'io', event=event):
+        group = root.require_group(path)
+        group.attrs['sources'] = {}  # incomplete until all the layers are written
+        for name in list(group.array_keys()):
+            if name not in layers:
+                del group[name]
+        for name, fp in layers.items():
+            _write_layer(group, name, fp, chunk)
+        group.attrs.update({'layers': list(layers), 'sources': sources})
+    return True
+
+
+def export_zarr(products: dict, store: Union[str, Path], dt_set: str, chunk: int = DEFAULT_CHUNK,
+                jobs: int = 1) -> str:
+    """Exports the products ({event: {layer name: path}}, see `floodsnet.products.event_products`) of `dt_set` to the
+    Zarr `store`, with up to `jobs` events written in parallel, and consolidates the metadata of the store.
+    Returns the path of the store."""
+    root = open_store(store)
+    root.require_group(dt_set)
+
+    def export(item):
+        event, layers = item
+        return export_event(root, dt_set, event, layers, chunk)
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        written = sum(executor.map(export, sorted(products.items())))
+    zarr.consolidate_metadata(str(store), **_FORMAT_KWARGS)
+    print(f'{written} {dt_set} event(s) exported to {store} ({len(products) - written} up to date).')
+    return str(store)
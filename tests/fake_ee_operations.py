@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Local fake of the Earth Engine operations endpoint, to exercise the GEE task polling without network access or
+credentials (see `test_geetasks.py`).
+"""
+import itertools
+
+
+class FakeTask:
+    """Mimics `ee.batch.Task`: has an `id`, and `start` and `status` methods."""
+
+    def __init__(self, endpoint, task_id: str, description: str):
+        self.endpoint = endpoint
+        self.id = task_id
+        self.description = description
+
+    def start(self):
+        self.endpoint.start(self.id)
+
+    def status(self) -> dict:
+        self.endpoint.n_status_calls += 1
+        if self.id not in self.endpoint.started:
+            return {'state': 'UNSUBMITTED', 'description': self.description}
+        operation = self.endpoint.operations[self.id]
+        return {
+            'id': self.id,
+            'state': {'PENDING': 'READY', 'RUNNING': 'RUNNING', 'SUCCEEDED': 'COMPLETED',
+                      'FAILED': 'FAILED', 'CANCELLED': 'CANCELLED'}[operation['metadata']['state']],
+            'description': self.description,
+        }
+
+    def __repr__(self):
+        return f'<FakeTask {self.description}>'
+
+
+class FakeOperationsEndpoint:
+    """Keeps a set of fake export operations. Every call to `list_operations` (the equivalent of
+    `ee.data.listOperations`) returns the operations of the started tasks in the same format as the EE endpoint, and
+    then moves each one a step closer to its final state: PENDING -> RUNNING (for `n_polls` listings) -> final state.
+    Tasks that were not started are not listed, and their `status` is UNSUBMITTED.
+    Calls are counted in `n_list_calls` and `n_status_calls` so that the number of requests can be checked.
+    """
+
+    def __init__(self, project: str = 'earthengine-legacy'):
+        self.project = project
+        self.operations = {}
+        self.started = set()
+        self.n_list_calls = 0
+        self.n_status_calls = 0
+        self._remaining = {}
+        self._final_state = {}
+        self._ids = itertools.count()
+
+    def submit(self, description: str, n_polls: int = 2, final_state: str = 'SUCCEEDED',
+               start: bool = True) -> FakeTask:
+        task_id = f'FAKE{next(self._ids):020d}'
+        self.operations[task_id] = {
+            'name': f'projects/{self.project}/operations/{task_id}',
+            'metadata': {'state': 'PENDING', 'description': description, 'type': 'EXPORT_IMAGE'},
+        }
+        self._remaining[task_id] = n_polls
+        self._final_state[task_id] = final_state
+        task = FakeTask(self, task_id, description)
+        if start:
+            task.start()
+        return task
+
+    def start(self, task_id: str):
+        self.started.add(task_id)
+        self.operations[task_id]['metadata']['state'] = 'RUNNING'
+
+    def _advance(self):
+        for task_id, operation in self.operations.items():
+            if operation['metadata']['state'] != 'RUNNING':
+                continue
+            if self._remaining[task_id] > 0:
+                self._remaining[task_id] -= 1
+                continue
+            operation['metadata']['state'] = self._final_state[task_id]
+            operation['done'] = True
+            if self._final_state[task_id] == 'FAILED':
+                operation['error'] = {'code': 2, 'message': 'Fake export failure.'}
+
+    def list_operations(self, project=None) -> list:
+        self.n_list_calls += 1
+        listing = [{**op, 'metadata': dict(op['metadata'])} for task_id, op in self.operations.items()
+                   if task_id in self.started]
+        self._advance()
+        return listing
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from fake_ee_operations import FakeOperationsEndpoint
+
+from floodsnet.geetasks import TaskPoller
+
+
+class CountingPoller(TaskPoller):
+    n_sweeps = 0
+
+    def sweep(self) -> list:
+        self.n_sweeps += 1
+        return super().sweep()
+
+
+def test_task_poller_lists_operations_once_per_sweep():
+    endpoint = FakeOperationsEndpoint()
+    tasks = [endpoint.submit(f'task_{i}', n_polls=i) for i in range(20)]
+    tasks.append(endpoint.submit('task_failed', n_polls=3, final_state='FAILED'))
+    completed = []
+    poller = CountingPoller(tasks, on_complete=lambda task, status: completed.append(task), interval=0,
+                            list_operations=endpoint.list_operations)
+    finished = poller.run()
+
+    assert poller.n_sweeps == 21
+    assert endpoint.n_list_calls == poller.n_sweeps
+    assert endpoint.n_status_calls == 0
+    assert set(finished) == set(tasks) and sorted(completed, key=tasks.index) == tasks
+    assert finished[tasks[-1]]['state'] == 'FAILED'
+    assert finished[tasks[-1]]['error_message'] == 'Fake export failure.'
+    assert all(finished[task]['state'] == 'COMPLETED' for task in tasks[:-1])
+
+
+
+def test_task_poller_does_not_wait_on_unsubmitted_tasks():
+    endpoint = FakeOperationsEndpoint()
+    tasks = [endpoint.submit('task_started', n_polls=1), endpoint.submit('task_unsubmitted', start=False)]
+    finished = TaskPoller(tasks, interval=0, list_operations=endpoint.list_operations).run()
+
+    assert finished[tasks[0]]['state'] == 'COMPLETED'
+    assert finished[tasks[1]]['state'] == 'UNSUBMITTED'
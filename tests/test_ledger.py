@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import pytest
+from fake_ee_operations import FakeOperationsEndpoint
+
+from floodsnet.dag import Dag, Node
+from floodsnet.ledger import RunLedger, describe_output
+
+
+def _run(ledger, out_dir, checksum=False):
+    """Runs a two-stage DAG (reproject -> classes) writing a file each, the way `floodsnet.pipeline` does with the
+    ledger: stages that changed since are forgotten first, and the outputs and keys of the stages that ran are
+    recorded."""
+    def stage(name):
+        def func(*deps):
+            fp = out_dir / f'EV_{name}.tif'
+            fp.write_bytes(name.encode())
+            return str(fp)
+        return func
+
+    ledger.forget_changed_stages('usgs')
+    stored_keys = ledger.stage_keys('usgs').get('EV', {})
+    dag = Dag([Node('reproject', stage('reproject')), Node('classes', stage('classes'), deps=['reproject'])])
+    results, keys, ran = dag.run(stored_keys)
+    for name in ran:
+        ledger.forget_stage('usgs', 'EV', name, remove_files=False)
+    ledger.record_outputs('usgs', 'EV', [describe_output(name, results[name], checksum=checksum) for name in ran])
+    ledger.record_stage_keys('usgs', 'EV', {name: keys[name] for name in ran})
+    return ran
+
+
+@pytest.mark.parametrize('checksum', [False, True])
+def test_deleted_output_is_run_again(tmp_path, checksum):
+    with RunLedger(tmp_path / 'ledger.sqlite') as ledger:
+        assert _run(ledger, tmp_path, checksum) == ['reproject', 'classes']
+        assert _run(ledger, tmp_path, checksum) == []
+
+        (tmp_path / 'EV_classes.tif').unlink()
+        assert _run(ledger, tmp_path, checksum) == ['classes']
+        assert (tmp_path / 'EV_classes.tif').exists()
+        assert _run(ledger, tmp_path, checksum) == []
+
+
+def test_changed_output_is_run_again(tmp_path):
+    with RunLedger(tmp_path / 'ledger.sqlite') as ledger:
+        _run(ledger, tmp_path, checksum=True)
+        (tmp_path / 'EV_reproject.tif').write_bytes(b'something else')
+        assert _run(ledger, tmp_path, checksum=True) == ['reproject']
+        assert (tmp_path / 'EV_reproject.tif').read_bytes() == b'reproject'
+
+
+def test_completed_download_without_file_is_forgotten(tmp_path):
+    endpoint = FakeOperationsEndpoint()
+    tasks = {name: endpoint.submit(name, n_polls=n_polls) for name, n_polls in
+             [('synced', 0), ('gone', 0), ('running', 10)]}
+    endpoint.list_operations()  # synced and gone complete
+    (tmp_path / 'synced_S2.tif').write_bytes(b'')
+    with RunLedger(tmp_path / 'ledger.sqlite') as ledger:
+        for name, task in tasks.items():
+            ledger.record_download('usgs', name, 's2', task.id, tmp_path / f'{name}_S2.tif')
+        live = ledger.live_downloads('usgs', list_operations=endpoint.list_operations)
+
+        assert sorted(live) == ['running', 'synced']
+        assert sorted(ledger.downloads('usgs')) == ['running', 'synced']
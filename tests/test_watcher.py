@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from floodsnet.watcher import wait_for_downloads
+
+
+def _downloads(tmp_path) -> list:
+    paths = [tmp_path / 'EV1_S2.tif', tmp_path / 'EV2_bad_S2.tif']
+    for fp in paths:
+        fp.write_bytes(b'data')
+    return [str(fp) for fp in paths]
+
+
+def _validate(fp) -> bool:
+    return 'bad' not in str(fp)
+
+
+def test_invalid_download_raises(tmp_path):
+    paths = _downloads(tmp_path)
+    with pytest.raises(RuntimeError):
+        wait_for_downloads(paths, timeout=0.2, settle=0, validate=_validate)
+
+
+def test_invalid_download_is_left_out(tmp_path):
+    paths = _downloads(tmp_path)
+    ready = wait_for_downloads(paths, timeout=0.2, settle=0, validate=_validate, raise_on_invalid=False)
+    assert ready == {paths[0]: [paths[0]]}